@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+This module guards the folders the on-disk caches are kept in. The caches
+default to folders under ``/tmp``, where any user can create a folder first and
+plant entries in it, so a cache folder is only used if it belongs to the
+current user and nobody else can write to it.
+"""
+
+import os
+import stat
+
+
+def check_private_dir(path: str) -> None:
+    """
+    Checks that a cache folder can be trusted.
+
+    Arguments:
+        path: The path of the folder
+
+    Raises:
+        FileNotFoundError: If the folder does not exist
+        PermissionError: If the folder is a symbolic link, is owned by another user,
+                         or can be written to by other users
+
+    """
+    folder_stat = os.lstat(path)
+    if not stat.S_ISDIR(folder_stat.st_mode):
+        raise PermissionError(f"{path} is not a folder")
+    if folder_stat.st_uid != os.getuid():
+        raise PermissionError(f"{path} is owned by another user")
+    if folder_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise PermissionError(f"{path} can be written to by other users")
+
+
+def make_private_dir(path: str) -> None:
+    """
+    Creates a cache folder only the current user can access, unless it exists,
+    and checks it with ``check_private_dir``.
+
+    Arguments:
+        path: The path of the folder
+
+    Raises:
+        PermissionError: If an existing folder cannot be trusted
+
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    check_private_dir(path)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+This module records how a submission container used the machine, by sampling
+the Docker stats stream while the container runs. The collected metrics are
+written to a JSON file next to the container's log file.
+"""
+
+import json
+import threading
+from typing import Optional
+
+import docker
+
+
+class ContainerMetrics:
+    """
+    Resource usage of a submission container.
+
+    Attributes:
+        pull_seconds: Wall-clock time spent pulling the image
+        start_seconds: Wall-clock time spent creating and starting the container
+        run_seconds: Wall-clock time between the container start and its exit
+        cpu_seconds: Total CPU time used by the container
+        peak_rss_bytes: Highest resident memory (anonymous memory) seen
+        peak_memory_usage_bytes: Highest memory usage (page cache included) seen
+        memory_limit_bytes: The memory limit of the container, as reported by Docker
+        memory_limit_hits: Number of times the memory limit was hit (cgroup v1 only)
+        oom_killed: Whether the container was killed for running out of memory
+        block_read_bytes: Bytes read from block devices
+        block_write_bytes: Bytes written to block devices
+        samples: Number of stats samples taken
+        reattached: Whether the container was started by a previous attempt of the task
+        reused_from: The submission whose memoized outputs were reused, if no container was run
+
+    """
+
+    def __init__(self) -> None:
+        self.pull_seconds: Optional[float] = None
+        self.start_seconds: Optional[float] = None
+        self.run_seconds: Optional[float] = None
+        self.cpu_seconds = 0.0
+        self.peak_rss_bytes = 0
+        self.peak_memory_usage_bytes = 0
+        self.memory_limit_bytes: Optional[int] = None
+        self.memory_limit_hits: Optional[int] = None
+        self.oom_killed = False
+        self.block_read_bytes = 0
+        self.block_write_bytes = 0
+        self.samples = 0
+        self.reattached = False
+        self.reused_from: Optional[str] = None
+
+    def update(self, stats: dict) -> None:
+        """
+        Updates the metrics from one sample of the Docker stats stream.
+        Counters reported by Docker are cumulative, so the highest value seen is kept.
+
+        Arguments:
+            stats: A decoded sample of the Docker stats stream
+
+        """
+        # Samples taken after the container exited are empty
+        cpu_usage = stats.get("cpu_stats", {}).get("cpu_usage", {})
+        memory_stats = stats.get("memory_stats", {})
+        if not cpu_usage and not memory_stats:
+            return
+        self.samples += 1
+
+        # CPU usage is reported in nanoseconds
+        self.cpu_seconds = max(self.cpu_seconds, cpu_usage.get("total_usage", 0) / 1e9)
+
+        # cgroup v1 reports ``rss``, cgroup v2 reports ``anon``
+        memory_detail = memory_stats.get("stats", {})
+        rss = memory_detail.get("rss", memory_detail.get("anon", 0))
+        self.peak_rss_bytes = max(self.peak_rss_bytes, rss)
+        self.peak_memory_usage_bytes = max(
+            self.peak_memory_usage_bytes,
+            memory_stats.get("max_usage", 0),
+            memory_stats.get("usage", 0),
+        )
+        if "limit" in memory_stats:
+            self.memory_limit_bytes = memory_stats["limit"]
+        if "failcnt" in memory_stats:
+            self.memory_limit_hits = max(self.memory_limit_hits or 0, memory_stats["failcnt"])
+
+        # Block I/O is reported per device and operation
+        read_bytes = write_bytes = 0
+        for entry in stats.get("blkio_stats", {}).get("io_service_bytes_recursive") or []:
+            operation = entry.get("op", "").lower()
+            if operation == "read":
+                read_bytes += entry.get("value", 0)
+            elif operation == "write":
+                write_bytes += entry.get("value", 0)
+        self.block_read_bytes = max(self.block_read_bytes, read_bytes)
+        self.block_write_bytes = max(self.block_write_bytes, write_bytes)
+
+    def update_from_attrs(self, attrs: dict) -> None:
+        """
+        Updates the metrics from the container attributes once it has exited.
+
+        Arguments:
+            attrs: The container attributes, i.e. ``container.attrs``
+
+        """
+        self.oom_killed = bool(attrs.get("State", {}).get("OOMKilled", False))
+
+    def to_dict(self) -> dict:
+        """Returns the metrics as a dictionary."""
+        return {
+            "pull_seconds": self.pull_seconds,
+            "start_seconds": self.start_seconds,
+            "run_seconds": self.run_seconds,
+            "cpu_seconds": round(self.cpu_seconds, 3),
+            "peak_rss_bytes": self.peak_rss_bytes,
+            "peak_memory_usage_bytes": self.peak_memory_usage_bytes,
+            "memory_limit_bytes": self.memory_limit_bytes,
+            "memory_limit_hits": self.memory_limit_hits,
+            "oom_killed": self.oom_killed,
+            "block_read_bytes": self.block_read_bytes,
+            "block_write_bytes": self.block_write_bytes,
+            "samples": self.samples,
+            "reattached": self.reattached,
+            "reused_from": self.reused_from,
+        }
+
+    def write(self, metrics_file_path: str) -> None:
+        """
+        Writes the metrics to a JSON file.
+
+        Arguments:
+            metrics_file_path: The path of the JSON file to write
+
+        """
+        with open(metrics_file_path, "w") as metrics_file:
+            metrics_file.write(json.dumps(self.to_dict()))
+        print(f"Metrics file created: {metrics_file_path}")
+
+
+def record_stats(
+    container: docker.models.containers.Container, metrics: ContainerMetrics
+) -> threading.Thread:
+    """
+    Samples the Docker stats stream of the container into ``metrics`` while it
+    runs. The stream ends, and the returned thread finishes, once the container exits.
+
+    Arguments:
+        container: The Docker container to sample
+        metrics: The metrics to update
+
+    Returns:
+        The thread sampling the stats
+
+    """
+
+    def sample_stats():
+        try:
+            for stats in container.stats(stream=True, decode=True):
+                metrics.update(stats)
+        except Exception as e:
+            print(f"Stats sampling interrupted: {e}")
+
+    stats_thread = threading.Thread(target=sample_stats, daemon=True)
+    stats_thread.start()
+
+    return stats_thread
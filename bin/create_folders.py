@@ -13,6 +13,7 @@ from typing import List, Union
 import synapseclient
 
 import helpers
+import synapse_gateway
 
 
 def create_folder(
@@ -112,7 +113,7 @@ def create_folders(
     """
     # Establish access to the Synapse API
     if not syn:
-        syn = synapseclient.login()
+        syn = synapse_gateway.login(silent=False)
 
     # Retrieving Synapse IDs that will be necessary later
     project_id = syn.findEntityId(name=project_name)
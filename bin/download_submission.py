@@ -3,9 +3,10 @@ import os
 import re
 import argparse
 
-import synapseclient
 from synapseclient.core.constants import concrete_types
 
+import synapse_gateway
+
 def get_args():
     """Set up command-line interface and get arguments without any flags."""
     parser = argparse.ArgumentParser()
@@ -44,8 +45,7 @@ if __name__ == "__main__":
     submission_id = args.submission_id
     file_type = args.file_type
 
-    syn = synapseclient.Synapse()
-    syn.login(silent=True)
+    syn = synapse_gateway.login(silent=True)
 
     submission = syn.getSubmission(submission_id, downloadLocation=".")
     entity_type = submission["entity"].concreteType
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Scores many dynamic challenge submissions in one process, e.g. to re-score past
+submissions after a metric fix:
+
+    dynamic_challenge_batch_score.py <manifest> <groundtruth_path> [--output-dir results] [--workers N]
+
+The manifest is a CSV file with a header row, and a ``submission_id`` and a
+``predictions_path`` (the predictions tarball) column. Optional ``status`` and
+``evaluation_id`` columns skip the status check and the Synapse lookup of the
+evaluation ID. Submissions are grouped by evaluation ID, the ground truth
+quantities of each group are computed once, and each submission gets a
+``<output_dir>/<submission_id>/results.json`` file in the format written by
+``dynamic_challenge_score.py``.
+"""
+
+import argparse
+import csv
+import os
+from typing import Dict, List, Optional
+
+import synapseclient
+
+import synapse_gateway
+from dynamic_challenge_score import (
+    INVALID,
+    get_eval_id,
+    precompute_truth_stats,
+    score_submission,
+    update_json,
+)
+
+VALIDATED = "VALIDATED"
+
+
+def get_args():
+    """Set up command-line interface and get arguments."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("manifest", type=str, help="The path to the submissions manifest (CSV)")
+    parser.add_argument(
+        "groundtruth_path", type=str, help="The path to the ground truth folder"
+    )
+    parser.add_argument(
+        "--output-dir",
+        type=str,
+        default="results",
+        help="The folder to write the results.json file of each submission to",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="The number of processes scoring a submission (defaults to the available CPUs)",
+    )
+    parser.add_argument(
+        "--memoize",
+        action="store_true",
+        help="Reuse the scores of identical predictions scored earlier",
+    )
+
+    return parser.parse_args()
+
+
+def read_manifest(manifest_path: str) -> List[dict]:
+    """Read the submissions to score from a manifest.
+
+    Arguments:
+        manifest_path: path to the CSV manifest
+
+    Returns:
+        List of manifest rows, by column name
+    """
+    with open(manifest_path, "r", newline="") as manifest_file:
+        return [
+            {column: (value or "").strip() for column, value in row.items()}
+            for row in csv.DictReader(manifest_file)
+        ]
+
+
+def group_by_evaluation(
+    rows: List[dict], syn: Optional[synapseclient.Synapse] = None
+) -> Dict[str, List[dict]]:
+    """Group the manifest rows by evaluation ID, in the order they first appear.
+
+    Arguments:
+        rows: manifest rows
+        syn: Synapse connection, to look up the evaluation ID of rows without one
+
+    Returns:
+        Dictionary of the manifest rows, by evaluation ID
+    """
+    groups = {}
+    for row in rows:
+        eval_id = row.get("evaluation_id") or get_eval_id(syn, row["submission_id"])
+        groups.setdefault(eval_id, []).append(row)
+
+    return groups
+
+
+def score_batch(
+    manifest_path: str,
+    groundtruth_path: str,
+    output_dir: str = "results",
+    workers: Optional[int] = None,
+    memoize: bool = False,
+) -> Dict[str, str]:
+    """Score every submission of a manifest.
+
+    Arguments:
+        manifest_path: path to the CSV manifest
+        groundtruth_path: path to the groundtruth folder
+        output_dir: folder to write the results.json file of each submission to
+        workers: number of processes scoring a submission. Defaults to the available CPUs.
+        memoize: whether to reuse the scores of identical predictions
+
+    Returns:
+        Dictionary of the score status of each submission, by submission ID
+    """
+    rows = read_manifest(manifest_path)
+
+    # Only log in to Synapse if some evaluation IDs must be looked up
+    syn = None
+    if any(not row.get("evaluation_id") for row in rows):
+        syn = synapse_gateway.login(silent=True)
+
+    score_statuses = {}
+    for eval_id, group in group_by_evaluation(rows, syn).items():
+        print(f"Scoring {len(group)} submissions of evaluation {eval_id}")
+        precompute_truth_stats(groundtruth_path, eval_id)
+
+        for row in group:
+            submission_id = row["submission_id"]
+
+            score_status, result = score_submission(
+                groundtruth_path,
+                row["predictions_path"],
+                eval_id,
+                row.get("status") or VALIDATED,
+                workers=workers,
+                submission_id=submission_id,
+                memoize=memoize,
+            )
+
+            results_path = os.path.join(output_dir, submission_id, "results.json")
+            os.makedirs(os.path.dirname(results_path), exist_ok=True)
+            open(results_path, "a").close()
+            update_json(results_path, result)
+
+            print(f"{submission_id}: {score_status}")
+            score_statuses[submission_id] = score_status
+
+    return score_statuses
+
+
+if __name__ == "__main__":
+    args = get_args()
+    score_statuses = score_batch(
+        args.manifest,
+        args.groundtruth_path,
+        args.output_dir,
+        workers=args.workers,
+        memoize=args.memoize,
+    )
+    scored = sum(status != INVALID for status in score_statuses.values())
+    print(f"Scored {scored} of {len(score_statuses)} submissions")
@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+"""
+Benchmarks the dynamic challenge metrics on synthetic datasets, offline and on
+the CPU only:
+
+    dynamic_challenge_benchmark.py [--repeats 3] [--baseline benchmark_baseline.json] [--save-baseline]
+
+Random ground truth and prediction arrays are generated with the shapes of the
+testing datasets in ``SYNTHETIC_SHAPES`` (override them with
+``--shape SYSTEM=ROWSxCOLUMNS``). The benchmark times each metric on each
+system, with the ground truth quantities computed as part of the metric. It
+also times ``calculate_all_scores`` for each evaluation ID on a synthetic
+predictions tarball, with the ground truth cache filled beforehand, as it is
+when submissions are scored.
+
+Each benchmark reports its best wall time over ``--repeats`` runs and its peak
+memory, as traced by ``tracemalloc`` in one more run (tracing slows allocations
+down, so the timed runs are not traced). This covers the arrays NumPy allocates
+but not pages that are only memory-mapped. ``--save-baseline`` writes the
+results to the baseline file. Otherwise, the results are compared with the
+baseline, and the script exits with status 1 if a benchmark got slower, or
+used more memory, than ``--tolerance`` times its baseline.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+import truth_cache
+from dynamic_challenge_score import (
+    SYSTEM_TO_FORECAST,
+    TASK_MAPPING,
+    calculate_all_scores,
+    forecast,
+    get_true_systems,
+    house_zero_score,
+    precompute_truth_stats,
+    reconstruction,
+)
+
+# (rows, columns) of the synthetic testing datasets: state variables by time steps,
+# except for HouseZero, which has one row per time step and one column per sensor
+SYNTHETIC_SHAPES = {
+    "doublependulum": (4, 10000),
+    "Lorenz": (3, 10000),
+    "Rossler": (3, 10000),
+    "KS": (1024, 1000),
+    "Lorenz96": (100, 1000),
+    "Kolmogorov": (128 * 128, 1000),
+    "HouseZero": (8760, 3),
+}
+
+
+class BenchmarkResult(NamedTuple):
+    seconds: float
+    peak_bytes: int
+
+
+def get_args():
+    """Set up command-line interface and get arguments."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=3,
+        help="The number of timed runs of each benchmark, the best of which is reported",
+    )
+    parser.add_argument(
+        "--baseline",
+        type=str,
+        default="benchmark_baseline.json",
+        help="The path to the baseline results",
+    )
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="Write the results to the baseline file instead of comparing them with it",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1.5,
+        help="The ratio of wall time or peak memory to the baseline above which a benchmark has regressed",
+    )
+    parser.add_argument(
+        "--shape",
+        type=str,
+        action="append",
+        default=[],
+        help="The shape of the testing datasets of a system, e.g. KS=1024x1000 (repeatable)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="The number of processes of calculate_all_scores. Peak memory is only traced with 1.",
+    )
+    parser.add_argument(
+        "--only",
+        type=str,
+        default=None,
+        help="Only run the benchmarks whose name contains this string",
+    )
+
+    return parser.parse_args()
+
+
+def parse_shapes(overrides: List[str]) -> Dict[str, Tuple[int, int]]:
+    """Apply the --shape overrides to the synthetic shapes.
+
+    Arguments:
+        overrides: SYSTEM=ROWSxCOLUMNS strings
+
+    Returns:
+        Dictionary of the dataset shapes, by system
+
+    Raises:
+        ValueError: If an override cannot be parsed, or gives a shape the metrics of the system cannot take
+    """
+    shapes = dict(SYNTHETIC_SHAPES)
+    for override in overrides:
+        system, _, shape = override.partition("=")
+        if system not in shapes:
+            raise ValueError(f"Unknown system {system!r} in --shape {override!r}")
+        rows, _, columns = shape.lower().partition("x")
+        try:
+            shapes[system] = (int(rows), int(columns))
+        except ValueError:
+            raise ValueError(f"Expected ROWSxCOLUMNS in --shape {override!r}") from None
+        check_shape(system, shapes[system])
+
+    return shapes
+
+
+def check_shape(system: str, shape: Tuple[int, int]) -> None:
+    """Check that the metrics of a system can score datasets of a shape.
+
+    Arguments:
+        system: name of the system
+        shape: (rows, columns) of the datasets
+
+    Raises:
+        ValueError: If the metrics cannot take datasets of that shape
+    """
+    rows, columns = shape
+    if rows < 1 or columns < 1:
+        raise ValueError(f"{system} datasets must have at least 1 row and 1 column, not {shape}")
+    if system == "HouseZero":
+        # CO2, room and slab temperatures
+        if columns < 3:
+            raise ValueError(f"HouseZero datasets need at least 3 columns, not {columns}")
+        return
+
+    params = SYSTEM_TO_FORECAST[system]["params"]
+    # The forecast metrics read the first and last k time steps
+    if columns < params["k"]:
+        raise ValueError(
+            f"{system} datasets need at least k={params['k']} columns, not {columns}"
+        )
+    if SYSTEM_TO_FORECAST[system]["function"].__name__ == "ode_forecast" and rows < 3:
+        raise ValueError(f"{system} datasets need at least 3 rows (x, y and z), not {rows}")
+    # Each column is a flattened nf x nf snapshot
+    if "nf" in params and rows != params["nf"] ** 2:
+        raise ValueError(
+            f"{system} datasets need nf^2={params['nf'] ** 2} rows, not {rows}"
+        )
+
+
+def synthetic_array(system: str, shape: Tuple[int, int], seed: int) -> np.ndarray:
+    """Generate a random array in the value range of a system's datasets.
+
+    Arguments:
+        system: name of the system
+        shape: shape of the array
+        seed: seed of the random generator
+
+    Returns:
+        The array
+    """
+    rng = np.random.default_rng(seed)
+    if system == "HouseZero":
+        # CO2 (ppm), room and slab temperatures (degrees C)
+        return rng.normal([600.0, 21.0, 24.0], [150.0, 1.5, 1.0], size=shape)
+    if SYSTEM_TO_FORECAST[system]["function"].__name__ == "ode_forecast":
+        # Spread over the histogram bins of the ODE metric
+        array = rng.normal(0.0, 8.0, size=shape)
+        array[2] = np.abs(array[2]) + 10.0
+        return array
+    return rng.normal(0.0, 1.0, size=shape)
+
+
+def measure(func: Callable[[], object], repeats: int) -> BenchmarkResult:
+    """Time a function, then trace its peak memory in a separate run.
+
+    Arguments:
+        func: the function to benchmark
+        repeats: number of timed runs
+
+    Returns:
+        The best wall time over the timed runs, and the peak memory of the traced run
+    """
+    best_seconds = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        best_seconds = min(best_seconds, time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        func()
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return BenchmarkResult(best_seconds, peak_bytes)
+
+
+def benchmark_metrics(
+    shapes: Dict[str, Tuple[int, int]], repeats: int, only: Optional[str] = None
+) -> Dict[str, BenchmarkResult]:
+    """Benchmark each metric on each system.
+
+    Arguments:
+        shapes: dataset shapes, by system
+        repeats: number of runs of each benchmark
+        only: only run the benchmarks whose name contains this string
+
+    Returns:
+        Dictionary of the results, by benchmark name
+    """
+    metrics = {}
+    for system in list(SYSTEM_TO_FORECAST) + ["HouseZero"]:
+        truth = synthetic_array(system, shapes[system], seed=0)
+        prediction = synthetic_array(system, shapes[system], seed=1)
+
+        if system == "HouseZero":
+            metrics["house_zero_score/HouseZero"] = lambda t=truth, p=prediction: (
+                house_zero_score(t, p)
+            )
+            continue
+        func_name = SYSTEM_TO_FORECAST[system]["function"].__name__
+        metrics[f"{func_name}/{system}"] = lambda t=truth, p=prediction, s=system: (
+            forecast(t, p, s)
+        )
+        metrics[f"reconstruction/{system}"] = lambda t=truth, p=prediction: (
+            reconstruction(t, p)
+        )
+
+    results = {}
+    for name, func in metrics.items():
+        if only and only not in name:
+            continue
+        results[name] = measure(func, repeats)
+        report(name, results[name])
+
+    return results
+
+
+def write_evaluation_data(
+    data_dir: str, evaluation_id: str, shapes: Dict[str, Tuple[int, int]]
+) -> Tuple[str, str]:
+    """Write the synthetic groundtruth folder and predictions tarball of an evaluation.
+
+    Arguments:
+        data_dir: folder to write the data to
+        evaluation_id: id of the evaluation queue
+        shapes: dataset shapes, by system
+
+    Returns:
+        Tuple: path to the groundtruth folder and path to the predictions tarball
+    """
+    groundtruth_path = os.path.join(data_dir, "groundtruth")
+    predictions_path = os.path.join(data_dir, "predictions.tar")
+    os.makedirs(data_dir, exist_ok=True)
+
+    with tarfile.open(predictions_path, "w") as tar_f:
+        for seed, system in enumerate(get_true_systems(evaluation_id)):
+            for prefix, _, _, _ in TASK_MAPPING[evaluation_id]:
+                truth_path = os.path.join(
+                    groundtruth_path, f"Test_{system}/{prefix}test.npy"
+                )
+                os.makedirs(os.path.dirname(truth_path), exist_ok=True)
+                np.save(truth_path, synthetic_array(system, shapes[system], 2 * seed))
+
+                pred_path = os.path.join(data_dir, f"{system}_{prefix}prediction.npy")
+                np.save(pred_path, synthetic_array(system, shapes[system], 2 * seed + 1))
+                tar_f.add(pred_path, arcname=os.path.basename(pred_path))
+                os.remove(pred_path)
+
+    return groundtruth_path, predictions_path
+
+
+def benchmark_evaluations(
+    shapes: Dict[str, Tuple[int, int]],
+    repeats: int,
+    workers: int = 1,
+    only: Optional[str] = None,
+) -> Dict[str, BenchmarkResult]:
+    """Benchmark calculate_all_scores for each evaluation ID.
+
+    Arguments:
+        shapes: dataset shapes, by system
+        repeats: number of runs of each benchmark
+        workers: number of processes of calculate_all_scores
+        only: only run the benchmarks whose name contains this string
+
+    Returns:
+        Dictionary of the results, by benchmark name
+    """
+    results = {}
+    data_dir = tempfile.mkdtemp(prefix="dynamic_challenge_benchmark_")
+    # Keep the synthetic ground truth out of the shared cache
+    cache_dir = truth_cache.set_cache_dir(os.path.join(data_dir, "groundtruth_cache"))
+    try:
+        for evaluation_id in TASK_MAPPING:
+            name = f"calculate_all_scores/{evaluation_id}"
+            if only and only not in name:
+                continue
+
+            eval_dir = os.path.join(data_dir, evaluation_id)
+            groundtruth_path, predictions_path = write_evaluation_data(
+                eval_dir, evaluation_id, shapes
+            )
+            precompute_truth_stats(groundtruth_path, evaluation_id)
+
+            def score(g=groundtruth_path, p=predictions_path, e=evaluation_id):
+                # Read the quantities from the cache on disk, as a new scoring task does
+                truth_cache.clear_memory()
+                return calculate_all_scores(g, p, e, workers=workers)
+
+            results[name] = measure(score, repeats)
+            report(name, results[name])
+            shutil.rmtree(eval_dir)
+    finally:
+        truth_cache.set_cache_dir(cache_dir)
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    return results
+
+
+def report(name: str, result: BenchmarkResult) -> None:
+    """Print the result of a benchmark."""
+    print(
+        f"{name:<40} {result.seconds * 1000:>10.1f} ms {result.peak_bytes / 1024**2:>10.1f} MiB"
+    )
+
+
+def compare_with_baseline(
+    results: Dict[str, BenchmarkResult], baseline: dict, tolerance: float
+) -> List[str]:
+    """Find the benchmarks that got slower, or used more memory, than their baseline.
+
+    Arguments:
+        results: benchmark results, by name
+        baseline: baseline results, by name, as written by --save-baseline
+        tolerance: ratio to the baseline above which a benchmark has regressed
+
+    Returns:
+        List of the regressions found
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        baseline_seconds = baseline[name]["seconds"]
+        if result.seconds > tolerance * baseline_seconds:
+            regressions.append(
+                f"{name}: {result.seconds * 1000:.1f} ms, baseline {baseline_seconds * 1000:.1f} ms"
+            )
+        baseline_bytes = baseline[name]["peak_bytes"]
+        if result.peak_bytes > tolerance * baseline_bytes:
+            regressions.append(
+                f"{name}: {result.peak_bytes / 1024**2:.1f} MiB, "
+                f"baseline {baseline_bytes / 1024**2:.1f} MiB"
+            )
+    return regressions
+
+
+if __name__ == "__main__":
+    args = get_args()
+    try:
+        shapes = parse_shapes(args.shape)
+    except ValueError as e:
+        raise SystemExit(f"Error: {e}")
+
+    print(f"{'benchmark':<40} {'wall time':>13} {'peak memory':>14}")
+    results = benchmark_metrics(shapes, args.repeats, args.only)
+    results.update(
+        benchmark_evaluations(shapes, args.repeats, args.workers, args.only)
+    )
+
+    if args.save_baseline:
+        baseline = {
+            "shapes": {system: list(shape) for system, shape in shapes.items()},
+            "workers": args.workers,
+            "results": {name: result._asdict() for name, result in results.items()},
+        }
+        with open(args.baseline, "w") as o:
+            o.write(json.dumps(baseline, indent=2))
+        print(f"Saved the baseline to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, "r") as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get("shapes") != {s: list(shape) for s, shape in shapes.items()}:
+            print("Warning: the baseline was measured on datasets of other shapes")
+        if baseline.get("workers") != args.workers:
+            print("Warning: the baseline was measured with another number of workers")
+        regressions = compare_with_baseline(
+            results, baseline["results"], args.tolerance
+        )
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            raise SystemExit(1)
+        print(f"No regression against {args.baseline}")
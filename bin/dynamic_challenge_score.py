@@ -1,19 +1,34 @@
 #!/usr/bin/env python3
 
 import argparse
+import contextlib
+import functools
 import json
+import multiprocessing
 import os
+import sys
 import typing
 
 import tarfile
 import numpy as np
-from typing import Tuple, List
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
 import synapseclient
 
+import metadata_cache
+import npy_tar
+import result_memo
+import synapse_gateway
+import truth_cache
+from spectral_norm import spectral_norm
+
 
 INVALID = "INVALID"
 SCORED = "SCORED"
 
+# The environment variables capping the threads of the BLAS libraries NumPy may use
+BLAS_THREADS_VARIABLES = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS")
+
 
 def get_args():
     """Set up command-line interface and get arguments without any flags."""
@@ -33,6 +48,17 @@ def get_args():
         default="results.json",
         help="The path to output file",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="The number of processes scoring the predictions (defaults to the available CPUs)",
+    )
+    parser.add_argument(
+        "--memoize",
+        action="store_true",
+        help="Reuse the scores of identical predictions scored earlier",
+    )
 
     return parser.parse_args()
 
@@ -52,50 +78,70 @@ def tar(directory: str, tar_filename: str) -> None:
         os.chdir(original_dir)
 
 
-def untar(directory: str, tar_filename: str, pattern="*") -> None:
-    """Untar a tar file into a directory
+# Histogram bins of the ODE metric, for the x/y and z coordinates
+ODE_BINS_XY = np.arange(-20, 21, 1)
+ODE_BINS_Z = np.arange(0, 51, 1)
+
+
+def ode_truth_stats(truth: np.ndarray, k: int, modes: int) -> dict:
+    """Compute the groundtruth-only quantities of the ODE metric.
 
     Arguments:
-        directory: Path to directory to untar files
-        tar_filename:  tar file path
-        pattern: pattern to match
+        truth: groundtruth data
+        k: number of time steps
+        modes: number of modes to use
+
+    Returns:
+        Dictionary with the norm of the first k time steps and the x, y and z histograms
     """
-    with tarfile.open(tar_filename, "r") as tar_f:
-        for member in tar_f.getmembers():
-            if member.isfile() and member.name.endswith(pattern):
-                member.name = os.path.basename(member.name)
-                tar_f.extract(member, path=directory)
+    yt = truth[-modes:, :]
+    yhistxt, _ = np.histogram(yt[0, :], bins=ODE_BINS_XY)
+    yhistyt, _ = np.histogram(yt[1, :], bins=ODE_BINS_XY)
+    yhistzt, _ = np.histogram(yt[2, :], bins=ODE_BINS_Z)
+
+    return {
+        "norm": spectral_norm(truth[:, 0:k]),
+        "hist_x": yhistxt,
+        "hist_y": yhistyt,
+        "hist_z": yhistzt,
+    }
 
 
 def ode_forecast(
-    truth: np.ndarray, prediction: np.ndarray, k: int, modes: int
+    truth: np.ndarray,
+    prediction: np.ndarray,
+    k: int,
+    modes: int,
+    truth_stats: Optional[dict] = None,
 ) -> Tuple[float, float]:
     """Produce long-time and short-time error scores using ODE metric.
 
+    Only the first k columns and the last ``modes`` rows of the arrays are read,
+    so memory-mapped arrays are only partly loaded.
+
     Arguments:
         truth: groundtruth data
         prediction: predicted data
         k: number of time steps
         modes: number of modes to use
+        truth_stats: the output of ``ode_truth_stats``, computed if not given
 
     Returns:
         Tuple of long-time and short-time error scores
     """
-    est = np.linalg.norm(truth[:, 0:k] - prediction[:, 0:k], 2) / np.linalg.norm(
-        truth[:, 0:k], 2
-    )
+    if truth_stats is None:
+        truth_stats = ode_truth_stats(truth, k, modes)
 
-    yt = truth[-modes:, :]
-    M = np.arange(-20, 21, 1)
-    M2 = np.arange(0, 51, 1)
-    yhistxt, _ = np.histogram(yt[0, :], bins=M)
-    yhistyt, _ = np.histogram(yt[1, :], bins=M)
-    yhistzt, _ = np.histogram(yt[2, :], bins=M2)
+    est = spectral_norm(truth[:, 0:k] - prediction[:, 0:k]) / truth_stats["norm"]
+
+    yhistxt = truth_stats["hist_x"]
+    yhistyt = truth_stats["hist_y"]
+    yhistzt = truth_stats["hist_z"]
 
     yp = prediction[-modes:, :]
-    yhistxp, _ = np.histogram(yp[0, :], bins=M)
-    yhistyp, _ = np.histogram(yp[1, :], bins=M)
-    yhistzp, _ = np.histogram(yp[2, :], bins=M2)
+    yhistxp, _ = np.histogram(yp[0, :], bins=ODE_BINS_XY)
+    yhistyp, _ = np.histogram(yp[1, :], bins=ODE_BINS_XY)
+    yhistzp, _ = np.histogram(yp[2, :], bins=ODE_BINS_Z)
 
     norm_yhistxt = np.linalg.norm(yhistxt, 2)
     eltx = (
@@ -121,50 +167,84 @@ def ode_forecast(
     return e1, e2
 
 
+def log_power_spectra(snapshots: np.ndarray, modes: int) -> np.ndarray:
+    """Compute the log power spectra of snapshots, around the zero frequency.
+
+    Arguments:
+        snapshots: one snapshot per column
+        modes: number of modes to keep on each side of the zero frequency
+
+    Returns:
+        Array of shape (2 * modes + 1, number of snapshots), ordered from
+        frequency -modes to +modes, i.e. as in the ``np.fft.fftshift``-ed spectra
+    """
+    m = snapshots.shape[0]
+    window = np.arange(-modes, modes + 1) % m
+    amplitude = np.abs(np.fft.fft(snapshots, axis=0)[window])
+
+    return np.log(np.multiply(amplitude, amplitude))
+
+
+def pde_truth_stats(truth: np.ndarray, k: int, modes: int) -> dict:
+    """Compute the groundtruth-only quantities of the PDE metric.
+
+    Arguments:
+        truth: groundtruth data
+        k: number of time steps
+        modes: number of modes to use
+
+    Returns:
+        Dictionary with the norm of the first k time steps, and the log power
+        spectra of the last k time steps and their norm
+    """
+    [_, n] = truth.shape
+    columns = n - np.arange(1, k + 1)
+    pt = log_power_spectra(truth[:, columns], modes)
+
+    return {
+        "norm": spectral_norm(truth[:, 0:k]),
+        "log_power": pt,
+        "log_power_norm": spectral_norm(pt),
+    }
+
+
 def pde_forecast(
-    truth: np.ndarray, prediction: np.ndarray, k: int, modes: int
+    truth: np.ndarray,
+    prediction: np.ndarray,
+    k: int,
+    modes: int,
+    truth_stats: Optional[dict] = None,
 ) -> Tuple[float, float]:
     """Produce long-time and short-time error scores using PDE metric.
 
+    Only the first k and the last k columns of the arrays are read, so
+    memory-mapped arrays are only partly loaded.
+
     Arguments:
         truth: groundtruth data
         prediction: predicted data
         k: number of time steps
         modes: number of modes to use
+        truth_stats: the output of ``pde_truth_stats``, computed if not given
 
     Returns:
         Tuple of long-time and short-time error scores
     """
-    [m, n] = truth.shape
-    est = np.linalg.norm(truth[:, 0:k] - prediction[:, 0:k], 2) / np.linalg.norm(
-        truth[:, 0:k], 2
-    )
+    if truth_stats is None:
+        truth_stats = pde_truth_stats(truth, k, modes)
 
-    m2 = 2 * modes + 1
-    pt = np.empty((m2, 0))
-    pp = np.empty((m2, 0))
+    [_, n] = truth.shape
+    est = spectral_norm(truth[:, 0:k] - prediction[:, 0:k]) / truth_stats["norm"]
 
     # LONG TIME:  Compute least-square fit to power spectra
-    for j in range(1, k + 1):
-        p_truth = np.multiply(
-            np.abs(np.fft.fft(truth[:, n - j])
-                   ), np.abs(np.fft.fft(truth[:, n - j]))
-        )
-        p_prediction = np.multiply(
-            np.abs(np.fft.fft(prediction[:, n - j])),
-            np.abs(np.fft.fft(prediction[:, n - j])),
-        )
-        pt3 = np.fft.fftshift(p_truth)
-        pp3 = np.fft.fftshift(p_prediction)
-        ptnew = pt3[int(m / 2) - modes: int(m / 2) + modes + 1]
-        ppnew = pp3[
-            int(m / 2) - modes: int(m / 2) + modes + 1
-        ]  # Fixed the variable name
-
-        pt = np.column_stack((pt, np.log(ptnew)))
-        pp = np.column_stack((pp, np.log(ppnew)))
+    # The last k time steps (latest first) are transformed in one batched FFT along
+    # axis 0, and only the 2 * modes + 1 frequencies around zero are kept. The complex
+    # FFT is used rather than ``np.fft.rfft``, which does not give bit-identical spectra.
+    columns = n - np.arange(1, k + 1)
+    pt = truth_stats["log_power"]
+    pp = log_power_spectra(prediction[:, columns], modes)
 
-    elt = np.linalg.norm(pt - pp, 2) / np.linalg.norm(pt, 2)
+    elt = spectral_norm(pt - pp) / truth_stats["log_power_norm"]
 
     e1 = 100 * (1 - est)
     e2 = 100 * (1 - elt)
@@ -172,213 +252,613 @@ def pde_forecast(
     return e1, e2
 
 
+def fourier_coefficients(snapshots: np.ndarray, nf: int, frequency: int) -> np.ndarray:
+    """Compute the DFT along the second axis of 2D snapshots, at a single frequency.
+
+    Arguments:
+        snapshots: one flattened (Fortran order) nf x nf snapshot per column
+        nf: number of frequencies
+        frequency: the frequency to evaluate the DFT at
+
+    Returns:
+        Array of shape (nf, number of snapshots), equal to column ``frequency`` of
+        the ``np.fft.fft`` along the second axis of each snapshot
+    """
+    grids = snapshots.reshape((nf, nf, -1), order="F")
+    twiddle = np.exp(-2j * np.pi * frequency * np.arange(nf) / nf)
+
+    # One matrix product for all the snapshots, run by the (multi-threaded) BLAS
+    return np.tensordot(grids, twiddle, axes=([1], [0]))
+
+
+def pde_2d_truth_stats(truth: np.ndarray, k: int, modes: int, nf: int) -> dict:
+    """Compute the groundtruth-only quantities of the PDE metric on 2D datasets.
+
+    Arguments:
+        truth: groundtruth data
+        k: number of time steps
+        modes: number of modes to use
+        nf: number of frequencies
+
+    Returns:
+        Dictionary with the norm of the first k time steps, and the log power
+        spectra of the last k time steps and their norm
+    """
+    [_, n] = truth.shape
+    columns = n - np.arange(1, k + 1)
+    frequency = int(nf / 2) + 1
+    pt = log_power_spectra(fourier_coefficients(truth[:, columns], nf, frequency), modes)
+
+    return {
+        "norm": spectral_norm(truth[:, 0:k]),
+        "log_power": pt,
+        "log_power_norm": spectral_norm(pt),
+    }
+
+
 def pde_forecast_2d(
-    truth: np.ndarray, prediction: np.ndarray, k: int, modes: int, nf: int
+    truth: np.ndarray,
+    prediction: np.ndarray,
+    k: int,
+    modes: int,
+    nf: int,
+    truth_stats: Optional[dict] = None,
 ) -> Tuple[float, float]:
     """Produce long-time and short-time error scores on 2D dataset using PDE metric.
 
+    Only the first k and the last k columns of the arrays are read, so
+    memory-mapped arrays are only partly loaded.
+
     Arguments:
         truth: comparison data
         prediction: predicted data
         k: number of time steps
         modes: number of modes to use
         nf: number of frequencies
+        truth_stats: the output of ``pde_2d_truth_stats``, computed if not given
 
     Returns:
         Tuple of long-time and short-time error scores
     """
-    [_, n] = truth.shape
-    est = np.linalg.norm(truth[:, 0:k] - prediction[:, 0:k], 2) / np.linalg.norm(
-        truth[:, 0:k], 2
-    )
+    if truth_stats is None:
+        truth_stats = pde_2d_truth_stats(truth, k, modes, nf)
 
-    m2 = 2 * modes + 1
-    pt = np.empty((m2, 0))
-    pp = np.empty((m2, 0))
+    [_, n] = truth.shape
+    est = spectral_norm(truth[:, 0:k] - prediction[:, 0:k]) / truth_stats["norm"]
 
     # LONG TIME:  Compute least-square fit to power spectra
-    for j in range(1, k + 1):
-        truth_fft = np.abs(np.fft.fft2(
-            truth[:, n - j].reshape((nf, nf), order="F")))
-        prediction_fft = np.abs(
-            np.fft.fft2(prediction[:, n - j].reshape((nf, nf), order="F"))
-        )
-        p_truth = np.multiply(truth_fft, truth_fft)
-        p_prediction = np.multiply(prediction_fft, prediction_fft)
-        #        P_truth = np.multiply(np.abs(np.fft.fft(truth[:, n-j])), np.abs(np.fft.fft(truth[:, n-j])))
-        #        P_prediction = np.multiply(np.abs(np.fft.fft(prediction[:, n-j])), np.abs(np.fft.fft(prediction[:, n-j])))
-        pt3 = np.fft.fftshift(p_truth[:, int(nf / 2) + 1])
-        pp3 = np.fft.fftshift(p_prediction[:, int(nf / 2) + 1])
-
-        ptnew = pt3[int(nf / 2) - modes: int(nf / 2) + modes + 1]
-        # Fixed the variable name
-        ppnew = pp3[int(nf / 2) - modes: int(nf / 2) + modes + 1]
-
-        pt = np.column_stack((pt, np.log(ptnew)))
-        pp = np.column_stack((pp, np.log(ppnew)))
+    # Only column nf/2+1 of the 2D spectrum of each snapshot is used, so the DFT along
+    # the second axis is only evaluated at that frequency, for the last k time steps
+    # at once, before the batched FFT along the first axis
+    columns = n - np.arange(1, k + 1)
+    frequency = int(nf / 2) + 1
+    pt = truth_stats["log_power"]
+    pp = log_power_spectra(
+        fourier_coefficients(prediction[:, columns], nf, frequency), modes
+    )
 
-    elt = np.linalg.norm(pt - pp, 2) / np.linalg.norm(pt, 2)
+    elt = spectral_norm(pt - pp) / truth_stats["log_power_norm"]
     e1 = 100 * (1 - est)
     e2 = 100 * (1 - elt)
 
     return e1, e2
 
 
-def forecast(truth: np.ndarray, prediction: np.ndarray, system: str) -> List[float]:
+SYSTEM_TO_FORECAST = {
+    "doublependulum": {
+        "function": ode_forecast,
+        "truth_stats": ode_truth_stats,
+        "params": {"k": 20, "modes": 1000},
+    },
+    "Lorenz": {
+        "function": ode_forecast,
+        "truth_stats": ode_truth_stats,
+        "params": {"k": 20, "modes": 1000},
+    },
+    "Rossler": {
+        "function": ode_forecast,
+        "truth_stats": ode_truth_stats,
+        "params": {"k": 20, "modes": 1000},
+    },
+    "KS": {
+        "function": pde_forecast,
+        "truth_stats": pde_truth_stats,
+        "params": {"k": 20, "modes": 100},
+    },
+    "Lorenz96": {
+        "function": pde_forecast,
+        "truth_stats": pde_truth_stats,
+        "params": {"k": 20, "modes": 30},
+    },
+    "Kolmogorov": {
+        "function": pde_forecast_2d,
+        "truth_stats": pde_2d_truth_stats,
+        "params": {"k": 20, "modes": 30, "nf": 128},
+    },
+}
+
+
+def forecast(
+    truth: np.ndarray,
+    prediction: np.ndarray,
+    system: str,
+    truth_stats: Optional[dict] = None,
+) -> List[float]:
     """Forecast scores.
 
     Arguments:
         truth: groundtruth data
         prediction: predicted data
         system: name of the system
+        truth_stats: the groundtruth-only quantities of the system's metric, computed if not given
 
     Returns:
         List of forecast scores
     """
-
-    system_to_forecast = {
-        "doublependulum": {
-            "function": ode_forecast,
-            "params": {"k": 20, "modes": 1000},
-        },
-        "Lorenz": {"function": ode_forecast, "params": {"k": 20, "modes": 1000}},
-        "Rossler": {"function": ode_forecast, "params": {"k": 20, "modes": 1000}},
-        "KS": {"function": pde_forecast, "params": {"k": 20, "modes": 100}},
-        "Lorenz96": {"function": pde_forecast, "params": {"k": 20, "modes": 30}},
-        "Kolmogorov": {
-            "function": pde_forecast_2d,
-            "params": {"k": 20, "modes": 30, "nf": 128},
-        },
-    }
-
-    if system in system_to_forecast:
-        forecast_func = system_to_forecast[system]["function"]
-        forecast_params = system_to_forecast[system]["params"]
-        scores = forecast_func(truth, prediction, **forecast_params)
+    if system in SYSTEM_TO_FORECAST:
+        forecast_func = SYSTEM_TO_FORECAST[system]["function"]
+        forecast_params = SYSTEM_TO_FORECAST[system]["params"]
+        scores = forecast_func(
+            truth, prediction, truth_stats=truth_stats, **forecast_params
+        )
         return list(scores)
     else:
         return []
 
 
-def reconstruction(truth: np.ndarray, prediction: np.ndarray) -> float:
+def reconstruction_truth_stats(truth: np.ndarray) -> dict:
+    """Compute the groundtruth-only quantities of the reconstruction metric.
+
+    Arguments:
+        truth: groundtruth data
+
+    Returns:
+        Dictionary with the norm of the groundtruth
+    """
+    return {"norm": spectral_norm(truth)}
+
+
+def reconstruction(
+    truth: np.ndarray, prediction: np.ndarray, truth_stats: Optional[dict] = None
+) -> float:
     """Produce reconstruction fit score.
 
     Arguments:
         truth: groundtruth data
         prediction: predicted data
+        truth_stats: the output of ``reconstruction_truth_stats``, computed if not given
 
     Returns:
         e1: reconstruction fit score
     """
-    est = np.linalg.norm(truth - prediction, 2) / np.linalg.norm(truth, 2)
+    if truth_stats is None:
+        truth_stats = reconstruction_truth_stats(truth)
+
+    est = spectral_norm(truth - prediction) / truth_stats["norm"]
 
     e1 = 100 * (1 - est)
 
     return e1
 
 
-def house_zero_score(truth: np.ndarray, prediction: np.ndarray) -> Tuple[float, float, float]:
+def house_zero_truth_stats(truth: np.ndarray) -> dict:
+    '''Compute the groundtruth-only quantities of the HouseZero metric: the norms
+    of the squared CO2, room and slab temperatures.'''
+    return {
+        "norms": np.array([np.linalg.norm(truth[:, i]**2) for i in range(3)])
+    }
+
+
+def house_zero_score(
+    truth: np.ndarray, prediction: np.ndarray, truth_stats: Optional[dict] = None
+) -> Tuple[float, float, float]:
     '''Produce errors for the HouseZero model.'''
+    if truth_stats is None:
+        truth_stats = house_zero_truth_stats(truth)
+    norms = truth_stats["norms"]
+
     error_room_temp = 100 * \
         (1 - np.linalg.norm((prediction[:, 1] -
-         truth[:, 1])**2)/np.linalg.norm(truth[:, 1]**2))
+         truth[:, 1])**2)/norms[1])
 
     error_slab_temp = 100 * \
         (1 - np.linalg.norm((prediction[:, 2] -
-         truth[:, 2])**2)/np.linalg.norm(truth[:, 2]**2))
+         truth[:, 2])**2)/norms[2])
 
     error_co2 = 100 * \
         (1 - np.linalg.norm((prediction[:, 0] -
-         truth[:, 0])**2)/np.linalg.norm(truth[:, 0]**2))
+         truth[:, 0])**2)/norms[0])
     return error_room_temp, error_slab_temp, error_co2
 
 
+def get_cgroup_cpu_limit() -> Optional[float]:
+    """Get the CPU quota of the container this process runs in, from its cgroup.
+
+    Returns:
+        The number of CPUs the quota allows, or None if the CPU time is not limited
+    """
+    # cgroup v2, then cgroup v1
+    try:
+        with open("/sys/fs/cgroup/cpu.max", "r") as cpu_max:
+            quota, period = cpu_max.read().split()[:2]
+        return None if quota == "max" else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us", "r") as cfs_quota:
+            quota = int(cfs_quota.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us", "r") as cfs_period:
+            period = int(cfs_period.read())
+        return None if quota <= 0 else quota / period
+    except (OSError, ValueError):
+        return None
+
+
+def get_available_cpus() -> int:
+    """Get the number of CPUs allocated to the task: the lowest of ``SCORING_CPUS``
+    (exported by the SCORE process as the task's ``cpus``), the CPU quota of the
+    container and the CPUs this process may run on. Docker containers started by
+    Nextflow are only given CPU shares, which do not limit the CPUs a process sees.
+
+    Returns:
+        The number of CPUs, at least 1
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+
+    cgroup_cpus = get_cgroup_cpu_limit()
+    if cgroup_cpus is not None:
+        cpus = min(cpus, int(cgroup_cpus))
+    if os.environ.get("SCORING_CPUS"):
+        cpus = min(cpus, int(float(os.environ["SCORING_CPUS"])))
+
+    return max(cpus, 1)
+
+
+@contextlib.contextmanager
+def single_blas_thread_environment() -> typing.Iterator[None]:
+    """Cap the BLAS threads of the processes started in this context to one each, unless
+    the environment sets a cap already. BLAS reads the cap when NumPy is imported, so it
+    does not change the threads of this process.
+    """
+    previous = {variable: os.environ.get(variable) for variable in BLAS_THREADS_VARIABLES}
+    for variable in BLAS_THREADS_VARIABLES:
+        os.environ.setdefault(variable, "1")
+    try:
+        yield
+    finally:
+        for variable, value in previous.items():
+            if value is None:
+                os.environ.pop(variable, None)
+
+
+def get_pool_context() -> multiprocessing.context.BaseContext:
+    """Get the context the scoring pool starts its processes in.
+
+    The processes are forked from a server process that imports NumPy with one BLAS thread
+    (see ``single_blas_thread_environment``), since the pool already runs one process per
+    CPU. Forked from this process, they would inherit its BLAS threads, and an initializer
+    would run after NumPy is imported. The server preloads the scoring code, so the
+    processes start quickly.
+
+    Returns:
+        the multiprocessing context
+    """
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(sorted({"__main__", __name__}))
+    return context
+
+
+TASK_MAPPING = {
+    "9615379": [("X1", "forecast", ["stf_E1", "ltf_E2"], [0, 1])],  # Task1
+    "9615532": [  # Task2
+        ("X2", "reconstruction", ["recon_E3"], [0]),
+        ("X3", "forecast", ["ltf_E4"], [1]),
+        ("X4", "reconstruction", ["recon_E5"], [0]),
+        ("X5", "forecast", ["ltf_E6"], [1]),
+    ],
+    "9615534": [("X6", "forecast", ["stf_E7", "ltf_E8"], [0, 1])],  # Task3
+    "9615535": [  # Task4
+        ("X7", "forecast", ["stf_E9", "ltf_E10"], [0, 1]),
+        ("X8", "reconstruction", ["recon_E11"], [0]),
+        ("X9", "reconstruction", ["recon_E12"], [0]),
+    ],
+    "9615601": [  # Task5
+        ("X21", "HouseZeroScore", [
+         "rt_E21", "st_E21", "co2_E21"], [0, 1, 2]),
+        ("X74", "HouseZeroScore", [
+         "rt_E74", "st_E74", "co2_E74"], [0, 1, 2]),
+    ]
+}
+
+
+def get_true_systems(evaluation_id: str) -> List[str]:
+    """Get the systems scored for an evaluation queue.
+
+    Arguments:
+        evaluation_id: id of the evaluation queue
+
+    Returns:
+        List of system names
+    """
+    if evaluation_id == "9615601":
+        return ["HouseZero"]
+    return ["doublependulum", "Lorenz", "Rossler", "Lorenz96", "KS", "Kolmogorov"]
+
+
+@functools.lru_cache(maxsize=None)
+def get_truth_stats_code_version() -> str:
+    """Get the version of the code computing the groundtruth-only quantities, to key the
+    groundtruth cache with.
+
+    Returns:
+        the digest of this module and of the spectral norm module
+    """
+    return result_memo.code_version(
+        [__file__, sys.modules[spectral_norm.__module__].__file__]
+    )
+
+
+def get_truth_stats(
+    truth_path: str, truth: np.ndarray, score_metric: str, system: str
+) -> Optional[dict]:
+    """Get the groundtruth-only quantities of a metric, from the groundtruth cache if possible.
+
+    Arguments:
+        truth_path: path to the groundtruth array
+        truth: groundtruth data
+        score_metric: "forecast", "reconstruction" or "HouseZeroScore"
+        system: name of the system
+
+    Returns:
+        dictionary containing the quantities, or None if the system has no forecast metric
+    """
+    if score_metric == "forecast":
+        if system not in SYSTEM_TO_FORECAST:
+            return None
+        stats_func = SYSTEM_TO_FORECAST[system]["truth_stats"]
+        params = SYSTEM_TO_FORECAST[system]["params"]
+    elif score_metric == "reconstruction":
+        stats_func, params = reconstruction_truth_stats, {}
+    else:
+        stats_func, params = house_zero_truth_stats, {}
+
+    return truth_cache.get_truth_stats(
+        truth_path,
+        stats_func.__name__,
+        params,
+        lambda: stats_func(truth, **params),
+        code_version=get_truth_stats_code_version(),
+    )
+
+
+def precompute_truth_stats(groundtruth_path: str, evaluation_id: str) -> int:
+    """Fill the groundtruth cache with the quantities of every testing dataset of a task.
+
+    Arguments:
+        groundtruth_path: path to the groundtruth folder
+        evaluation_id: id of the evaluation queue
+
+    Returns:
+        Number of testing datasets processed
+    """
+    processed = 0
+    for system in get_true_systems(evaluation_id):
+        for prefix, score_metric, _, _ in TASK_MAPPING.get(evaluation_id, []):
+            truth_path = os.path.join(
+                groundtruth_path, f"Test_{system}/{prefix}test.npy"
+            )
+            if os.path.exists(truth_path):
+                truth = np.load(truth_path, mmap_mode="r")
+                get_truth_stats(truth_path, truth, score_metric, system)
+                del truth
+                processed += 1
+
+    return processed
+
+
+def score_pair(
+    system: str,
+    score_metric: str,
+    score_keys: List[str],
+    score_indices: List[int],
+    truth_path: str,
+    pred_path: str,
+    pred_member: Optional[npy_tar.NpyMember] = None,
+) -> dict:
+    """Score the prediction of one system for one testing dataset.
+
+    Arguments:
+        system: name of the system
+        score_metric: "forecast", "reconstruction" or "HouseZeroScore"
+        score_keys: names of the scores to report
+        score_indices: indices of the reported scores among the metric's scores
+        truth_path: path to the groundtruth array
+        pred_path: path to the predicted array, or to the predictions tarball
+        pred_member: the member of the predictions tarball holding the predicted array
+
+    Returns:
+        dictionary containing the scores of the pair
+    """
+    # Memory-map the arrays, so only the slices a metric reads are loaded
+    truth = np.load(truth_path, mmap_mode="r")
+    if pred_member is None:
+        pred = np.load(pred_path, mmap_mode="r")
+    else:
+        pred = npy_tar.load_member(pred_path, pred_member)
+    truth_stats = get_truth_stats(truth_path, truth, score_metric, system)
+
+    if score_metric == "forecast":
+        scores = forecast(truth, pred, system, truth_stats=truth_stats)
+    elif score_metric == "reconstruction":
+        scores = (reconstruction(truth, pred, truth_stats=truth_stats),)
+    else:
+        scores = house_zero_score(truth, pred, truth_stats=truth_stats)
+
+    return {
+        f"{system}_{key}": scores[index] for key, index in zip(score_keys, score_indices)
+    }
+
+
 def calculate_all_scores(
-    groundtruth_path: str, predictions_path: str, evaluation_id: str
+    groundtruth_path: str,
+    predictions_path: str,
+    evaluation_id: str,
+    workers: Optional[int] = None,
 ) -> dict:
     """Calculate scores across all testing datasets.
 
+    The (system, testing dataset) pairs are independent, and are scored in a
+    pool of ``workers`` processes.
+
     Arguments:
         groundtruth_path: path to the groundtruth folder
-        predictions_path: path to the predictions file
+        predictions_path: path to the predictions tarball, or to a folder of predicted arrays
         evaluation_id: id of the evaluation queue
+        workers: number of processes scoring pairs. Defaults to the available CPUs.
 
     Returns:
         score_result: dictionary containing scores
     """
     score_result = {}
-    task_mapping = {
-        "9615379": [("X1", "forecast", ["stf_E1", "ltf_E2"], [0, 1])],  # Task1
-        "9615532": [  # Task2
-            ("X2", "reconstruction", ["recon_E3"], [0]),
-            ("X3", "forecast", ["ltf_E4"], [1]),
-            ("X4", "reconstruction", ["recon_E5"], [0]),
-            ("X5", "forecast", ["ltf_E6"], [1]),
-        ],
-        "9615534": [("X6", "forecast", ["stf_E7", "ltf_E8"], [0, 1])],  # Task3
-        "9615535": [  # Task4
-            ("X7", "forecast", ["stf_E9", "ltf_E10"], [0, 1]),
-            ("X8", "reconstruction", ["recon_E11"], [0]),
-            ("X9", "reconstruction", ["recon_E12"], [0]),
-        ],
-        "9615601": [  # Task5
-            ("X21", "HouseZeroScore", [
-             "rt_E21", "st_E21", "co2_E21"], [0, 1, 2]),
-            ("X74", "HouseZeroScore", [
-             "rt_E74", "st_E74", "co2_E74"], [0, 1, 2]),
-        ]
-    }
 
     # get mapping of inputs and outs for specific task
-    task_info = task_mapping.get(evaluation_id)
+    task_info = TASK_MAPPING.get(evaluation_id)
 
-    # get unique systems
-    pred_files = os.listdir(predictions_path)
-    pred_systems = list(set(f.split("_")[0] for f in pred_files))
-    if evaluation_id == "9615601":
-        true_systems = ["HouseZero"]
+    # the predicted arrays are read straight from the tarball, without extracting it
+    if os.path.isdir(predictions_path):
+        predictions = contextlib.nullcontext(predictions_path)
     else:
-        true_systems = ["doublependulum", "Lorenz",
-                        "Rossler", "Lorenz96", "KS", "Kolmogorov"]
-    unique_systems = list(set(true_systems) & set(pred_systems))
+        # a compressed tarball is decompressed once, so its arrays can be memory-mapped too
+        predictions = npy_tar.uncompressed_tar(predictions_path)
+    with predictions as predictions_path:
+        if os.path.isdir(predictions_path):
+            pred_members = {f: None for f in os.listdir(predictions_path)}
+        else:
+            pred_members = npy_tar.index_tar(predictions_path, pattern=".npy")
+
+        # get unique systems
+        pred_files = list(pred_members)
+        pred_systems = list(set(f.split("_")[0] for f in pred_files))
+        true_systems = get_true_systems(evaluation_id)
+        # sorted, so that the pairs are always scored and merged in the same order
+        unique_systems = sorted(set(true_systems) & set(pred_systems))
+
+        pairs = []
+        for system in unique_systems:
+            for prefix, score_metric, score_keys, score_indices in task_info:
+                truth_path = os.path.join(
+                    groundtruth_path, f"Test_{system}/{prefix}test.npy"
+                )
+                pred_file = f"{system}_{prefix}prediction.npy"
+
+                # score provided required files
+                if pred_file in pred_members:
+                    pred_member = pred_members[pred_file]
+                    pred_path = (
+                        predictions_path
+                        if pred_member is not None
+                        else os.path.join(predictions_path, pred_file)
+                    )
+                    pairs.append(
+                        (
+                            system,
+                            score_metric,
+                            score_keys,
+                            score_indices,
+                            truth_path,
+                            pred_path,
+                            pred_member,
+                        )
+                    )
+
+        workers = min(workers or get_available_cpus(), len(pairs))
+        if workers > 1:
+            # Each worker loads its pair while the others compute theirs, with one
+            # BLAS thread each. Scoring in this process keeps its BLAS threads.
+            with single_blas_thread_environment(), ProcessPoolExecutor(
+                max_workers=workers, mp_context=get_pool_context()
+            ) as executor:
+                pair_results = list(executor.map(score_pair, *zip(*pairs)))
+        else:
+            pair_results = [score_pair(*pair) for pair in pairs]
+
+    for pair_result in pair_results:
+        score_result.update(pair_result)
 
-    for system in unique_systems:
-        for prefix, score_metric, score_keys, score_indices in task_info:
-            truth_path = os.path.join(
-                groundtruth_path, f"Test_{system}/{prefix}test.npy"
-            )
-            pred_path = os.path.join(
-                predictions_path, f"{system}_{prefix}prediction.npy"
-            )
+    return score_result
 
-            # score provided required files
-            if os.path.exists(pred_path):
-                truth = np.load(truth_path)
-                pred = np.load(pred_path)
 
-                if score_metric == "forecast":
-                    scores = forecast(truth, pred, system)
-                elif score_metric == "reconstruction":
-                    scores = (reconstruction(truth, pred),)
-                else:
-                    scores = house_zero_score(truth, pred)
+def get_score_memo_key(
+    groundtruth_path: str, predictions_path: str, evaluation_id: str
+) -> Optional[str]:
+    """Get the key under which the scores of a predictions file are memoized: the content
+    of the predictions, of the groundtruth of the task, and of the scoring code.
 
-                for key, index in zip(score_keys, score_indices):
-                    score_result[f"{system}_{key}"] = scores[index]
+    Arguments:
+        groundtruth_path: path to the groundtruth folder
+        predictions_path: path to the predictions tarball, or to a folder of predicted arrays
+        evaluation_id: id of the evaluation queue
 
-    return score_result
+    Returns:
+        the key, or None if the files cannot be read
+    """
+    truth_paths = [
+        os.path.join(groundtruth_path, f"Test_{system}/{prefix}test.npy")
+        for system in get_true_systems(evaluation_id)
+        for prefix, _, _, _ in TASK_MAPPING.get(evaluation_id, [])
+    ]
+    try:
+        predictions_digest = (
+            result_memo.directory_digest(predictions_path)
+            if os.path.isdir(predictions_path)
+            else truth_cache.file_digest(predictions_path)
+        )
+        groundtruth_digests = {
+            os.path.relpath(path, groundtruth_path): truth_cache.file_digest(path)
+            for path in truth_paths
+            if os.path.exists(path)
+        }
+        code_digest = result_memo.code_version(
+            [__file__, npy_tar.__file__, sys.modules[spectral_norm.__module__].__file__]
+        )
+    except OSError as e:
+        print(f"Could not hash the predictions, groundtruth or scoring code: {e}")
+        return None
+
+    return result_memo.memo_key(
+        predictions=predictions_digest,
+        groundtruth=groundtruth_digests,
+        code=code_digest,
+        evaluation_id=evaluation_id,
+    )
 
 
 def score_submission(
-    groundtruth_path: str, predictions_path: str, evaluation_id: str, status: str
+    groundtruth_path: str,
+    predictions_path: str,
+    evaluation_id: str,
+    status: str,
+    workers: Optional[int] = None,
+    submission_id: Optional[str] = None,
+    memoize: bool = False,
 ) -> typing.Tuple[str, dict]:
     """Determine the score of a submission.
 
+    If ``memoize`` is True, the scores are recorded in ``result_memo``, and a
+    submission of identical predictions is not scored again: the recorded scores
+    are reused (see ``get_score_memo_key``).
+
     Arguments:
         groundtruth_path: path to the groundtruth folder
         predictions_path: path to the predictions file
         evaluation_id: id of the evaluation queue
         status: current submission status
+        workers: number of processes scoring the predictions. Defaults to the available CPUs.
+        submission_id: id of the submission, recorded with its memoized scores
+        memoize: whether to reuse the scores of identical predictions
 
     Returns:
         Tuple: score status string and dictionary containing score, status and errors
@@ -390,12 +870,25 @@ def score_submission(
     else:
         try:
             # assume predictions are compressed into a tarball file
-            # untar the predictions into 'predictions' folder
-            untar("predictions", tar_filename=predictions_path, pattern=".npy")
-            # score the predictions
-            scores = calculate_all_scores(
-                groundtruth_path, "predictions", evaluation_id
+            # score the predictions, read in place from the tarball
+            score_memo_key = (
+                get_score_memo_key(groundtruth_path, predictions_path, evaluation_id)
+                if memoize
+                else None
             )
+            memo_entry = result_memo.lookup(score_memo_key) if score_memo_key else None
+            if memo_entry is not None:
+                print(
+                    f"Reusing the scores of submission {memo_entry.submission_id}, "
+                    "whose predictions are identical"
+                )
+                scores = memo_entry.result
+            else:
+                scores = calculate_all_scores(
+                    groundtruth_path, predictions_path, evaluation_id, workers=workers
+                )
+                if score_memo_key and scores:
+                    result_memo.store(score_memo_key, submission_id or "", result=scores)
             score_status = SCORED
             message = ""
         except Exception as e:
@@ -428,7 +921,7 @@ def get_eval_id(syn: synapseclient.Synapse, submission_id: str) -> str:
         Exception: if an error occurs
     """
     try:
-        eval_id = syn.getSubmission(submission_id).get("evaluationId")
+        eval_id = metadata_cache.get_submission(syn, submission_id).get("evaluationId")
         return eval_id
     except Exception as e:
         print(
@@ -460,15 +953,20 @@ if __name__ == "__main__":
     results_path = args.output
 
     # login to synapase
-    syn = synapseclient.Synapse()
-    syn.login(silent=True)
+    syn = synapse_gateway.login(silent=True)
 
     # get the evaluation ID to identify corresponding scoring parameters
     eval_id = get_eval_id(syn, sub_id)
 
     # get scores of submission
     score_status, result = score_submission(
-        groundtruth_path, predictions_path, eval_id, status
+        groundtruth_path,
+        predictions_path,
+        eval_id,
+        status,
+        workers=args.workers,
+        submission_id=sub_id,
+        memoize=args.memoize,
     )
 
     # update the scores and status for the submsision
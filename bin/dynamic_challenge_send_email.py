@@ -9,6 +9,8 @@ import synapseclient
 
 from typing import Tuple
 
+import metadata_cache
+import synapse_gateway
 from helpers import get_participant_id
 from send_email import (
     get_score_dict,
@@ -101,10 +103,10 @@ def get_evaluation(syn: synapseclient.Synapse, submission_id: str) -> Tuple[str,
         Exception: if an error occurs
     """
     try:
-        eval_id = syn.getSubmission(submission_id, downloadFile=False).get(
+        eval_id = metadata_cache.get_submission(syn, submission_id).get(
             "evaluationId"
         )
-        eval_name = syn.getEvaluation(eval_id).get("name")
+        eval_name = metadata_cache.get_evaluation(syn, eval_id).get("name")
         return eval_id, eval_name
     except Exception as e:
         print(
@@ -134,7 +136,7 @@ def get_target_link(synapse_client: synapseclient.Synapse, eval_id: str) -> str:
     link = EVAL_TO_LINK.get(eval_id, None)
     if link:
         return link
-    project_id = synapse_client.getEvaluation(eval_id).get("contentSource")
+    project_id = metadata_cache.get_evaluation(synapse_client, eval_id).get("contentSource")
     return f"https://www.synapse.org/#!Synapse:{project_id}"
 
 
@@ -157,7 +159,7 @@ def send_email(
         raise ValueError(
             f"Invalid notification_type. Must be '{BEFORE}' or '{AFTER}'")
     # Initiate connection to Synapse
-    syn = synapseclient.login()
+    syn = synapse_gateway.login(silent=False)
 
     # Get the Synapse users to send an e-mail to
     ids_to_notify = get_participant_id(syn, submission_id)
@@ -1,12 +1,17 @@
 #!/usr/bin/env python3
 
 import argparse
+import contextlib
 import tarfile
-from typing import List
+from typing import Dict, List, Optional, Tuple
 import synapseclient
 import json
 import os
 
+import metadata_cache
+import npy_tar
+import synapse_gateway
+
 
 INVALID = "INVALID"
 VALIDATED = "VALIDATED"
@@ -29,6 +34,13 @@ def get_args():
         default="results.json",
         help="The path to output file",
     )
+    parser.add_argument(
+        "--groundtruth-path",
+        type=str,
+        default=None,
+        help="The path to the ground truth folder, to check the shapes of the predictions against. "
+        "The shapes are not checked without it.",
+    )
 
     return parser.parse_args()
 
@@ -67,18 +79,70 @@ def get_expected_filenames(eval_id: str) -> List[str]:
     return expected_patterns
 
 
-def untar(directory: str, tar_filename: str, pattern="*") -> None:
-    """Untar a tar file into a directory
+def get_expected_shapes(groundtruth_path: str, eval_id: str) -> Dict[str, Tuple[int, ...]]:
+    """Reads the shape of each expected prediction from the header of its ground truth.
 
     Arguments:
-        directory: Path to directory to untar files
-        tar_filename:  tar file path
+        groundtruth_path: The path to the ground truth folder.
+        eval_id: The evaluation ID.
+
+    Returns:
+        The expected shapes, by expected filename. Filenames without a ground truth are left out.
     """
-    with tarfile.open(tar_filename, "r") as tar:
-        for member in tar.getmembers():
-            if member.isfile() and member.name.endswith(pattern):
-                member.name = os.path.basename(member.name)
-                tar.extract(member, path=directory)
+    expected_shapes = {}
+    for filename in get_expected_filenames(eval_id):
+        system, prediction_name = filename.split("_", 1)
+        prefix = prediction_name[: -len("prediction.npy")]
+        truth_path = os.path.join(groundtruth_path, f"Test_{system}/{prefix}test.npy")
+        if os.path.exists(truth_path):
+            expected_shapes[filename] = npy_tar.read_file_header(truth_path).shape
+    return expected_shapes
+
+
+def check_prediction_headers(
+    predictions_path: str,
+    members: Dict[str, npy_tar.NpyMember],
+    expected_shapes: Optional[Dict[str, Tuple[int, ...]]] = None,
+) -> List[str]:
+    """Checks the NPY header of each prediction, without reading the arrays.
+    A prediction whose expected shape is unknown is rejected, since it could not be scored.
+
+    Arguments:
+        predictions_path: The path to the predictions tarball.
+        members: The predictions to check, as indexed by ``npy_tar.index_tar``.
+        expected_shapes: The expected shape of each prediction, by filename.
+                         The shapes are not checked if None.
+
+    Returns:
+        A list of the errors found.
+    """
+    errors = []
+    for filename, member in members.items():
+        try:
+            header = npy_tar.read_header(predictions_path, member)
+            npy_tar.check_header(member, header)
+        except (ValueError, tarfile.TarError) as e:
+            errors.append(f"Error: {filename} is not a valid NPY file ({e}).")
+            continue
+
+        # Only real numbers can be scored
+        if header.dtype.kind not in "iuf":
+            errors.append(
+                f"Error: {filename} has dtype {header.dtype}, expected integers or floats."
+            )
+
+        if expected_shapes is None:
+            continue
+        expected_shape = expected_shapes.get(filename)
+        if expected_shape is None:
+            errors.append(
+                f"Error: the expected shape of {filename} could not be determined."
+            )
+        elif header.shape != expected_shape:
+            errors.append(
+                f"Error: {filename} has shape {header.shape}, expected {expected_shape}."
+            )
+    return errors
 
 
 def get_eval_id(syn: synapseclient.Synapse, submission_id: str) -> str:
@@ -92,7 +156,7 @@ def get_eval_id(syn: synapseclient.Synapse, submission_id: str) -> str:
         sub_id: the evaluation ID, or None if an error occurs.
     """
     try:
-        eval_id = syn.getSubmission(submission_id).get("evaluationId")
+        eval_id = metadata_cache.get_submission(syn, submission_id).get("evaluationId")
         return eval_id
     except Exception as e:
         print(
@@ -109,8 +173,7 @@ if __name__ == "__main__":
     results_path = args.output
 
     # login to synapase
-    syn = synapseclient.Synapse()
-    syn.login(silent=True)
+    syn = synapse_gateway.login(silent=True)
 
     # get the evaluation ID to identify corresponding scoring parameters
     eval_id = get_eval_id(syn, sub_id)
@@ -127,18 +190,40 @@ if __name__ == "__main__":
         invalid_reasons.append('Error:  No "predictions.tar" found')
     else:
         expected_files = get_expected_filenames(eval_id)
-        untar("val_predictions", tar_filename=predictions_path, pattern=".npy")
-        pred_files = os.listdir("val_predictions")
-
-        matched_files = [f for f in pred_files if f in expected_files]
-
-        if not matched_files:
-            prediction_status = INVALID
-            invalid_reasons.append(
-                f'Error: No expected prediction file(s) found in the {os.path.basename(predictions_path)}.'
-            )
-        else:
-            prediction_status = VALIDATED
+        # list the arrays in place, without extracting the tarball. A compressed tarball
+        # is decompressed once, instead of once for each header read.
+        with contextlib.ExitStack() as stack:
+            tar_path = predictions_path
+            try:
+                tar_path = stack.enter_context(npy_tar.uncompressed_tar(predictions_path))
+                pred_members = npy_tar.index_tar(tar_path, pattern=".npy")
+            except tarfile.TarError:
+                pred_members = {}
+                invalid_reasons.append(
+                    f"Error: {os.path.basename(predictions_path)} is not a valid tar file."
+                )
+            pred_files = list(pred_members)
+
+            matched_files = [f for f in pred_files if f in expected_files]
+
+            if not matched_files:
+                prediction_status = INVALID
+                invalid_reasons.append(
+                    f'Error: No expected prediction file(s) found in the {os.path.basename(predictions_path)}.'
+                )
+            else:
+                # check the dtypes and shapes from the NPY headers only
+                expected_shapes = None
+                if args.groundtruth_path:
+                    expected_shapes = get_expected_shapes(args.groundtruth_path, eval_id)
+                invalid_reasons.extend(
+                    check_prediction_headers(
+                        tar_path,
+                        {f: pred_members[f] for f in matched_files},
+                        expected_shapes,
+                    )
+                )
+                prediction_status = INVALID if invalid_reasons else VALIDATED
 
     result = {
         "validation_status": prediction_status,
@@ -8,6 +8,9 @@ from synapseclient.core.exceptions import SynapseHTTPError
 from synapseclient.models.team import Team
 from synapseclient.models.user import UserProfile
 
+import metadata_cache
+import synapse_gateway
+
 
 def get_participant_id(syn: synapseclient.Synapse, submission_id: str) -> List[int]:
     """
@@ -23,8 +26,8 @@ def get_participant_id(syn: synapseclient.Synapse, submission_id: str) -> List[i
       The synID of a team or individual participant
 
     """
-    # Retrieve a Submission object
-    submission = syn.getSubmission(submission_id, downloadFile=False)
+    # Retrieve the submission metadata
+    submission = metadata_cache.get_submission(syn, submission_id)
 
     # Get the teamId or userId of submitter
     participant_id = submission.get("teamId") or submission.get("userId")
@@ -47,6 +50,13 @@ def get_participant_name(syn: synapseclient.Synapse, participant_id: List[int])
         The name of the participant
 
     """
+    # The models need a Synapse client of their own, so the gateway is queried directly
+    if isinstance(syn, synapse_gateway.GatewaySynapse):
+        try:
+            return syn.restGET(f"/userProfile/{participant_id[0]}")["userName"]
+        except SynapseHTTPError:
+            return syn.restGET(f"/team/{participant_id[0]}")["name"]
+
     try:
         name = UserProfile.from_id(participant_id[0], synapse_client=syn).username
     except SynapseHTTPError:
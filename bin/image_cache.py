@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+This module keeps the submission Docker images pulled on a host within a disk
+budget, by evicting the least recently used ones.
+
+Only images recorded with ``ImageCache.touch`` are ever evicted, so images that
+were not pulled for a submission (e.g. the workflow's own containers) are left
+alone. The last use of each image is kept in a JSON file keyed by the image
+digest (``DOCKER_IMAGE_CACHE_STATE``, ``/tmp/docker_image_cache/state.json`` by
+default), along with the tasks currently pulling or running it (see
+``mark_in_use``). Tasks only see each other's images and marks if they share that
+file, as they share ``/tmp`` on AWS Batch. Since the file decides which images are
+removed, its folder must belong to the current user and be writable by nobody
+else (see ``cache_dir``); otherwise no use is recorded and nothing is evicted.
+"""
+
+import fcntl
+import json
+import os
+import tempfile
+import time
+import uuid
+from typing import Dict, Iterable, List, Optional
+
+import docker
+
+from cache_dir import make_private_dir
+
+STATE_PATH = os.environ.get(
+    "DOCKER_IMAGE_CACHE_STATE",
+    os.path.join(tempfile.gettempdir(), "docker_image_cache", "state.json"),
+)
+
+# Age (in seconds) after which an in-use mark is ignored, e.g. because its task was killed
+IN_USE_TTL = float(os.environ.get("DOCKER_IMAGE_CACHE_IN_USE_TTL", 24 * 3600))
+
+
+def get_image_digest(docker_image: str) -> str:
+    """
+    Returns the digest of a Docker image identifier.
+
+    Arguments:
+        docker_image: Docker image identifier in the format: '<image_name>@<sha_code>'
+
+    Returns:
+        The digest, or the identifier itself if it has no digest
+
+    """
+    return docker_image.split("@", 1)[-1]
+
+
+class ImageCache:
+    """
+    A least-recently-used cache of submission images, under a disk budget.
+
+    Arguments:
+        client: The Docker client
+        max_size: The disk budget (in bytes) for submission images. Nothing is evicted if None.
+        state_path: The JSON file recording the last use of each image, in a private folder
+
+    """
+
+    def __init__(
+        self,
+        client: docker.DockerClient,
+        max_size: Optional[int] = None,
+        state_path: str = STATE_PATH,
+    ) -> None:
+        self.client = client
+        self.max_size = max_size
+        self.state_path = state_path
+
+    def _update_state(self, update) -> Dict[str, dict]:
+        # A state file others can write to could get any image evicted, so it is not used
+        try:
+            make_private_dir(os.path.dirname(os.path.abspath(self.state_path)))
+        except OSError as e:
+            print(f"Could not use the image cache state {self.state_path}: {e}")
+            return {}
+
+        # The state file is shared between tasks, so it is locked while it is updated
+        with open(self.state_path + ".lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                with open(self.state_path, "r") as state_file:
+                    state = json.load(state_file)
+            except (OSError, ValueError):
+                state = {}
+
+            update(state)
+
+            with open(self.state_path, "w") as state_file:
+                json.dump(state, state_file)
+
+        return state
+
+    def touch(self, docker_image: str) -> None:
+        """
+        Records that a submission image was just used.
+
+        Arguments:
+            docker_image: Docker image identifier in the format: '<image_name>@<sha_code>'
+
+        """
+
+        def update(state):
+            entry = state.setdefault(get_image_digest(docker_image), {})
+            entry["image"] = docker_image
+            entry["last_used"] = time.time()
+
+        self._update_state(update)
+
+    def mark_in_use(self, docker_image: str) -> str:
+        """
+        Records that a submission image is being pulled or run, so that no task
+        evicts it until ``unmark_in_use`` is called (or ``IN_USE_TTL`` has passed).
+
+        Arguments:
+            docker_image: Docker image identifier in the format: '<image_name>@<sha_code>'
+
+        Returns:
+            The token identifying the mark, to pass to ``unmark_in_use``
+
+        """
+        token = uuid.uuid4().hex
+
+        def update(state):
+            entry = state.setdefault(get_image_digest(docker_image), {})
+            entry["image"] = docker_image
+            entry.setdefault("last_used", time.time())
+            entry.setdefault("in_use", {})[token] = time.time()
+
+        self._update_state(update)
+
+        return token
+
+    def unmark_in_use(self, docker_image: str, token: str) -> None:
+        """
+        Removes a mark set by ``mark_in_use``.
+
+        Arguments:
+            docker_image: Docker image identifier in the format: '<image_name>@<sha_code>'
+            token: The token returned by ``mark_in_use``
+
+        """
+
+        def update(state):
+            entry = state.get(get_image_digest(docker_image))
+            if entry is not None:
+                entry.get("in_use", {}).pop(token, None)
+
+        self._update_state(update)
+
+    def evict(self, pinned: Iterable[str] = ()) -> List[str]:
+        """
+        Removes the least recently used submission images until the ones left fit
+        in the disk budget. Pinned images (e.g. those of submissions still queued),
+        images marked in use by any task and images used by a container are never removed.
+
+        Arguments:
+            pinned: The Docker image identifiers that must be kept
+
+        Returns:
+            The Docker image identifiers that were removed
+
+        """
+        if self.max_size is None:
+            return []
+
+        pinned_digests = {get_image_digest(docker_image) for docker_image in pinned}
+        removed = []
+
+        def update(state):
+            # Drop the marks of tasks that did not remove them, and forget images that are
+            # no longer on the host, unless they are being pulled
+            now = time.time()
+            sizes = {}
+            for digest, entry in list(state.items()):
+                entry["in_use"] = {
+                    token: marked_at
+                    for token, marked_at in entry.get("in_use", {}).items()
+                    if now - marked_at < IN_USE_TTL
+                }
+                try:
+                    sizes[digest] = self.client.images.get(entry["image"]).attrs.get("Size", 0)
+                except docker.errors.ImageNotFound:
+                    if not entry["in_use"]:
+                        del state[digest]
+
+            total_size = sum(sizes.values())
+            least_recently_used = sorted(sizes, key=lambda digest: state[digest]["last_used"])
+            for digest in least_recently_used:
+                if total_size <= self.max_size:
+                    break
+                if digest in pinned_digests or state[digest]["in_use"]:
+                    continue
+                try:
+                    self.client.images.remove(state[digest]["image"])
+                except docker.errors.APIError as e:
+                    # The image is still used by a container
+                    print(f"Could not remove image {state[digest]['image']}: {e}")
+                    continue
+                print(f"Removed image {state[digest]['image']} ({sizes[digest]} bytes)")
+                removed.append(state[digest]["image"])
+                total_size -= sizes[digest]
+                del state[digest]
+
+        self._update_state(update)
+
+        return removed
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+This module pulls submission Docker images in the background, so that image
+pulls from docker.synapse.org overlap with earlier containers still running
+instead of sitting on the critical path of each container start.
+"""
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Union
+
+import docker
+
+
+class ImagePrefetcher:
+    """
+    Pulls Docker images with bounded concurrency.
+
+    Images are queued with ``prefetch`` (in the order they will be run) and
+    ``wait`` blocks until a given image has been pulled. If a pull fails, the
+    image is simply pulled again by ``client.containers.run``, which then only
+    downloads the layers that are still missing.
+
+    Arguments:
+        client: The Docker client, already logged into the registry
+        max_workers: The maximum number of images pulled at the same time
+        preflight: Checks an image before it is pulled, returning the reason it is
+                   rejected, or None. Rejected images are not pulled.
+
+    """
+
+    def __init__(
+        self,
+        client: docker.DockerClient,
+        max_workers: int = 2,
+        preflight: Optional[Callable[[str], Optional[str]]] = None,
+    ) -> None:
+        self.client = client
+        self.preflight = preflight
+        self._executor = ThreadPoolExecutor(max_workers=max(max_workers, 1))
+        self._pulls: Dict[str, Future] = {}
+
+    def _pull(self, docker_image: str) -> None:
+        # Skip the pull if the image is already on the host
+        try:
+            self.client.images.get(docker_image)
+            print(f"Image already present: {docker_image}")
+            return
+        except docker.errors.ImageNotFound:
+            pass
+
+        if self.preflight is not None:
+            image_error = self.preflight(docker_image)
+            if image_error:
+                print(f"Not prefetching image {docker_image}: {image_error}")
+                return
+
+        print(f"Prefetching image... {docker_image}")
+        self.client.images.pull(docker_image)
+        print(f"Prefetched image: {docker_image}")
+
+    def prefetch(self, docker_image: str) -> None:
+        """
+        Queues the pull of a Docker image, unless it is already queued.
+
+        Arguments:
+            docker_image: Docker image identifier in the format: '<image_name>@<sha_code>'
+
+        """
+        # ``get_submission_image`` returns an error message for non-Docker submissions
+        if "InputError" in docker_image or docker_image in self._pulls:
+            return
+        self._pulls[docker_image] = self._executor.submit(self._pull, docker_image)
+
+    def wait(
+        self, docker_image: str, timeout: Optional[Union[int, float]] = None
+    ) -> bool:
+        """
+        Blocks until the pull of a Docker image has finished.
+
+        Arguments:
+            docker_image: Docker image identifier in the format: '<image_name>@<sha_code>'
+            timeout: Maximum time to wait (in seconds). Waits indefinitely if None.
+
+        Returns:
+            True if the image was pulled, False if it was not queued, or if its pull
+            failed or did not finish in time.
+
+        """
+        pull = self._pulls.get(docker_image)
+        if pull is None:
+            return False
+
+        try:
+            pull.result(timeout=timeout)
+        except Exception as e:
+            print(f"Could not prefetch image {docker_image}: {e}")
+            return False
+
+        return True
+
+    def shutdown(self) -> None:
+        """Cancels the pulls that have not started yet, and waits for the others."""
+        self._executor.shutdown(wait=True, cancel_futures=True)
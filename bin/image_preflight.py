@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+This module inspects a submission Docker image in its registry before it is
+pulled. The image manifest and config are fetched through the Docker Registry
+HTTP API (v2), so that images that are too large, or that are not built for the
+platform of the host, are rejected before any layer is downloaded.
+"""
+
+import functools
+import os
+import re
+from typing import List, NamedTuple, Optional, Tuple
+
+import requests
+
+MANIFEST_LIST_TYPES = [
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+    "application/vnd.oci.image.index.v1+json",
+]
+MANIFEST_TYPES = [
+    "application/vnd.docker.distribution.manifest.v2+json",
+    "application/vnd.oci.image.manifest.v1+json",
+]
+
+# Time (in seconds) to wait for the registry to answer
+REQUEST_TIMEOUT = 30
+
+
+class ImageRejected(Exception):
+    """Raised when a submission image does not meet the image limits."""
+
+
+class ImageLimits(NamedTuple):
+    max_compressed_size: Optional[int] = None
+    max_uncompressed_size: Optional[int] = None
+    platform: Optional[str] = None
+
+
+def parse_image(docker_image: str) -> Tuple[str, str, str]:
+    """
+    Splits a Docker image identifier into its registry, repository and reference.
+
+    Arguments:
+        docker_image: Docker image identifier, e.g. 'docker.synapse.org/syn123/model@sha256:...'
+
+    Returns:
+        The registry host, the repository name and the digest (or tag)
+
+    """
+    if "@" in docker_image:
+        name, reference = docker_image.split("@", 1)
+    else:
+        name, _, reference = docker_image.rpartition(":")
+        if not name or "/" in reference:
+            name, reference = docker_image, "latest"
+
+    first, _, rest = name.partition("/")
+    if rest and ("." in first or ":" in first or first == "localhost"):
+        return first, rest, reference
+
+    # Images without a registry host come from Docker Hub
+    repository = name if "/" in name else f"library/{name}"
+    return "registry-1.docker.io", repository, reference
+
+
+class RegistryClient:
+    """
+    A minimal Docker Registry HTTP API (v2) client, handling the Basic and
+    Bearer token authentication challenges of the registry.
+
+    Arguments:
+        registry: The registry host, e.g. 'docker.synapse.org' or 'localhost:5000'
+        username: The registry username, if any
+        password: The registry password or token, if any
+
+    """
+
+    def __init__(
+        self,
+        registry: str,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+    ) -> None:
+        local = registry.split(":")[0] in ("localhost", "127.0.0.1")
+        self.base_url = f"{'http' if local else 'https'}://{registry}/v2"
+        self.auth = (username or "", password) if password else None
+        self.session = requests.Session()
+
+    def _authenticate(self, challenge: str) -> None:
+        scheme, _, params = challenge.partition(" ")
+        if scheme.lower() == "basic":
+            self.session.auth = self.auth
+            return
+
+        # Bearer challenge: get a token from the realm, e.g.
+        # Bearer realm="https://docker.synapse.org/v2/bearerToken",service="docker.synapse.org",scope="repository:syn123/model:pull"
+        fields = dict(re.findall(r'(\w+)="([^"]*)"', params))
+        realm = fields.pop("realm")
+        response = self.session.get(
+            realm, params=fields, auth=self.auth, timeout=REQUEST_TIMEOUT
+        )
+        response.raise_for_status()
+        token = response.json().get("token") or response.json().get("access_token")
+        self.session.headers["Authorization"] = f"Bearer {token}"
+
+    def get(self, path: str, accept: Optional[List[str]] = None) -> requests.Response:
+        """
+        Sends a GET request to the registry, authenticating if the registry asks to.
+
+        Arguments:
+            path: The path of the request, relative to /v2
+            accept: The accepted media types
+
+        Returns:
+            The response
+
+        Raises:
+            requests.HTTPError: If the registry returns an error
+
+        """
+        headers = {"Accept": ", ".join(accept)} if accept else {}
+        response = self.session.get(
+            f"{self.base_url}/{path}", headers=headers, timeout=REQUEST_TIMEOUT
+        )
+        if response.status_code == 401 and "WWW-Authenticate" in response.headers:
+            self._authenticate(response.headers["WWW-Authenticate"])
+            response = self.session.get(
+                f"{self.base_url}/{path}", headers=headers, timeout=REQUEST_TIMEOUT
+            )
+        response.raise_for_status()
+
+        return response
+
+
+def format_platform(platform: dict) -> str:
+    """Formats a platform description as '<os>/<architecture>[/<variant>]'."""
+    parts = [platform.get("os", ""), platform.get("architecture", "")]
+    if platform.get("variant"):
+        parts.append(platform["variant"])
+
+    return "/".join(parts)
+
+
+def matches_platform(platform: dict, expected: str) -> bool:
+    """
+    Checks a platform description against an expected '<os>/<architecture>[/<variant>]'.
+    The variant is only compared if the expected platform has one.
+    """
+    expected_parts = expected.split("/")
+    actual_parts = format_platform(platform).split("/")
+
+    return actual_parts[: len(expected_parts)] == expected_parts
+
+
+@functools.lru_cache(maxsize=None)
+def preflight_image(
+    docker_image: str,
+    limits: ImageLimits,
+    username: str = "foo",
+    password: Optional[str] = None,
+) -> Optional[str]:
+    """
+    Checks a Docker image against ``limits`` from its registry metadata, without
+    downloading any layer:
+
+    1. If the image is a multi-platform image, it must have a variant for ``limits.platform``.
+       Otherwise, the platform in its config must match ``limits.platform``.
+    2. The sum of its compressed layer sizes must not exceed ``limits.max_compressed_size``.
+
+    The registry does not record the uncompressed size of the layers, so
+    ``limits.max_uncompressed_size`` can only be checked once the image is pulled.
+
+    If the registry cannot be reached, the image is not rejected: it is left to the
+    pull to fail, if it has to.
+
+    Arguments:
+        docker_image: Docker image identifier in the format: '<image_name>@<sha_code>'
+        limits: The limits to check the image against
+        username: The registry username
+        password: The registry password. Defaults to the SYNAPSE_AUTH_TOKEN environment variable.
+
+    Returns:
+        The reason the image was rejected, or None if it passed the checks
+
+    """
+    registry, repository, reference = parse_image(docker_image)
+    registry_client = RegistryClient(
+        registry, username, password or os.environ.get("SYNAPSE_AUTH_TOKEN")
+    )
+
+    try:
+        manifest = registry_client.get(
+            f"{repository}/manifests/{reference}", accept=MANIFEST_LIST_TYPES + MANIFEST_TYPES
+        ).json()
+
+        # Multi-platform images list one manifest per platform
+        if manifest.get("mediaType") in MANIFEST_LIST_TYPES or "manifests" in manifest:
+            platforms = [entry.get("platform", {}) for entry in manifest["manifests"]]
+            selected = next(
+                (
+                    entry
+                    for entry in manifest["manifests"]
+                    if not limits.platform
+                    or matches_platform(entry.get("platform", {}), limits.platform)
+                ),
+                None,
+            )
+            if selected is None:
+                available = ", ".join(format_platform(platform) for platform in platforms)
+                return (
+                    f"Docker image is not built for the {limits.platform} platform "
+                    f"(available platforms: {available})."
+                )
+            manifest = registry_client.get(
+                f"{repository}/manifests/{selected['digest']}", accept=MANIFEST_TYPES
+            ).json()
+
+        elif limits.platform:
+            config = registry_client.get(
+                f"{repository}/blobs/{manifest['config']['digest']}"
+            ).json()
+            if not matches_platform(config, limits.platform):
+                return (
+                    f"Docker image is built for the {format_platform(config)} platform, "
+                    f"not {limits.platform}."
+                )
+
+    except (requests.RequestException, ValueError, KeyError) as e:
+        print(f"Could not inspect image {docker_image} in its registry: {e}")
+        return None
+
+    compressed_size = manifest.get("config", {}).get("size", 0) + sum(
+        layer.get("size", 0) for layer in manifest.get("layers", [])
+    )
+    if limits.max_compressed_size and compressed_size > limits.max_compressed_size:
+        return (
+            f"Docker image is {compressed_size / 1024**3:.2f} GB compressed, which exceeds "
+            f"the limit of {limits.max_compressed_size / 1024**3:.2f} GB."
+        )
+
+    return None
+
+
+def check_uncompressed_size(size: int, limits: ImageLimits) -> Optional[str]:
+    """
+    Checks the size of a pulled Docker image against ``limits.max_uncompressed_size``.
+
+    Arguments:
+        size: The size of the image on disk, in bytes
+        limits: The limits to check the image against
+
+    Returns:
+        The reason the image was rejected, or None if it passed the check
+
+    """
+    if limits.max_uncompressed_size and size > limits.max_uncompressed_size:
+        return (
+            f"Docker image is {size / 1024**3:.2f} GB uncompressed, which exceeds "
+            f"the limit of {limits.max_uncompressed_size / 1024**3:.2f} GB."
+        )
+
+    return None
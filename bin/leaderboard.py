@@ -0,0 +1,654 @@
+#!/usr/bin/env python3
+"""
+This module ranks the scored submissions of an evaluation queue incrementally,
+so that a new score only moves the ranks it affects instead of re-sorting the
+whole submission view.
+
+Each evaluation has two rankings, named after the annotations they are written
+back to:
+
+- ``current_rank``: every scored submission
+- ``team_rank``: the best submission of each team (or individual submitter)
+
+Submissions are ordered by score, then by submission time (the earlier
+submission wins a tie), then by submission ID. The rankings are kept in sorted
+arrays: a new score is placed with a binary search, and only the submissions
+whose rank it changes are reported.
+
+The scores are appended to a JSON lines file per evaluation under
+``LEADERBOARD_STORE``, which must be set to a folder that persists across tasks
+and runs (e.g. on a shared file system): a folder under a task's own ``/tmp``
+would start every task with an empty leaderboard. Rescoring a submission
+appends a new line, which replaces the earlier one. Every ``SNAPSHOT_INTERVAL``
+lines, the rankings are also written out in order, so loading the leaderboard
+only reads them back and replays the lines appended since, without sorting.
+
+The store of an evaluation is locked while a score is ranked, appended and
+annotated, so concurrent tasks rank their submissions one at a time. It holds
+no Synapse state, so it can be used (and rebuilt) without Synapse:
+
+    leaderboard.py add <evaluation_id> <submission_id> <results.json> [--score-key KEY] [--team-id ID] [--created-on TIME] [--annotate]
+    leaderboard.py show <evaluation_id> [--view team_rank]
+"""
+
+import argparse
+import bisect
+import fcntl
+import json
+import math
+import os
+import tempfile
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+import synapseclient
+
+import metadata_cache
+import synapse_gateway
+from cache_dir import make_private_dir
+
+STORE_DIR = os.environ.get("LEADERBOARD_STORE")
+
+# Number of scores appended to the store of an evaluation between two snapshots of its rankings
+SNAPSHOT_INTERVAL = 100
+
+ALL_SUBMISSIONS = "current_rank"
+BEST_PER_TEAM = "team_rank"
+VIEWS = (ALL_SUBMISSIONS, BEST_PER_TEAM)
+
+SCORED = "SCORED"
+
+# results.json keys that are not scores
+NON_SCORE_KEYS = {"score_status", "score_errors", "validation_status", "validation_errors"}
+
+
+class Entry(NamedTuple):
+    submission_id: str
+    team_id: str
+    score: float
+    created_on: str
+
+
+class RankChange(NamedTuple):
+    submission_id: str
+    view: str
+    old_rank: Optional[int]
+    new_rank: Optional[int]
+
+
+class RankedIndex:
+    """
+    The submissions of a ranking, as a sorted array of sort keys. The last
+    element of a key is the submission ID, so keys are unique.
+
+    """
+
+    def __init__(self, keys: Iterable[tuple] = ()):
+        self.keys = sorted(keys)
+
+    @classmethod
+    def from_sorted(cls, keys: Iterable[tuple]) -> "RankedIndex":
+        """Builds an index from keys that are already sorted, without sorting them again."""
+        index = cls()
+        index.keys = list(keys)
+        return index
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def rank(self, key: tuple) -> Optional[int]:
+        """
+        Finds the (1-based) rank of a key.
+
+        Arguments:
+            key: The sort key of the submission
+
+        Returns:
+            The rank, or None if the key is not ranked
+
+        """
+        index = bisect.bisect_left(self.keys, key)
+        if index < len(self.keys) and self.keys[index] == key:
+            return index + 1
+        return None
+
+    def replace(
+        self, old_key: Optional[tuple], new_key: Optional[tuple]
+    ) -> List[Tuple[str, Optional[int], Optional[int]]]:
+        """
+        Removes a key and inserts another, each located with a binary search.
+
+        Arguments:
+            old_key: The key to remove, if any
+            new_key: The key to insert, if any
+
+        Returns:
+            The submission ID, old rank and new rank of each submission whose rank changed
+
+        """
+        removed = inserted = None
+        if old_key is not None:
+            removed = bisect.bisect_left(self.keys, old_key)
+            del self.keys[removed]
+        if new_key is not None:
+            inserted = bisect.bisect_left(self.keys, new_key)
+            self.keys.insert(inserted, new_key)
+
+        changes = []
+        if old_key is not None:
+            changes.append((old_key[-1], removed + 1, None))
+        if new_key is not None:
+            changes.append((new_key[-1], None, inserted + 1))
+        if removed is None and inserted is None:
+            return changes
+
+        # Only the submissions between the removed and the inserted key move
+        positions = [p for p in (removed, inserted) if p is not None]
+        start = min(positions)
+        stop = max(positions) + 1 if len(positions) == 2 else len(self.keys)
+        for position in range(start, min(stop, len(self.keys))):
+            if position == inserted:
+                continue
+            old_position = position
+            if inserted is not None and position > inserted:
+                old_position -= 1
+            if removed is not None and old_position >= removed:
+                old_position += 1
+            if old_position != position:
+                changes.append((self.keys[position][-1], old_position + 1, position + 1))
+
+        return changes
+
+
+class Leaderboard:
+    """
+    The rankings of the scored submissions of an evaluation queue.
+
+    Arguments:
+        higher_is_better: Whether a higher score ranks first
+
+    """
+
+    def __init__(self, higher_is_better: bool = True):
+        self.higher_is_better = higher_is_better
+        self.entries: Dict[str, Entry] = {}
+        self.team_members: Dict[str, Set[str]] = {}
+        self.team_best: Dict[str, str] = {}
+        self.views = {view: RankedIndex() for view in VIEWS}
+
+    def key(self, entry: Entry) -> tuple:
+        """Returns the sort key of an entry: the first key ranks first."""
+        score = -entry.score if self.higher_is_better else entry.score
+        return (score, entry.created_on, entry.submission_id)
+
+    @classmethod
+    def from_entries(
+        cls, entries: Iterable[Entry], higher_is_better: bool = True
+    ) -> "Leaderboard":
+        """
+        Builds a leaderboard from its entries with one sort per ranking. A later
+        entry of a submission replaces an earlier one.
+
+        Arguments:
+            entries: The entries, in the order they were scored
+            higher_is_better: Whether a higher score ranks first
+
+        Returns:
+            The leaderboard
+
+        """
+        leaderboard = cls(higher_is_better)
+        for entry in entries:
+            previous = leaderboard.entries.get(entry.submission_id)
+            if previous is not None:
+                leaderboard.team_members[previous.team_id].discard(entry.submission_id)
+            leaderboard.entries[entry.submission_id] = entry
+            leaderboard.team_members.setdefault(entry.team_id, set()).add(entry.submission_id)
+
+        for team_id in leaderboard.team_members:
+            leaderboard.team_best[team_id] = leaderboard._find_team_best(team_id)
+        leaderboard.views[ALL_SUBMISSIONS] = RankedIndex(
+            leaderboard.key(entry) for entry in leaderboard.entries.values()
+        )
+        leaderboard.views[BEST_PER_TEAM] = RankedIndex(
+            leaderboard.key(leaderboard.entries[submission_id])
+            for submission_id in leaderboard.team_best.values()
+            if submission_id is not None
+        )
+
+        return leaderboard
+
+    def snapshot(self) -> dict:
+        """
+        Returns the entries of the leaderboard in ranking order, from which
+        ``from_snapshot`` restores it without sorting.
+
+        Returns:
+            The snapshot, as a JSON-serializable dictionary
+
+        """
+        return {
+            "higher_is_better": self.higher_is_better,
+            "entries": [
+                self.entries[key[-1]]._asdict() for key in self.views[ALL_SUBMISSIONS].keys
+            ],
+            "team_ranking": [key[-1] for key in self.views[BEST_PER_TEAM].keys],
+        }
+
+    @classmethod
+    def from_snapshot(cls, snapshot: dict) -> "Leaderboard":
+        """
+        Restores a leaderboard from a snapshot, in linear time.
+
+        Arguments:
+            snapshot: The snapshot, as returned by ``snapshot``
+
+        Returns:
+            The leaderboard
+
+        """
+        leaderboard = cls(snapshot["higher_is_better"])
+        for fields in snapshot["entries"]:
+            entry = Entry(**fields)
+            leaderboard.entries[entry.submission_id] = entry
+            leaderboard.team_members.setdefault(entry.team_id, set()).add(entry.submission_id)
+        for submission_id in snapshot["team_ranking"]:
+            leaderboard.team_best[leaderboard.entries[submission_id].team_id] = submission_id
+
+        # The entries are stored in ranking order
+        leaderboard.views[ALL_SUBMISSIONS] = RankedIndex.from_sorted(
+            leaderboard.key(entry) for entry in leaderboard.entries.values()
+        )
+        leaderboard.views[BEST_PER_TEAM] = RankedIndex.from_sorted(
+            leaderboard.key(leaderboard.entries[submission_id])
+            for submission_id in snapshot["team_ranking"]
+        )
+
+        return leaderboard
+
+    def _find_team_best(self, team_id: str) -> Optional[str]:
+        members = self.team_members.get(team_id, ())
+        if not members:
+            return None
+        return min(members, key=lambda s: self.key(self.entries[s]))
+
+    def _team_key(self, team_id: str) -> Optional[tuple]:
+        best = self.team_best.get(team_id)
+        return self.key(self.entries[best]) if best is not None else None
+
+    def add(self, entry: Entry) -> List[RankChange]:
+        """
+        Adds the score of a submission, or replaces it if the submission was
+        already ranked.
+
+        Arguments:
+            entry: The scored submission
+
+        Returns:
+            The rank changes, in each ranking. A rank of None means unranked.
+
+        """
+        previous = self.entries.get(entry.submission_id)
+        changes = [
+            RankChange(submission_id, ALL_SUBMISSIONS, old_rank, new_rank)
+            for submission_id, old_rank, new_rank in self.views[ALL_SUBMISSIONS].replace(
+                self.key(previous) if previous is not None else None, self.key(entry)
+            )
+        ]
+
+        # A submission that moved to another team leaves its previous team first
+        affected_teams = [entry.team_id]
+        if previous is not None:
+            self.team_members[previous.team_id].discard(entry.submission_id)
+            if previous.team_id != entry.team_id:
+                affected_teams.insert(0, previous.team_id)
+        old_team_keys = {team_id: self._team_key(team_id) for team_id in affected_teams}
+
+        self.entries[entry.submission_id] = entry
+        self.team_members.setdefault(entry.team_id, set()).add(entry.submission_id)
+
+        for team_id in affected_teams:
+            best = self.team_best.get(team_id)
+            if best == entry.submission_id:
+                # The best submission was rescored (or moved to another team): look for the new best
+                self.team_best[team_id] = self._find_team_best(team_id)
+            elif team_id == entry.team_id and (
+                best is None or self.key(entry) < self.key(self.entries[best])
+            ):
+                self.team_best[team_id] = entry.submission_id
+
+            new_team_key = self._team_key(team_id)
+            if new_team_key == old_team_keys[team_id]:
+                continue
+            changes.extend(
+                RankChange(submission_id, BEST_PER_TEAM, old_rank, new_rank)
+                for submission_id, old_rank, new_rank in self.views[BEST_PER_TEAM].replace(
+                    old_team_keys[team_id], new_team_key
+                )
+            )
+
+        return merge_changes(changes)
+
+    def rank(self, submission_id: str, view: str = ALL_SUBMISSIONS) -> Optional[int]:
+        """
+        Finds the rank of a submission.
+
+        Arguments:
+            submission_id: The ID of the submission
+            view: The ranking, ``current_rank`` or ``team_rank``
+
+        Returns:
+            The rank, or None if the submission is not ranked
+
+        """
+        entry = self.entries.get(submission_id)
+        if entry is None:
+            return None
+        return self.views[view].rank(self.key(entry))
+
+    def ranking(self, view: str = ALL_SUBMISSIONS) -> List[Entry]:
+        """Returns the entries of a ranking, best first."""
+        return [self.entries[key[-1]] for key in self.views[view].keys]
+
+
+def merge_changes(changes: List[RankChange]) -> List[RankChange]:
+    """
+    Merges the changes of the same submission in the same ranking, e.g. the removal
+    and the insertion of a rescored submission, and drops those that cancel out.
+
+    Arguments:
+        changes: The rank changes, in the order they happened
+
+    Returns:
+        The net rank changes
+
+    """
+    merged: Dict[Tuple[str, str], RankChange] = {}
+    for change in changes:
+        key = (change.submission_id, change.view)
+        if key in merged:
+            change = change._replace(old_rank=merged[key].old_rank)
+        merged[key] = change
+
+    return [change for change in merged.values() if change.old_rank != change.new_rank]
+
+
+class LeaderboardStore:
+    """
+    The local store of the leaderboard of an evaluation queue, locked for as long as
+    it is open: exclusively to add scores, so that concurrent tasks load, rank, append
+    and annotate one at a time, or shared to only read the rankings.
+
+        with LeaderboardStore(evaluation_id) as store:
+            changes = store.add(entry)
+
+    Arguments:
+        evaluation_id: The ID of the evaluation queue
+        higher_is_better: Whether a higher score ranks first
+        exclusive: Whether to lock the store exclusively, to add scores
+        store_dir: The folder of the store. Defaults to ``LEADERBOARD_STORE``.
+
+    Raises:
+        ValueError: If no folder is given and ``LEADERBOARD_STORE`` is not set
+
+    """
+
+    def __init__(
+        self,
+        evaluation_id: str,
+        higher_is_better: bool = True,
+        exclusive: bool = True,
+        store_dir: Optional[str] = None,
+    ) -> None:
+        self.store_dir = store_dir or STORE_DIR
+        if not self.store_dir:
+            raise ValueError(
+                "LEADERBOARD_STORE must be set to a folder that persists across tasks"
+            )
+        self.evaluation_id = evaluation_id
+        self.higher_is_better = higher_is_better
+        self.exclusive = exclusive
+        self.leaderboard: Optional[Leaderboard] = None
+        self._log_file = None
+        self._unsnapshotted = 0
+
+    def _path(self, suffix: str) -> str:
+        return os.path.join(self.store_dir, f"{self.evaluation_id}{suffix}")
+
+    def __enter__(self) -> "LeaderboardStore":
+        make_private_dir(self.store_dir)
+        self._log_file = open(self._path(".jsonl"), "a+")
+        try:
+            fcntl.flock(self._log_file, fcntl.LOCK_EX if self.exclusive else fcntl.LOCK_SH)
+            self.leaderboard = self._load()
+        except BaseException:
+            self._log_file.close()
+            raise
+
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        # Closing the file releases the lock
+        self._log_file.close()
+
+    def _load(self) -> Leaderboard:
+        try:
+            with open(self._path(".snapshot.json"), "r") as snapshot_file:
+                snapshot = json.load(snapshot_file)
+        except (OSError, ValueError):
+            snapshot = None
+
+        log_size = os.fstat(self._log_file.fileno()).st_size
+        if (
+            snapshot is None
+            or snapshot.get("higher_is_better") != self.higher_is_better
+            or snapshot.get("offset", log_size + 1) > log_size
+        ):
+            snapshot = None
+
+        # Replay the scores appended since the snapshot, or all of them if there is none
+        self._log_file.seek(snapshot["offset"] if snapshot is not None else 0)
+        entries = [Entry(**json.loads(line)) for line in self._log_file if line.strip()]
+        if snapshot is None:
+            leaderboard = Leaderboard.from_entries(entries, self.higher_is_better)
+        else:
+            leaderboard = Leaderboard.from_snapshot(snapshot)
+            for entry in entries:
+                leaderboard.add(entry)
+        self._unsnapshotted = len(entries)
+
+        if self.exclusive and self._unsnapshotted >= SNAPSHOT_INTERVAL:
+            self._write_snapshot(leaderboard)
+
+        return leaderboard
+
+    def _write_snapshot(self, leaderboard: Leaderboard) -> None:
+        # Written to a temporary file and moved into place, so a reader never sees a partial
+        # snapshot. Failing to write it is not an error: the log is replayed instead.
+        snapshot = leaderboard.snapshot()
+        snapshot["offset"] = os.fstat(self._log_file.fileno()).st_size
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.store_dir, suffix=".tmp")
+            with os.fdopen(fd, "w") as tmp_file:
+                json.dump(snapshot, tmp_file)
+            os.replace(tmp_path, self._path(".snapshot.json"))
+            self._unsnapshotted = 0
+        except OSError as e:
+            print(f"Could not write the snapshot of leaderboard {self.evaluation_id}: {e}")
+
+    def add(self, entry: Entry) -> List[RankChange]:
+        """
+        Ranks the score of a submission and appends it to the store.
+
+        Arguments:
+            entry: The scored submission
+
+        Returns:
+            The rank changes, in each ranking. A rank of None means unranked.
+
+        Raises:
+            ValueError: If the store is only locked for reading
+
+        """
+        if not self.exclusive:
+            raise ValueError("Scores can only be added to a store locked exclusively")
+
+        changes = self.leaderboard.add(entry)
+        self._log_file.write(json.dumps(entry._asdict()) + "\n")
+        self._log_file.flush()
+        self._unsnapshotted += 1
+        if self._unsnapshotted >= SNAPSHOT_INTERVAL:
+            self._write_snapshot(self.leaderboard)
+
+        return changes
+
+
+def read_score(results_path: str, score_key: Optional[str] = None) -> Optional[float]:
+    """
+    Reads the score of a submission from its results.json file.
+
+    Arguments:
+        results_path: The path of the results.json file
+        score_key: The score to rank by. Defaults to the mean of all the scores.
+
+    Returns:
+        The score, or None if the submission was not scored or its score is
+        not finite (NaN or infinite scores cannot be ordered)
+
+    """
+    with open(results_path, "r") as results_file:
+        results = json.load(results_file)
+    if results.get("score_status") != SCORED:
+        return None
+
+    if score_key is not None:
+        score = results.get(score_key)
+        if score is None or not math.isfinite(float(score)):
+            return None
+        return float(score)
+
+    scores = [
+        float(value)
+        for key, value in results.items()
+        if key not in NON_SCORE_KEYS
+        and isinstance(value, (int, float))
+        and not isinstance(value, bool)
+    ]
+    if not scores or not all(math.isfinite(score) for score in scores):
+        return None
+    return sum(scores) / len(scores)
+
+
+def annotate_rank_changes(syn: synapseclient.Synapse, changes: List[RankChange]) -> None:
+    """
+    Writes rank changes back to the annotations of the submissions. A submission
+    that left a ranking loses the annotation.
+
+    Arguments:
+        syn: Synapse connection
+        changes: The rank changes
+
+    """
+    by_submission: Dict[str, List[RankChange]] = {}
+    for change in changes:
+        by_submission.setdefault(change.submission_id, []).append(change)
+
+    for submission_id, submission_changes in by_submission.items():
+        status = syn.getSubmissionStatus(submission_id)
+        annotations = status["submissionAnnotations"]
+        for change in submission_changes:
+            if change.new_rank is None:
+                annotations.pop(change.view, None)
+            else:
+                annotations[change.view] = change.new_rank
+        syn.store(status)
+
+
+def get_args():
+    """Set up command-line interface and get arguments."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--lower-is-better",
+        action="store_true",
+        help="Rank lower scores first",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    add_parser = subparsers.add_parser("add", help="Rank the score of a submission")
+    add_parser.add_argument("evaluation_id", type=str, help="The ID of the evaluation queue")
+    add_parser.add_argument("submission_id", type=str, help="The ID of submission")
+    add_parser.add_argument("results", type=str, help="The path to the results.json file")
+    add_parser.add_argument(
+        "--score-key",
+        type=str,
+        default=None,
+        help="The score to rank by (defaults to the mean of all the scores)",
+    )
+    add_parser.add_argument(
+        "--team-id",
+        type=str,
+        default=None,
+        help="The ID of the submitting team or user (looked up on Synapse if not given)",
+    )
+    add_parser.add_argument(
+        "--created-on",
+        type=str,
+        default=None,
+        help="The ISO 8601 submission time (looked up on Synapse if not given)",
+    )
+    add_parser.add_argument(
+        "--annotate",
+        action="store_true",
+        help="Write the rank changes back to the submission annotations",
+    )
+
+    show_parser = subparsers.add_parser("show", help="Print a ranking")
+    show_parser.add_argument("evaluation_id", type=str, help="The ID of the evaluation queue")
+    show_parser.add_argument(
+        "--view", type=str, choices=VIEWS, default=ALL_SUBMISSIONS, help="The ranking to print"
+    )
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    higher_is_better = not args.lower_is_better
+
+    try:
+        if args.command == "show":
+            with LeaderboardStore(args.evaluation_id, higher_is_better, exclusive=False) as store:
+                ranking = store.leaderboard.ranking(args.view)
+            for rank, entry in enumerate(ranking, start=1):
+                print(f"{rank}\t{entry.submission_id}\t{entry.team_id}\t{entry.score}")
+            raise SystemExit(0)
+
+        store = LeaderboardStore(args.evaluation_id, higher_is_better)
+    except ValueError as e:
+        raise SystemExit(f"Error: {e}")
+
+    score = read_score(args.results, args.score_key)
+    if score is None:
+        print(f"Submission {args.submission_id} was not scored, and is not ranked")
+        raise SystemExit(0)
+
+    syn = None
+    team_id, created_on = args.team_id, args.created_on
+    if team_id is None or created_on is None or args.annotate:
+        syn = synapse_gateway.login(silent=True)
+    if team_id is None or created_on is None:
+        submission = metadata_cache.get_submission(syn, args.submission_id)
+        team_id = team_id or str(submission.get("teamId") or submission.get("userId"))
+        created_on = created_on or submission.get("createdOn", "")
+
+    entry = Entry(args.submission_id, team_id, score, created_on)
+    # The annotations are written before the store is unlocked, so that a concurrent
+    # task cannot annotate ranks computed from an older leaderboard over these
+    with store:
+        changes = store.add(entry)
+
+        for change in changes:
+            print(
+                f"{change.submission_id}\t{change.view}\t{change.old_rank} -> {change.new_rank}"
+            )
+        if args.annotate:
+            annotate_rank_changes(syn, changes)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+This module provides a fixed-size buffer for Docker container logs.
+
+The buffer keeps the first ``head_size`` bytes and the last ``tail_size`` bytes
+written to it, and counts the bytes dropped in between, so memory use stays
+constant regardless of how much a submission container prints.
+"""
+
+from typing import Union
+
+# Room reserved for the truncation marker, so that the buffered output never
+# exceeds the size requested in ``LogBuffer.from_max_size``
+MARKER_MAX_SIZE = 64
+
+
+class LogBuffer:
+    """
+    A head + tail byte buffer.
+
+    Arguments:
+        head_size: Number of bytes to keep from the start of the stream
+        tail_size: Number of bytes to keep from the end of the stream
+
+    """
+
+    def __init__(self, head_size: int, tail_size: int) -> None:
+        self.head_size = max(int(head_size), 0)
+        self.tail_size = max(int(tail_size), 0)
+        self.total_bytes = 0
+        self._head = bytearray()
+        self._tail = bytearray()
+
+    @classmethod
+    def from_max_size(cls, max_size: int, head_fraction: float = 0.25) -> "LogBuffer":
+        """
+        Creates a buffer whose output (truncation marker included) is at most
+        ``max_size`` bytes, of which ``head_fraction`` is kept from the start of the stream.
+
+        Arguments:
+            max_size: The maximum number of bytes held by the buffer
+            head_fraction: The share of ``max_size`` kept from the start of the stream
+
+        Returns:
+            A new, empty LogBuffer
+
+        """
+        max_size = max(max_size - MARKER_MAX_SIZE, 0)
+        head_size = int(max_size * head_fraction)
+        return cls(head_size=head_size, tail_size=max_size - head_size)
+
+    @property
+    def dropped_bytes(self) -> int:
+        """The number of bytes written to the buffer but not kept."""
+        return self.total_bytes - len(self._head) - len(self._tail)
+
+    def write(self, chunk: Union[str, bytes]) -> None:
+        """
+        Adds a chunk of log output to the buffer.
+
+        Arguments:
+            chunk: The log output to add. Strings are encoded as UTF-8.
+
+        """
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+        self.total_bytes += len(chunk)
+
+        # Fill the head first
+        head_room = self.head_size - len(self._head)
+        if head_room > 0:
+            self._head += chunk[:head_room]
+            chunk = chunk[head_room:]
+
+        if not chunk or self.tail_size == 0:
+            return
+
+        # Only the last ``tail_size`` bytes of the chunk can survive
+        if len(chunk) >= self.tail_size:
+            self._tail[:] = chunk[-self.tail_size :]
+        else:
+            self._tail += chunk
+            excess = len(self._tail) - self.tail_size
+            if excess > 0:
+                del self._tail[:excess]
+
+    def getvalue(self) -> bytes:
+        """
+        Returns the buffered log output. If any bytes were dropped, a marker
+        stating how many is placed between the head and the tail.
+
+        Returns:
+            The buffered log output, in bytes
+
+        """
+        if not self.dropped_bytes:
+            return bytes(self._head + self._tail)
+
+        marker = f"\n\n... [{self.dropped_bytes} bytes truncated] ...\n\n".encode("utf-8")
+        return bytes(self._head) + marker + bytes(self._tail)
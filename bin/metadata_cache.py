@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+This module caches Synapse submission and evaluation metadata on disk, so that
+the scripts processing a submission share one Synapse round trip instead of
+each calling ``syn.getSubmission`` / ``syn.getEvaluation`` again.
+
+Entries are JSON files under ``SYNAPSE_METADATA_CACHE`` (``/tmp/synapse_metadata_cache``
+by default) and expire after ``SYNAPSE_METADATA_CACHE_TTL`` seconds (one hour by
+default). Tasks only share entries if that folder is the same for all of them: on
+AWS Batch, ``aws.batch.volumes`` mounts the host's ``/tmp`` into every task, but
+with the local Docker profile each task has its own ``/tmp``, so point
+``SYNAPSE_METADATA_CACHE`` at a folder mounted into every task instead. The
+folder must belong to the user running the tasks (see ``cache_dir``).
+
+The cache can be warmed for a whole evaluation queue from one paginated
+submission bundle listing:
+
+    metadata_cache.py <evaluation_id> [status]
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Optional
+
+import synapseclient
+
+import synapse_gateway
+from cache_dir import check_private_dir, make_private_dir
+
+CACHE_DIR = os.environ.get(
+    "SYNAPSE_METADATA_CACHE",
+    os.path.join(tempfile.gettempdir(), "synapse_metadata_cache"),
+)
+CACHE_TTL = float(os.environ.get("SYNAPSE_METADATA_CACHE_TTL", 3600))
+
+
+def _cache_path(kind: str, key: str) -> str:
+    return os.path.join(CACHE_DIR, f"{kind}_{key}.json")
+
+
+def read_cache(kind: str, key: str, ttl: float = CACHE_TTL) -> Optional[dict]:
+    """
+    Reads a cached entry.
+
+    Arguments:
+        kind: The kind of entry, e.g. 'submission' or 'evaluation'
+        key: The ID of the entry
+        ttl: The age (in seconds) after which the entry is considered stale
+
+    Returns:
+        The cached metadata, or None if it is missing, stale or unreadable, or if the
+        cache folder cannot be trusted
+
+    """
+    try:
+        check_private_dir(CACHE_DIR)
+        with open(_cache_path(kind, key), "r") as cache_file:
+            entry = json.load(cache_file)
+    except (OSError, ValueError):
+        return None
+
+    if time.time() - entry.get("cached_at", 0) > ttl:
+        return None
+
+    return entry.get("data")
+
+
+def write_cache(kind: str, key: str, data: dict) -> None:
+    """
+    Writes an entry to the cache. The entry is written to a temporary file and
+    moved into place, so concurrent readers never see a partial file. Failing to
+    write the cache is not an error.
+
+    Arguments:
+        kind: The kind of entry, e.g. 'submission' or 'evaluation'
+        key: The ID of the entry
+        data: The metadata to cache
+
+    """
+    try:
+        make_private_dir(CACHE_DIR)
+        fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+        with os.fdopen(fd, "w") as tmp_file:
+            json.dump({"cached_at": time.time(), "data": data}, tmp_file)
+        os.replace(tmp_path, _cache_path(kind, key))
+    except OSError as e:
+        print(f"Could not write {kind} {key} to the metadata cache: {e}")
+
+
+def get_submission(syn: synapseclient.Synapse, submission_id: str) -> dict:
+    """
+    Retrieves the metadata of a submission (evaluationId, teamId, userId,
+    dockerRepositoryName, dockerDigest, entityBundleJSON, ...), from the cache
+    if possible. The submitted file itself is never downloaded.
+
+    Arguments:
+        syn: Synapse connection
+        submission_id: The ID of the submission
+
+    Returns:
+        The submission metadata, as returned by the Synapse REST API
+
+    """
+    submission = read_cache("submission", str(submission_id))
+    if submission is None:
+        submission = syn.restGET(f"/evaluation/submission/{submission_id}")
+        write_cache("submission", str(submission_id), submission)
+
+    return submission
+
+
+def get_evaluation(syn: synapseclient.Synapse, evaluation_id: str) -> dict:
+    """
+    Retrieves the metadata of an evaluation queue (name, contentSource, ...),
+    from the cache if possible.
+
+    Arguments:
+        syn: Synapse connection
+        evaluation_id: The ID of the evaluation queue
+
+    Returns:
+        The evaluation metadata, as returned by the Synapse REST API
+
+    """
+    evaluation = read_cache("evaluation", str(evaluation_id))
+    if evaluation is None:
+        evaluation = syn.restGET(f"/evaluation/{evaluation_id}")
+        write_cache("evaluation", str(evaluation_id), evaluation)
+
+    return evaluation
+
+
+def warm_evaluation(
+    syn: synapseclient.Synapse,
+    evaluation_id: str,
+    status: Optional[str] = None,
+    limit: int = 100,
+) -> int:
+    """
+    Caches the metadata of an evaluation queue and of all its submissions, from
+    one paginated listing of the queue's submission bundles.
+
+    Arguments:
+        syn: Synapse connection
+        evaluation_id: The ID of the evaluation queue
+        status: Only cache the submissions with this status, e.g. 'RECEIVED'
+        limit: The page size of the listing
+
+    Returns:
+        The number of submissions cached
+
+    """
+    get_evaluation(syn, evaluation_id)
+
+    uri = f"/evaluation/{evaluation_id}/submission/bundle/all"
+    if status:
+        uri = f"/evaluation/{evaluation_id}/submission/bundle?status={status}"
+
+    cached = 0
+    offset = 0
+    while True:
+        separator = "&" if "?" in uri else "?"
+        page = syn.restGET(f"{uri}{separator}limit={limit}&offset={offset}")
+        results = page.get("results", [])
+        for bundle in results:
+            submission = bundle["submission"]
+            write_cache("submission", str(submission["id"]), submission)
+            cached += 1
+
+        offset += limit
+        if not results or offset >= page.get("totalNumberOfResults", 0):
+            break
+
+    print(f"Cached {cached} submissions of evaluation {evaluation_id}")
+
+    return cached
+
+
+if __name__ == "__main__":
+    evaluation_id = sys.argv[1]
+    status = sys.argv[2] if len(sys.argv) > 2 else None
+
+    syn = synapse_gateway.login(silent=True)
+    warm_evaluation(syn, evaluation_id, status=status)
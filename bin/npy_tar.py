@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+This module reads the ``.npy`` members of a predictions tarball in place,
+without extracting them to disk.
+
+``index_tar`` records where the data of each member starts in the archive. The
+members of an uncompressed tarball are then memory-mapped at that offset, so
+only the pages a metric reads are loaded. The members of a compressed tarball
+(gzip, bz2, xz) cannot be mapped: ``uncompressed_tar`` decompresses the whole
+tarball once, into a temporary uncompressed tarball whose members can be. Reading
+the members of the compressed tarball one by one would decompress it from its
+start for each of them.
+"""
+
+import bz2
+import contextlib
+import gzip
+import lzma
+import os
+import shutil
+import tarfile
+import tempfile
+import zlib
+from typing import BinaryIO, Callable, Dict, Iterator, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+# The magic numbers of the compression formats tarfile reads, and how to open them
+DECOMPRESSORS = {
+    b"\x1f\x8b": gzip.open,
+    b"BZh": bz2.open,
+    b"\xfd7zXZ\x00": lzma.open,
+}
+
+# Size of the chunks copied when decompressing a tarball
+COPY_CHUNK_SIZE = 1024**2
+
+
+class NpyMember(NamedTuple):
+    name: str
+    offset: int
+    size: int
+    compressed: bool
+
+
+class NpyHeader(NamedTuple):
+    shape: Tuple[int, ...]
+    fortran_order: bool
+    dtype: np.dtype
+    data_offset: int
+
+
+def index_tar(tar_filename: str, pattern: str = ".npy") -> Dict[str, NpyMember]:
+    """
+    Indexes the regular file members of a tarball whose name ends with ``pattern``.
+    Members are keyed by their base name, as if the tarball was extracted flat:
+    a later member with the same base name replaces an earlier one.
+
+    Arguments:
+        tar_filename: The path of the tarball
+        pattern: The suffix of the members to index
+
+    Returns:
+        The members, by base name
+
+    Raises:
+        tarfile.TarError: If the file is not a valid tarball
+
+    """
+    compressed = _is_compressed(tar_filename)
+    with tarfile.open(tar_filename, "r:*") as tar_f:
+        members = {}
+        for member in tar_f.getmembers():
+            if member.isfile() and member.name.endswith(pattern):
+                members[member.name.rsplit("/", 1)[-1]] = NpyMember(
+                    name=member.name,
+                    offset=member.offset_data,
+                    size=member.size,
+                    # Sparse members are not stored contiguously, so they are streamed too
+                    compressed=compressed or member.issparse(),
+                )
+
+    return members
+
+
+def _get_decompressor(tar_filename: str) -> Optional[Callable]:
+    with open(tar_filename, "rb") as fp:
+        magic = fp.read(max(len(magic) for magic in DECOMPRESSORS))
+    return next(
+        (opener for magic_number, opener in DECOMPRESSORS.items() if magic.startswith(magic_number)),
+        None,
+    )
+
+
+def _is_compressed(tar_filename: str) -> bool:
+    return _get_decompressor(tar_filename) is not None
+
+
+@contextlib.contextmanager
+def uncompressed_tar(tar_filename: str) -> Iterator[str]:
+    """
+    Provides an uncompressed version of a tarball, so that its members can be
+    memory-mapped: the tarball itself if it is not compressed, otherwise a copy
+    decompressed once, next to it. The copy is removed on exit.
+
+    Arguments:
+        tar_filename: The path of the tarball
+
+    Yields:
+        The path of the uncompressed tarball
+
+    Raises:
+        tarfile.ReadError: If the tarball cannot be decompressed
+
+    """
+    opener = _get_decompressor(tar_filename)
+    if opener is None:
+        yield tar_filename
+        return
+
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(tar_filename)), suffix=".tar"
+    )
+    try:
+        try:
+            with os.fdopen(fd, "wb") as tmp_file, opener(tar_filename, "rb") as compressed_file:
+                shutil.copyfileobj(compressed_file, tmp_file, COPY_CHUNK_SIZE)
+        except (EOFError, zlib.error, lzma.LZMAError, gzip.BadGzipFile) as e:
+            raise tarfile.ReadError(f"{tar_filename} cannot be decompressed: {e}") from e
+        except OSError as e:
+            # bz2 reports invalid data as an OSError
+            if e.errno is not None:
+                raise
+            raise tarfile.ReadError(f"{tar_filename} cannot be decompressed: {e}") from e
+        yield tmp_path
+    finally:
+        os.remove(tmp_path)
+
+
+def _read_header(fp: BinaryIO) -> Tuple[Tuple[int, ...], bool, np.dtype]:
+    version = np.lib.format.read_magic(fp)
+    if version == (1, 0):
+        return np.lib.format.read_array_header_1_0(fp)
+    return np.lib.format.read_array_header_2_0(fp)
+
+
+def read_header(tar_filename: str, member: NpyMember) -> NpyHeader:
+    """
+    Reads the NPY header of a member, without reading the array itself.
+
+    Arguments:
+        tar_filename: The path of the tarball
+        member: The member, as returned by ``index_tar``
+
+    Returns:
+        The shape, memory order and dtype of the array, and the offset of its data
+        from the start of the member
+
+    Raises:
+        ValueError: If the member is not a valid NPY file
+
+    """
+    if member.compressed:
+        with tarfile.open(tar_filename, "r:*") as tar_f:
+            fp = tar_f.extractfile(member.name)
+            shape, fortran_order, dtype = _read_header(fp)
+            return NpyHeader(shape, fortran_order, dtype, fp.tell())
+
+    with open(tar_filename, "rb") as fp:
+        fp.seek(member.offset)
+        shape, fortran_order, dtype = _read_header(fp)
+        return NpyHeader(shape, fortran_order, dtype, fp.tell() - member.offset)
+
+
+def read_file_header(npy_filename: str) -> NpyHeader:
+    """
+    Reads the header of a NPY file, without reading the array itself.
+
+    Arguments:
+        npy_filename: The path of the NPY file
+
+    Returns:
+        The shape, memory order and dtype of the array, and the offset of its data
+
+    Raises:
+        ValueError: If the file is not a valid NPY file
+
+    """
+    with open(npy_filename, "rb") as fp:
+        shape, fortran_order, dtype = _read_header(fp)
+        return NpyHeader(shape, fortran_order, dtype, fp.tell())
+
+
+def check_header(member: NpyMember, header: NpyHeader) -> int:
+    """
+    Checks that the array described by a header can be loaded from a member.
+
+    Arguments:
+        member: The member, as returned by ``index_tar``
+        header: The header of the member
+
+    Returns:
+        The number of elements of the array
+
+    Raises:
+        ValueError: If the array holds Python objects, or the member is truncated
+
+    """
+    if header.dtype.hasobject:
+        raise ValueError(f"{member.name} holds Python objects, which cannot be loaded")
+
+    count = int(np.prod(header.shape, dtype=np.int64))
+    if header.data_offset + count * header.dtype.itemsize > member.size:
+        raise ValueError(f"{member.name} is truncated")
+
+    return count
+
+
+def load_member(
+    tar_filename: str, member: NpyMember, header: Optional[NpyHeader] = None
+) -> np.ndarray:
+    """
+    Loads the array of a member: memory-mapped in place if the tarball is
+    uncompressed, streamed into memory otherwise. Use ``uncompressed_tar`` to load
+    several members of a compressed tarball.
+
+    Arguments:
+        tar_filename: The path of the tarball
+        member: The member, as returned by ``index_tar``
+        header: The header of the member, read if not given
+
+    Returns:
+        The array (read-only if memory-mapped)
+
+    Raises:
+        ValueError: If the member is not a valid NPY file, is truncated, or holds Python objects
+
+    """
+    if member.compressed:
+        with tarfile.open(tar_filename, "r:*") as tar_f:
+            fp = tar_f.extractfile(member.name)
+            shape, fortran_order, dtype = _read_header(fp)
+            header = NpyHeader(shape, fortran_order, dtype, fp.tell())
+            check_header(member, header)
+            order = "F" if header.fortran_order else "C"
+            array = np.empty(header.shape, dtype=header.dtype, order=order)
+
+            # Stream the data straight into the array
+            buffer = memoryview(array.reshape(-1, order=order)).cast("B")
+            read = 0
+            while read < len(buffer):
+                chunk = fp.readinto(buffer[read:])
+                if not chunk:
+                    raise ValueError(f"{member.name} is truncated")
+                read += chunk
+            return array
+
+    if header is None:
+        header = read_header(tar_filename, member)
+    order = "F" if header.fortran_order else "C"
+
+    # Empty arrays cannot be memory-mapped
+    if check_header(member, header) == 0:
+        return np.empty(header.shape, dtype=header.dtype, order=order)
+
+    return np.memmap(
+        tar_filename,
+        dtype=header.dtype,
+        mode="r",
+        offset=member.offset + header.data_offset,
+        shape=header.shape,
+        order=order,
+    )
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+This module enforces a size quota on the output directory of a submission
+container. The directory is measured at a fixed interval while the container
+runs, and the container is stopped as soon as the quota is exceeded, before it
+can fill the disk of the host.
+"""
+
+import os
+import threading
+from typing import Optional, Union
+
+import docker
+
+# Time (in seconds) between two measurements of the output directory
+CHECK_INTERVAL = 5
+
+
+def get_directory_size(path: str) -> int:
+    """
+    Returns the disk space used by the files under a directory. Allocated blocks
+    are counted rather than file sizes, so sparse files count for what they use.
+    Symbolic links are not followed.
+
+    Arguments:
+        path: The directory to measure
+
+    Returns:
+        The disk space used, in bytes
+
+    """
+    total_size = 0
+    directories = [path]
+    while directories:
+        try:
+            entries = list(os.scandir(directories.pop()))
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    directories.append(entry.path)
+                else:
+                    total_size += entry.stat(follow_symlinks=False).st_blocks * 512
+            except OSError:
+                continue
+
+    return total_size
+
+
+class OutputQuotaWatcher:
+    """
+    Stops a container once the directory mounted as its /output grows past a quota.
+
+    Arguments:
+        container: The Docker container to watch
+        output_path: The host directory mounted as /output
+        max_size: The quota, in bytes
+        interval: Time (in seconds) between two measurements
+
+    Attributes:
+        message: The reason the container was stopped, or an empty string if it was not
+
+    """
+
+    def __init__(
+        self,
+        container: docker.models.containers.Container,
+        output_path: str,
+        max_size: int,
+        interval: Union[int, float] = CHECK_INTERVAL,
+    ) -> None:
+        self.container = container
+        self.output_path = output_path
+        self.max_size = max_size
+        self.interval = interval
+        self.message = ""
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _watch(self) -> None:
+        while not self._stopped.wait(self.interval):
+            output_size = get_directory_size(self.output_path)
+            if output_size <= self.max_size:
+                continue
+
+            self.message = (
+                f"Container exceeded the output size limit of {self.max_size / 1024**3:.2f} GB "
+                f"({output_size} bytes written to /output). Unable to process."
+            )
+            print("Output size limit exceeded. Stopping container.")
+            try:
+                self.container.kill()
+            except docker.errors.APIError as e:
+                print(f"Could not stop container: {e}")
+            return
+
+    def start(self) -> None:
+        """Starts watching the output directory in a background thread."""
+        self._thread = threading.Thread(target=self._watch, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stops watching the output directory."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
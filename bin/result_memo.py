@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+This module memoizes the outputs of submission runs and the results of scoring
+passes, so that a resubmission of identical content (the same image digest, or
+the same predictions file) reuses them instead of being run or scored again.
+
+Entries are folders under ``RESULT_MEMO`` (``/tmp/result_memo`` by default),
+named after a key that combines what the outputs depend on, e.g. the image
+digest, the version of the input data, and ``MEMO_VERSION``. A task can only
+reuse what another task recorded if both see the same ``RESULT_MEMO`` folder:
+the host's ``/tmp`` is mounted into the tasks on AWS Batch
+(``aws.batch.volumes``), but not by the local Docker profile. Since an entry is
+trusted as is, ``RESULT_MEMO`` must belong to the current user and be writable
+by nobody else; otherwise nothing is looked up or recorded. Each entry holds a ``memo.json`` file (the
+ID of the submission it was recorded for, and any result) next to its files.
+Entries are written to a temporary folder and renamed into place, so a reader
+never sees a partial entry.
+
+Only complete, valid outputs should be memoized: an entry is reused as is.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import Dict, Iterable, NamedTuple, Optional
+
+from cache_dir import check_private_dir, make_private_dir
+from truth_cache import file_digest
+
+MEMO_DIR = os.environ.get(
+    "RESULT_MEMO",
+    os.path.join(tempfile.gettempdir(), "result_memo"),
+)
+MEMO_VERSION = 1
+
+MEMO_FILE_NAME = "memo.json"
+
+
+class MemoEntry(NamedTuple):
+    path: str
+    submission_id: str
+    result: dict
+    files: Dict[str, str]
+
+
+def memo_key(**parts) -> str:
+    """
+    Combines what memoized outputs depend on into a key.
+
+    Arguments:
+        parts: The values the outputs depend on, e.g. image='repo@sha256:...', input='...'
+
+    Returns:
+        The hexadecimal SHA-256 of the parts
+
+    """
+    return hashlib.sha256(
+        json.dumps({"version": MEMO_VERSION, **parts}, sort_keys=True).encode()
+    ).hexdigest()
+
+
+def directory_digest(path: str) -> str:
+    """
+    Returns a digest of the content of a folder (symbolic links are followed).
+    The digest of each file is recorded along with its size and modification
+    time (see ``truth_cache.file_digest``), so unchanged files are only hashed once.
+
+    Arguments:
+        path: The path of the folder
+
+    Returns:
+        The hexadecimal SHA-256 of the relative paths and digests of the files
+
+    """
+    sha256 = hashlib.sha256()
+    for root, dirs, files in os.walk(path, followlinks=True):
+        dirs.sort()
+        for file_name in sorted(files):
+            file_path = os.path.join(root, file_name)
+            relative_path = os.path.relpath(file_path, path)
+            sha256.update(f"{relative_path}\0{file_digest(file_path)}\n".encode())
+
+    return sha256.hexdigest()
+
+
+def code_version(module_files: Iterable[str]) -> str:
+    """
+    Returns a digest of the source code the outputs are computed with.
+
+    Arguments:
+        module_files: The paths of the source files, e.g. ``module.__file__``
+
+    Returns:
+        The hexadecimal SHA-256 of the source files
+
+    """
+    sha256 = hashlib.sha256()
+    for module_file in module_files:
+        with open(module_file, "rb") as source_file:
+            sha256.update(hashlib.sha256(source_file.read()).digest())
+
+    return sha256.hexdigest()
+
+
+def link_or_copy(source: str, destination: str) -> None:
+    """Hard-links a file, or copies it if it is on another file system."""
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+def lookup(key: str) -> Optional[MemoEntry]:
+    """
+    Looks up a memo entry. Failing to read it, or a ``MEMO_DIR`` that cannot be
+    trusted (see ``cache_dir.check_private_dir``), is not an error: it is then a miss.
+
+    Arguments:
+        key: The key of the entry, as returned by ``memo_key``
+
+    Returns:
+        The entry, or None if there is none
+
+    """
+    entry_path = os.path.join(MEMO_DIR, key)
+    try:
+        check_private_dir(MEMO_DIR)
+        with open(os.path.join(entry_path, MEMO_FILE_NAME), "r") as memo_file:
+            memo = json.load(memo_file)
+    except (OSError, ValueError):
+        return None
+
+    files = {
+        file_name: os.path.join(entry_path, file_name)
+        for file_name in memo.get("files", [])
+    }
+    if not all(os.path.isfile(file_path) for file_path in files.values()):
+        return None
+
+    return MemoEntry(entry_path, memo.get("submission_id", ""), memo.get("result", {}), files)
+
+
+def store(
+    key: str,
+    submission_id: str,
+    result: Optional[dict] = None,
+    files: Iterable[str] = (),
+) -> None:
+    """
+    Records a memo entry. An existing entry is kept, and failing to write the
+    entry is not an error.
+
+    Arguments:
+        key: The key of the entry, as returned by ``memo_key``
+        submission_id: The ID of the submission the outputs were computed for
+        result: The result to record, e.g. the scores
+        files: The paths of the output files to record, by hard link or copy
+
+    """
+    entry_path = os.path.join(MEMO_DIR, key)
+    if os.path.exists(entry_path):
+        return
+
+    tmp_path = None
+    try:
+        make_private_dir(MEMO_DIR)
+        tmp_path = tempfile.mkdtemp(dir=MEMO_DIR, suffix=".tmp")
+        file_names = []
+        for file_path in files:
+            file_name = os.path.basename(file_path)
+            link_or_copy(file_path, os.path.join(tmp_path, file_name))
+            file_names.append(file_name)
+
+        memo = {"submission_id": submission_id, "result": result or {}, "files": file_names}
+        with open(os.path.join(tmp_path, MEMO_FILE_NAME), "w") as memo_file:
+            json.dump(memo, memo_file)
+
+        os.rename(tmp_path, entry_path)
+        tmp_path = None
+    except OSError as e:
+        # Another task may have recorded the same entry first
+        if not os.path.exists(entry_path):
+            print(f"Could not record the outputs of submission {submission_id}: {e}")
+    finally:
+        if tmp_path is not None:
+            shutil.rmtree(tmp_path, ignore_errors=True)
@@ -12,22 +12,58 @@ https://github.com/Sage-Bionetworks-Challenges/model-to-data-challenge-workflow/
 
 
 import os
-import sys
+import re
 import json
 import time
+import argparse
+import shutil
+import threading
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
 from glob import glob
 from typing import (
     Optional,
     Union,
     List,
     NamedTuple,
+    Tuple,
 )
-from zipfile import ZipFile
+from zipfile import BadZipFile, ZipFile
 
 import docker
+import requests
 import synapseclient
 
 import helpers
+import metadata_cache
+import result_memo
+import synapse_gateway
+from container_metrics import ContainerMetrics, record_stats
+from image_cache import ImageCache
+from image_prefetch import ImagePrefetcher
+from image_preflight import (
+    ImageLimits,
+    ImageRejected,
+    check_uncompressed_size,
+    preflight_image,
+)
+from log_buffer import LogBuffer
+from output_quota import OutputQuotaWatcher
+
+
+# Limits applied when checking a zipped output file, before anything is extracted
+ZIP_MAX_UNCOMPRESSED_SIZE = 10 * 1024**3
+ZIP_MAX_MEMBERS = 10000
+ZIP_MAX_COMPRESSION_RATIO = 100
+ZIP_READ_CHUNK_SIZE = 1024**2
+
+# Maximum number of processes a submission container can create
+CONTAINER_PIDS_LIMIT = 1024
+
+# Labels identifying the submission (and the workflow run) a container was started for
+SUBMISSION_LABEL = "org.sagebionetworks.challenge.submission_id"
+RUN_LABEL = "org.sagebionetworks.challenge.run_id"
 
 
 class UpdatedMessages(NamedTuple):
@@ -52,7 +88,7 @@ def get_entity_type(syn: synapseclient.Synapse, submission_id: str) -> str:
         Entity type of the submission
 
     """
-    file_handle = syn.getSubmission(submission_id)
+    file_handle = metadata_cache.get_submission(syn, submission_id)
     entity_bundle = json.loads(file_handle.get("entityBundleJSON"))
     entity_type = entity_bundle.get("entityType")
 
@@ -73,7 +109,7 @@ def get_submission_image(syn: synapseclient.Synapse, submission_id: str) -> str:
         ValueError: If submission has no associated Docker image
 
     """
-    submission = syn.getSubmission(submission_id)
+    submission = metadata_cache.get_submission(syn, submission_id)
     docker_repository = submission.get("dockerRepositoryName", None)
     docker_digest = submission.get("dockerDigest", None)
     if not docker_digest or not docker_repository:
@@ -106,6 +142,80 @@ def make_invalid_output(file_name: str, log_file_path: str, file_content: str) -
     return invalid_file
 
 
+def inspect_zip_file(
+    file: str,
+    max_uncompressed_size: int = ZIP_MAX_UNCOMPRESSED_SIZE,
+    max_members: int = ZIP_MAX_MEMBERS,
+    max_compression_ratio: float = ZIP_MAX_COMPRESSION_RATIO,
+) -> Tuple[bool, Optional[str]]:
+    """
+    Checks a zipped output file by decompressing each member in memory, chunk by
+    chunk, without writing anything to disk. The sizes recorded in the zip directory
+    are not trusted: the checks are made on the bytes actually decompressed.
+
+    The archive is rejected if it is corrupt (including CRC mismatches), has more than
+    ``max_members`` files, decompresses to more than ``max_uncompressed_size`` bytes, or
+    has a member whose compression ratio passes ``max_compression_ratio``.
+
+    Arguments:
+        file: The path to the zip file
+        max_uncompressed_size: The maximum number of decompressed bytes, across all members
+        max_members: The maximum number of files in the archive
+        max_compression_ratio: The maximum ratio of decompressed to compressed size of a member
+
+    Returns:
+        has_empty_member: Whether any file in the archive is empty
+        error_message: The reason the archive was rejected, or None if it was not
+
+    """
+    file_name = os.path.basename(file)
+    has_empty_member = False
+    total_size = 0
+
+    try:
+        with ZipFile(file, "r") as zipfile:
+            members = [zip_info for zip_info in zipfile.infolist() if not zip_info.is_dir()]
+            if len(members) > max_members:
+                return has_empty_member, (
+                    f"Could not evaluate because {file_name} contains {len(members)} files. "
+                    f"The maximum is {max_members}"
+                )
+
+            for zip_info in members:
+                member_size = 0
+                # Reading a member to its end verifies its CRC
+                with zipfile.open(zip_info, "r") as member:
+                    while True:
+                        chunk = member.read(ZIP_READ_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        member_size += len(chunk)
+                        total_size += len(chunk)
+
+                        if total_size > max_uncompressed_size:
+                            return has_empty_member, (
+                                f"Could not evaluate because {file_name} decompresses to more than "
+                                f"{max_uncompressed_size} bytes"
+                            )
+                        # Small members are allowed to compress well
+                        if (
+                            member_size > ZIP_READ_CHUNK_SIZE
+                            and member_size > max_compression_ratio * max(zip_info.compress_size, 1)
+                        ):
+                            return has_empty_member, (
+                                f"Could not evaluate because {zip_info.filename} in {file_name} has a "
+                                f"compression ratio above {max_compression_ratio}"
+                            )
+
+                if member_size == 0:
+                    has_empty_member = True
+
+    except (BadZipFile, zlib.error, EOFError, NotImplementedError, RuntimeError) as e:
+        return has_empty_member, f"Could not evaluate because {file_name} is not a valid zip file: {e}"
+
+    return has_empty_member, None
+
+
 def check_output_file_size(
     file_list: List[str],
     log_text: str,
@@ -115,7 +225,9 @@ def check_output_file_size(
     Checks if the given output file generated from the Docker submission is empty.
     This function handles the following cases:
     1. If the output file is empty, it will update and return the log_text and bad_output_msg inputs
-    2. If the output file is not empty, it will return the log_text and bad_output_msg inputs
+    2. If the output file is a zip file that fails ``inspect_zip_file``, it will update and return
+    the log_text and bad_output_msg inputs with the reason
+    3. Otherwise, it will return the log_text and bad_output_msg inputs
     as they were fed into the function call originally
 
     Arguments:
@@ -134,29 +246,31 @@ def check_output_file_size(
 
     # Check output files that are zipped into a single file
     if ".zip" in os.path.basename(file):
-        with ZipFile(file, "r") as zipfile:
-            incorrect_size = any(
-                zip_info.file_size == 0
-                for zip_info in zipfile.infolist()
-                if not zip_info.is_dir()
-            )
+        incorrect_size, zip_error = inspect_zip_file(file)
+        if zip_error:
+            bad_output_msg = zip_error
 
     # Check output files that are not zipped
     else:
         incorrect_size = True if os.path.getsize(file) == 0 else False
 
     # Next, update the log_text and bad_output_msg inputs, if necessary
-    if incorrect_size:
+    if incorrect_size and not bad_output_msg:
         bad_output_msg = f"Could not evaluate because one or more output files are empty: {os.path.basename(file)}"
+
+    if bad_output_msg:
         if isinstance(log_text, bytes):
             log_text = log_text.decode("utf-8")
-            log_text = log_text + "\n" + bad_output_msg
+        log_text = log_text + "\n" + bad_output_msg
 
     return UpdatedMessages(log_message=log_text, error_message=bad_output_msg)
 
 
 def handle_outputs(
-    output_path: str, output_file_name: str, log_text: str
+    output_path: str,
+    output_file_name: str,
+    log_text: str,
+    exit_message: Optional[str] = None,
 ) -> NamedTuple:
     """
     Handles any output files generated by the submitted Docker container:
@@ -168,6 +282,8 @@ def handle_outputs(
         output_file_name: The name of the output file.
         log_text: The log text to be updated, if an incorrect number of
                   output files were found.
+        exit_message: How the container failed (e.g. a non-zero exit code), if it did.
+                      It is put in front of the bad output message, if there is one.
 
     Returns:
         output_file: The path to the output file.
@@ -193,6 +309,10 @@ def handle_outputs(
         log_text = updated_messages.log_message
         bad_output_msg = updated_messages.error_message
 
+    # Lead with the reason the container failed, if it did
+    if bad_output_msg and exit_message:
+        bad_output_msg = f"{exit_message} {bad_output_msg}"
+
     # If the output file is empty or an incorrect number of output files were generated, create an INVALID output file
     # to carry on in the workflow, and notify the user of the inconsistency
     output_file = (
@@ -218,7 +338,8 @@ def create_log_file(
     Creates the Docker submission execution log file.
 
     This function creates a log file with the given name and writes the given text to it.
-    If no text is given, it writes "No Logs" to the file.
+    If no text is given, it writes "No Logs" to the file. Text larger than ``log_max_size``
+    is truncated to its first and last bytes so the file stays within the limit.
 
     Arguments:
         log_file_name: The name of the log file to create
@@ -231,31 +352,21 @@ def create_log_file(
     if log_file_path is None:
         log_file_path = os.getcwd()
 
-    # Get the size of the log text
+    # Get the size of the log text, in bytes
     log_text = log_text or "No Logs"
-    log_text_size = (
-        len(log_text)
-        if isinstance(log_text, bytes)
-        else len(str(log_text).encode("utf-8"))
-    )
-
-    # Decode the log text if it is bytes
-    log_text = (
-        log_text.decode("utf-8", "ignore") if isinstance(log_text, bytes) else log_text
-    )
+    log_bytes = log_text if isinstance(log_text, bytes) else str(log_text).encode("utf-8")
+    log_text_size = len(log_bytes)
 
-    # Truncate the log message if it exceeds the maximum size
+    # Truncate the log message if it exceeds the maximum size, keeping
+    # its start and its end
     if log_text_size > log_max_size * 1000:
         print(f"Original log message exceeds {log_max_size} Kb. Truncating...")
-        log_text = log_text[-(log_max_size * 1000) :]
+        log_buffer = LogBuffer.from_max_size(log_max_size * 1000)
+        log_buffer.write(log_bytes)
+        log_bytes = log_buffer.getvalue()
 
-    with open(
-        os.path.join(log_file_path, log_file_name),
-        "w",
-        encoding="utf-8",
-        errors="ignore",
-    ) as log_file:
-        log_file.write(log_text)
+    with open(os.path.join(log_file_path, log_file_name), "wb") as log_file:
+        log_file.write(log_bytes)
 
     # Add some print statements to notify those monitoring the workflow
     if log_text_size <= log_max_size * 1000:
@@ -264,7 +375,37 @@ def create_log_file(
         print(f"Truncated log file created: {log_file_name}")
 
 
-def mount_volumes() -> dict:
+def capture_logs(
+    container: docker.models.containers.Container, log_buffer: LogBuffer
+) -> threading.Thread:
+    """
+    Streams the container logs (stdout and stderr) into ``log_buffer`` while the
+    container runs. The stream ends, and the returned thread finishes, once the
+    container exits.
+
+    Arguments:
+        container: The Docker container to capture logs from
+        log_buffer: The buffer the logs are written to
+
+    Returns:
+        The thread streaming the logs
+
+    """
+
+    def stream_logs():
+        try:
+            for chunk in container.logs(stdout=True, stderr=True, stream=True, follow=True):
+                log_buffer.write(chunk)
+        except Exception as e:
+            log_buffer.write(f"\nLog streaming interrupted: {e}\n")
+
+    log_thread = threading.Thread(target=stream_logs, daemon=True)
+    log_thread.start()
+
+    return log_thread
+
+
+def mount_volumes(output_dir: Optional[str] = None) -> dict:
     """
     Mount volumes onto a docker container.
 
@@ -279,10 +420,14 @@ def mount_volumes() -> dict:
 
     The volumes mounted are:
 
-    - The current working directory's output/ directory, mounted as read-write
+    - The current working directory's output/ directory (or ``output_dir``, if given), mounted as read-write
     - The current working directory's input/ directory, mounted as read-only
+
+    Arguments:
+        output_dir: The host directory to mount as /output. Defaults to the current
+                    working directory's output/ directory.
     """
-    output_dir = os.path.join(os.getcwd(), "output")
+    output_dir = output_dir or os.path.join(os.getcwd(), "output")
     input_dir = os.path.join(os.getcwd(), "input")
 
     mounted_volumes = {
@@ -298,8 +443,12 @@ def mount_volumes() -> dict:
 
 
 def validate_submission(
-    docker_image: str, output_path: str, output_file_name: str
-) -> None:
+    docker_image: str,
+    output_path: str,
+    output_file_name: str,
+    log_file_name: str = "docker.log",
+    log_max_size: int = 50,
+) -> str:
     """
     Validates the Docker image for the submission
 
@@ -307,6 +456,8 @@ def validate_submission(
         docker_image: Docker image identifier in the format: '<image_name>@<sha_code>'
         output_path: Path to the output directory that houses the output file and log file
         output_file_name: Name of the output file generated from the container
+        log_file_name: The name of the log file to create if the submission is invalid
+        log_max_size: The maximum size of the log file that will be written, in kilobytes
 
     """
     # If the submission is not a Docker image, create an invalid output file
@@ -314,7 +465,7 @@ def validate_submission(
     if "InputError" in docker_image:
 
         # Make the output directory since it wouldnt' exist without running the container
-        os.makedirs(output_path)
+        os.makedirs(output_path, exist_ok=True)
 
         # Create an invalid output file
         make_invalid_output(
@@ -335,122 +486,480 @@ def validate_submission(
     return "VALID"
 
 
-def get_poll_interval(
-    elapsed_time: Union[int, float],
-    poll_interval: Union[int, float],
-    timeout: Union[int, float],
-) -> Union[int, float]:
+def get_container_elapsed_time(
+    container: docker.models.containers.Container,
+) -> float:
     """
-    Return the time to wait (poll interval) between status checks. If the
-    elapsed time is greater than the timeout, the poll interval is the difference between
-    the timeout and the elapsed time. Otherwise, the poll interval remains unchanged.
+    Returns how long the container has been running (in minutes), measured from
+    the ``State.StartedAt`` timestamp reported by the Docker daemon rather than
+    from the time spent monitoring it.
 
     Arguments:
-        elapsed_time: The elapsed time already spent monitoring (in minutes).
-        poll_interval: Time to wait between status checks (in minutes).
-        timeout: Maximum duration to monitor the container (in minutes).
+        container: The Docker container to inspect. Its attributes should be fresh,
+                   i.e. ``container.reload()`` has been called recently.
 
     Returns:
-        The modified or unmodified poll interval.
+        The elapsed running time of the container (in minutes).
 
     """
-    if (elapsed_time + poll_interval) > timeout:
-        return timeout - elapsed_time
-    else:
-        return poll_interval
+    started_at = container.attrs.get("State", {}).get("StartedAt", "")
+
+    # Docker reports nanosecond precision (e.g. '2024-01-01T12:00:00.123456789Z'),
+    # which ``datetime`` cannot parse, so the fraction is cut down to microseconds.
+    match = re.match(r"(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})(\.\d+)?", started_at)
+    if not match or started_at.startswith("0001-01-01"):
+        return 0.0
+    fraction = (match.group(2) or ".0")[:7]
+    started = datetime.strptime(
+        match.group(1) + fraction, "%Y-%m-%dT%H:%M:%S.%f"
+    ).replace(tzinfo=timezone.utc)
+
+    elapsed_seconds = (datetime.now(timezone.utc) - started).total_seconds()
+
+    return max(elapsed_seconds, 0.0) / 60
+
+
+def wait_for_container(
+    container: docker.models.containers.Container,
+    wait_time: Union[int, float],
+) -> bool:
+    """
+    Blocks on the Docker wait API until the container exits, or until ``wait_time``
+    has passed, whichever comes first.
+
+    Arguments:
+        container: The Docker container to wait on.
+        wait_time: Maximum time to block (in minutes).
+
+    Returns:
+        True if the container exited within ``wait_time``, False otherwise.
+
+    """
+    try:
+        container.wait(timeout=max(wait_time * 60, 1))
+    except (requests.exceptions.ReadTimeout, requests.exceptions.ConnectionError):
+        return False
+
+    return True
 
 
 def monitor_container(
     container: docker.models.containers.Container,
     timeout: Union[int, float],
     poll_interval: Union[int, float],
-    elapsed_time: Union[int, float] = 0,
-):
+) -> str:
     """
-    Recursively monitor the status of a Docker container until it finishes,
-    or the timeout is reached, at which point the container is killed.
+    Monitor a Docker container until it finishes, or the timeout is reached,
+    at which point the container is killed.
+
+    Rather than sleeping between status checks, this blocks on the Docker wait API,
+    so monitoring returns as soon as the container exits. ``poll_interval`` only
+    controls how often progress is reported while the container is still running.
+    The elapsed time is taken from the container's ``State.StartedAt`` timestamp.
 
     Arguments:
         container: The Docker container subject to monitor.
         timeout: Maximum duration to monitor the container (in minutes) before forced shutdown.
-        poll_interval: Time to wait between status checks (in minutes).
-        elapsed_time: The elapsed time already spent monitoring (in minutes).
+        poll_interval: Time between progress reports (in minutes).
+
+    Returns:
+        An empty string if the container exited on its own, otherwise the timeout message.
+
     """
+    while True:
+        # Refresh container status
+        container.reload()
 
-    # Refresh container status
-    container.reload()
+        # If the container has exited, stop monitoring
+        if container.status == "exited":
+            return ""
 
-    # If the container has exited, stop monitoring
-    if container.status == "exited":
-        return ""
+        # Check if the elapsed time has reached or exceeded the timeout
+        elapsed_time = get_container_elapsed_time(container)
+        if elapsed_time >= timeout:
+            print("Timeout reached. Stopping container.")
+            container.stop(timeout=10)
+            return f"Container exceeded execution time limit of {timeout} minutes. Unable to process."
 
-    # Check if the elapsed time has reached or exceeded the timeout
-    if elapsed_time >= timeout:
-        print("Timeout reached. Stopping container.")
-        container.stop(timeout=10)
-        return f"Container exceeded execution time limit of {timeout} minutes. Unable to process."
+        # Notify the backend when elapsed time is 3/4 of the way to timeout
+        if elapsed_time >= timeout * 0.75:
+            print(f"Time spent running container (minutes): {elapsed_time:.2f}")
+            print(f"Container run will shut down after {timeout} minute(s).")
 
-    # Wait before the next check
-    poll_interval = get_poll_interval(elapsed_time, poll_interval, timeout)
-    print(
-        "Container still running. Checking again in " + str(poll_interval) + " minutes."
+        # Block until the container exits, or until the next progress report is due
+        wait_time = min(poll_interval, timeout - elapsed_time)
+        print(f"Container still running. Waiting up to {wait_time:.2f} minutes for it to exit.")
+        if wait_for_container(container, wait_time):
+            container.reload()
+            return ""
+
+
+class ContainerRequest(NamedTuple):
+    submission_id: str
+    cpus: float
+    memory: int
+
+
+def parse_memory(memory: Union[int, float, str]) -> int:
+    """
+    Converts a memory amount into bytes. Accepts numbers (interpreted as GB) and
+    strings with an optional unit, including Nextflow's notation, e.g. '16.GB', '512 MB', '2g',
+    '1073741824B'.
+
+    Arguments:
+        memory: The memory amount to convert
+
+    Returns:
+        The memory amount in bytes
+
+    Raises:
+        ValueError: If the memory amount cannot be parsed
+
+    """
+    if isinstance(memory, (int, float)):
+        return int(memory * 1024**3)
+
+    match = re.fullmatch(
+        r"\s*(\d+(?:\.\d+)?)\.?\s*([kmgt]?b?)\s*", str(memory), flags=re.IGNORECASE
     )
-    time.sleep(poll_interval * 60)
+    if not match:
+        raise ValueError(f"Could not parse memory amount: '{memory}'")
+    amount, unit = match.groups()
+    unit = unit.lower().rstrip("b") if len(unit) > 1 else unit.lower()
+    exponent = {"": 3, "b": 0, "k": 1, "m": 2, "g": 3, "t": 4}[unit]
 
-    # Increment the elapsed time
-    elapsed_time += poll_interval
+    return int(float(amount) * 1024**exponent)
 
-    # Notify the backend when elapsed time is 3/4 of the way to timeout
-    if elapsed_time >= timeout * 0.75:
-        print(f"Time spent monitoring container (minutes): {elapsed_time}")
-        print(f"Container run will shut down after {timeout} minute(s).")
 
-    # Recursively call the function to continue monitoring
-    if container.status != "exited" or elapsed_time < timeout:
-        return monitor_container(container, timeout, poll_interval, elapsed_time)
+def parse_container_requests(
+    submissions: str, default_cpus: float, default_memory: int
+) -> List[ContainerRequest]:
+    """
+    Parses a comma-separated list of submissions into container resource requests.
+    Each entry is either a submission ID, or ``<submission_id>:<cpus>:<memory>`` to
+    override the default resources for that submission, e.g. ``9741046,9741047:2:8.GB``.
 
+    Arguments:
+        submissions: The comma-separated list of submissions
+        default_cpus: The CPUs requested for submissions without an override
+        default_memory: The memory (in bytes) requested for submissions without an override
 
-def run_docker(
+    Returns:
+        The container requests, in the order given
+
+    """
+    container_requests = []
+    for entry in submissions.strip().split(","):
+        if not entry.strip():
+            continue
+        submission_id, *resources = entry.strip().split(":")
+        cpus = float(resources[0]) if len(resources) > 0 else default_cpus
+        memory = parse_memory(resources[1]) if len(resources) > 1 else default_memory
+        container_requests.append(ContainerRequest(submission_id, cpus, memory))
+
+    return container_requests
+
+
+def select_container_requests(
+    pending: List[ContainerRequest],
+    available_cpus: float,
+    available_memory: int,
+    idle: bool,
+) -> List[ContainerRequest]:
+    """
+    Picks the pending container requests to start next, packing them first-fit,
+    in queue order, against the CPUs and memory still available on the host.
+
+    A request larger than the whole budget can never fit. It is started on its own
+    once nothing else is running, so that it is not starved.
+
+    Arguments:
+        pending: The container requests waiting to run, in queue order
+        available_cpus: The CPUs not used by running containers
+        available_memory: The memory (in bytes) not used by running containers
+        idle: Whether no container is currently running
+
+    Returns:
+        The container requests to start
+
+    """
+    selected = []
+    for container_request in pending:
+        if (
+            container_request.cpus <= available_cpus
+            and container_request.memory <= available_memory
+        ):
+            selected.append(container_request)
+            available_cpus -= container_request.cpus
+            available_memory -= container_request.memory
+
+    if not selected and idle and pending:
+        print(
+            f"Submission {pending[0].submission_id} requests more than the host budget. Running it on its own."
+        )
+        selected.append(pending[0])
+
+    return selected
+
+
+def get_container_limits(
+    cpus: Optional[float] = None, memory: Optional[int] = None
+) -> dict:
+    """
+    Returns the resource limits to apply to a submission container, in the format
+    expected by ``client.containers.run``. Swap is disabled by setting the memory + swap
+    limit to the memory limit, and the number of processes is capped at ``CONTAINER_PIDS_LIMIT``.
+
+    Arguments:
+        cpus: The CPUs the container may use. Not limited if None.
+        memory: The memory (in bytes) the container may use. Not limited if None.
+
+    Returns:
+        The keyword arguments setting the limits
+
+    """
+    limits = {"pids_limit": CONTAINER_PIDS_LIMIT}
+    if cpus:
+        limits["nano_cpus"] = int(cpus * 1e9)
+    if memory:
+        limits["mem_limit"] = memory
+        limits["memswap_limit"] = memory
+
+    return limits
+
+
+def get_exit_message(attrs: dict, memory: Optional[int] = None) -> Tuple[bool, str]:
+    """
+    Describes how a submission container exited, based on its attributes.
+
+    Arguments:
+        attrs: The container attributes, i.e. ``container.attrs``
+        memory: The memory limit (in bytes) applied to the container, if any
+
+    Returns:
+        oom_killed: Whether the container was killed for running out of memory
+        exit_message: The reason the container failed, or an empty string if it exited with status 0
+
+    """
+    state = attrs.get("State", {})
+    exit_code = state.get("ExitCode", 0)
+
+    if state.get("OOMKilled", False):
+        limit = f" of {memory / 1024**3:.2f} GB" if memory else ""
+        return True, (
+            f"Container was killed because it exceeded its memory limit{limit} "
+            f"(exit code {exit_code}). Unable to process."
+        )
+    if exit_code:
+        return False, f"Container exited with non-zero exit code {exit_code}."
+
+    return False, ""
+
+
+def get_container_labels(submission_id: str, run_id: Optional[str] = None) -> dict:
+    """
+    Returns the labels to set on a submission container, so that it can be found
+    again by ``find_submission_container``.
+
+    Arguments:
+        submission_id: The ID of the submission
+        run_id: The ID of the workflow run, if any
+
+    Returns:
+        The container labels
+
+    """
+    labels = {SUBMISSION_LABEL: str(submission_id)}
+    if run_id:
+        labels[RUN_LABEL] = str(run_id)
+
+    return labels
+
+
+def find_submission_container(
+    client: docker.DockerClient, submission_id: str, run_id: Optional[str] = None
+) -> Optional[docker.models.containers.Container]:
+    """
+    Looks for a container already started for the submission, e.g. by a previous
+    attempt of a task that was retried. When ``run_id`` is given, only containers
+    started by the same workflow run are considered.
+
+    Arguments:
+        client: The Docker client
+        submission_id: The ID of the submission
+        run_id: The ID of the workflow run, if any
+
+    Returns:
+        The most recently created running or exited container of the submission,
+        or None if there is none
+
+    """
+    filters = {
+        "label": [
+            f"{key}={value}"
+            for key, value in get_container_labels(submission_id, run_id).items()
+        ],
+        "status": ["running", "exited"],
+    }
+    containers = client.containers.list(all=True, filters=filters)
+    if not containers:
+        return None
+
+    return max(containers, key=lambda container: container.attrs.get("Created", ""))
+
+
+def get_output_mount(container: docker.models.containers.Container) -> Optional[str]:
+    """
+    Returns the host directory mounted as /output in a container.
+
+    Arguments:
+        container: The Docker container to inspect
+
+    Returns:
+        The host directory, or None if /output is not a mount
+
+    """
+    return next(
+        (
+            mount.get("Source")
+            for mount in container.attrs.get("Mounts", [])
+            if mount.get("Destination") == "/output"
+        ),
+        None,
+    )
+
+
+def collect_outputs(
+    container: docker.models.containers.Container,
+    output_path: str,
     submission_id: str,
-    container_timeout: Union[int, float],
-    poll_interval: Union[int, float] = 1,
-    log_file_name: str = "docker.log",
-    log_max_size: int = 50,
-    rename_output: bool = True,
+    skip_files: List[str] = [],
 ) -> None:
     """
-    A function to run a Docker container with the specified image and handle any exceptions that may occur.
+    Copies the files written to /output by a container started in another directory
+    (i.e. by a previous attempt of a task) into ``output_path``.
 
-    This function will run a Docker container using the image specified by the
-    ``submission_id`` argument, and will mount the input/ and output/ directories
-    in the current working directory to the corresponding locations in the
-    container. If the container runs successfully, the function will store any
-    generated predictions file in the /output directory to Synapse, along with
-    any logs generated. If the container run fails, the function will store the
-    error message in a log file on Synapse.
+    If the previous attempt got as far as handling the outputs, the renamed output file
+    gets its original name back, and INVALID files and ``skip_files`` (e.g. its log file)
+    are left behind, since they are created again by this attempt.
 
-    Args:
-        submission_id: The ID of the submission to run.
-        container_timeout: The maximum duration to monitor the container (in minutes).
-        poll_interval: The time to wait between status checks during container monitoring (in minutes).
+    Arguments:
+        container: The Docker container whose outputs are collected
+        output_path: The output directory of the current attempt
+        submission_id: The ID of the submission
+        skip_files: Names of the files not to copy
+
+    """
+    previous_output_path = get_output_mount(container)
+    if not previous_output_path or os.path.realpath(previous_output_path) == os.path.realpath(output_path):
+        return
+
+    os.makedirs(output_path, exist_ok=True)
+    prefix = f"{submission_id}_"
+    for file_name in os.listdir(previous_output_path):
+        previous_file = os.path.join(previous_output_path, file_name)
+        original_name = file_name[len(prefix):] if file_name.startswith(prefix) else file_name
+        if (
+            not os.path.isfile(previous_file)
+            or file_name in skip_files
+            or original_name.startswith("INVALID_")
+        ):
+            continue
+        shutil.copy2(previous_file, os.path.join(output_path, original_name))
+    print(f"Collected outputs from {previous_output_path}")
+
+
+def get_run_memo_key(docker_image: str, volumes: dict) -> Optional[str]:
+    """
+    Computes the key under which the outputs of a run are memoized: the image digest
+    and the content of the input data.
+
+    Arguments:
+        docker_image: Docker image identifier in the format: '<image_name>@<sha_code>'
+        volumes: The volumes mounted on the container, as returned by ``mount_volumes``
+
+    Returns:
+        The key, or None if the image is not pinned to a digest or the input data cannot be read
+
+    """
+    if "@" not in docker_image:
+        return None
+    input_path = next(
+        (key for key in volumes.keys() if volumes[key]["bind"] == "/input"), None
+    )
+    try:
+        input_digest = result_memo.directory_digest(input_path) if input_path else None
+    except OSError as e:
+        print(f"Could not hash the input data: {e}")
+        return None
+
+    return result_memo.memo_key(image=docker_image, input=input_digest)
+
+
+def reuse_outputs(
+    memo_entry: result_memo.MemoEntry,
+    output_path: str,
+    log_file_name: str,
+    log_max_size: int,
+    metrics_file_name: str,
+) -> str:
+    """
+    Puts the memoized outputs of an earlier run in the output directory, as if the
+    submission had been run: its output file, its log file (stating that the outputs
+    were reused) and a metrics file recording which submission they come from.
+
+    Arguments:
+        memo_entry: The memoized outputs
+        output_path: The path to the output directory.
         log_file_name: The name of the log file to create.
         log_max_size: The maximum size of the log file that will be written, in kilobytes
-        rename_output: If True, renames the output file to include the submission ID.
-                       For example, if the submission ID is '123' and the output file is 'predictions.csv',
-                       then the 'predictions.csv' file is renamed to '123_predictions.csv'.
+        metrics_file_name: The name of the container metrics file to create.
 
     Returns:
-        None
+        The path to the output file.
 
     """
-    # Get the Synapse authentication token from the environment variable
-    synapse_auth_token: str = os.environ["SYNAPSE_AUTH_TOKEN"]
+    output_file = None
+    for file_name, file_path in memo_entry.files.items():
+        output_file = os.path.join(output_path, file_name)
+        result_memo.link_or_copy(file_path, output_file)
+
+    log_text = (
+        memo_entry.result.get("log_text", "")
+        + "\n\nThis submission's image and input data are identical to those of an earlier run, "
+        + "whose outputs were reused."
+    )
+    create_log_file(
+        log_file_name=log_file_name,
+        log_max_size=log_max_size,
+        log_file_path=output_path,
+        log_text=log_text,
+    )
+
+    metrics = ContainerMetrics()
+    metrics.reused_from = memo_entry.submission_id
+    metrics.write(os.path.join(output_path, metrics_file_name))
+
+    return output_file
+
+
+def connect(synapse_auth_token: str) -> Tuple[docker.DockerClient, synapseclient.Synapse]:
+    """
+    Connects to the Docker daemon and to Synapse, and logs the Docker client into
+    the Synapse Docker registry.
+
+    Arguments:
+        synapse_auth_token: The Synapse authentication token
+
+    Returns:
+        The Docker client and the Synapse connection
 
+    """
     # Communication with the Docker client
     client = docker.from_env()
 
-    # Log into Synapse
-    syn = synapseclient.login(silent=True)
+    # Log into Synapse, through the local gateway if it is running
+    syn = synapse_gateway.login(silent=True)
 
     # Login to the Docker registry using SYNAPSE_AUTH_TOKEN
     client.login(
@@ -459,12 +968,77 @@ def run_docker(
         registry="https://docker.synapse.org",
     )
 
-    # Mount the input/ and output/ volumes that will exist in the submission container
-    volumes = mount_volumes()
+    return client, syn
 
-    # Get the Docker image ID from the submission
-    docker_image = get_submission_image(syn, submission_id)
 
+def run_submission(
+    client: docker.DockerClient,
+    submission_id: str,
+    docker_image: str,
+    volumes: dict,
+    container_timeout: Union[int, float],
+    poll_interval: Union[int, float] = 1,
+    log_file_name: str = "docker.log",
+    log_max_size: int = 50,
+    rename_output: bool = True,
+    metrics_file_name: str = "metrics.json",
+    cpus: Optional[float] = None,
+    memory: Optional[int] = None,
+    run_id: Optional[str] = None,
+    image_cache: Optional[ImageCache] = None,
+    output_max_size: Optional[int] = None,
+    image_limits: Optional[ImageLimits] = None,
+    memoize: bool = False,
+) -> None:
+    """
+    Runs the container of a single submission, monitors it, and handles its outputs and logs.
+    The resources used by the container are written to ``metrics_file_name``, next to the log file.
+
+    The container is limited to ``cpus`` and ``memory`` (see ``get_container_limits``). If it is
+    killed for exceeding its memory limit, an INVALID output file stating so is created.
+
+    Containers are labelled with the submission ID (and ``run_id``). If a container for the
+    submission already exists, e.g. because a previous attempt of the task failed after
+    starting it, this reattaches to it if it is still running, and in either case collects
+    its logs and outputs instead of running the submission again.
+
+    If ``output_max_size`` is given, the container is stopped as soon as its output directory
+    grows past it, and an INVALID output file stating so is created.
+
+    Once its logs and outputs are collected, the container is removed. The use of the
+    image is recorded in ``image_cache``, if given, so that it can later be evicted, and
+    the image is marked in use from its pull until the container is removed, so that no
+    task evicts it in between.
+
+    If ``image_limits`` is given, the image is inspected in its registry before it is pulled
+    (see ``preflight_image``), and checked against the uncompressed size limit once pulled.
+    A rejected image is never run, and an INVALID output file stating why is created.
+
+    If ``memoize`` is True, the valid outputs of a run are recorded in ``result_memo``, keyed
+    by the image digest and the content of the input data. A later submission of the same
+    image on the same input data is not run: the recorded outputs and logs are reused instead
+    (see ``reuse_outputs``).
+
+    Arguments:
+        client: The Docker client
+        submission_id: The ID of the submission to run.
+        docker_image: Docker image identifier in the format: '<image_name>@<sha_code>'
+        volumes: The volumes to mount on the container, as returned by ``mount_volumes``
+        container_timeout: The maximum duration to monitor the container (in minutes).
+        poll_interval: The time between progress reports during container monitoring (in minutes).
+        log_file_name: The name of the log file to create.
+        log_max_size: The maximum size of the log file that will be written, in kilobytes
+        rename_output: If True, renames the output file to include the submission ID.
+        metrics_file_name: The name of the container metrics file to create.
+        cpus: The CPUs the container may use. Not limited if None.
+        memory: The memory (in bytes) the container may use. Not limited if None.
+        run_id: The ID of the workflow run, used to only reattach to containers of the same run.
+        image_cache: The cache recording the use of submission images
+        output_max_size: The maximum size (in bytes) of the output directory. Not limited if None.
+        image_limits: The size and platform limits of the submission image. Not checked if None.
+        memoize: Whether to reuse the outputs of an earlier run of the same image on the same input data
+
+    """
     # Get the output directory based on the mounted volumes dictionary used to run the container
     output_path = next(
         (key for key in volumes.keys() if "output" in volumes[key]["bind"]), None
@@ -473,30 +1047,151 @@ def run_docker(
     output_file_name = "predictions"
 
     # Ensure the submission is a valid Docker image
-    validation_result = validate_submission(docker_image, output_path, output_file_name)
+    validation_result = validate_submission(
+        docker_image,
+        output_path,
+        output_file_name,
+        log_file_name=log_file_name,
+        log_max_size=log_max_size,
+    )
     if validation_result == "INVALID":
+        # Prefix the invalid output like any other, so batch mode moves it into output/
+        if rename_output:
+            helpers.rename_file(
+                submission_id, os.path.join(output_path, f"INVALID_{output_file_name}.csv")
+            )
         return
 
+    # Reuse the outputs of an earlier run of the same image on the same input data
+    run_memo_key = get_run_memo_key(docker_image, volumes) if memoize else None
+    memo_entry = result_memo.lookup(run_memo_key) if run_memo_key else None
+    if memo_entry is not None:
+        print(f"Reusing the outputs of submission {memo_entry.submission_id}, run from the same image")
+        output_file = reuse_outputs(
+            memo_entry, output_path, log_file_name, log_max_size, metrics_file_name
+        )
+        if rename_output:
+            helpers.rename_file(submission_id, output_file)
+        return
+
+    # Keep other tasks from evicting the image while it is pulled and run
+    in_use_token = image_cache.mark_in_use(docker_image) if image_cache is not None else None
+
     # Run the docker image using the client. We detach so that we can monitor the container.
     timeout_msg = ""
+    exit_msg = ""
+    metrics = ContainerMetrics()
+    container = None
+    run_completed = False
     print(f"Running container... {docker_image}")
     try:
-        container = client.containers.run(
-            docker_image,
-            detach=True,
-            volumes=volumes,
-            network_disabled=True
+        # Reattach to the container of a previous attempt, if there is one
+        container = find_submission_container(client, submission_id, run_id)
+        if container is not None:
+            print(f"Reattaching to container {container.short_id} ({container.status})")
+            metrics.reattached = True
+        else:
+            # Reject images that are too large, or built for another platform, before pulling them
+            image_error = (
+                preflight_image(docker_image, image_limits) if image_limits else None
+            )
+            if image_error:
+                raise ImageRejected(image_error)
+
+            # Pull the image, unless it is already on the host
+            pull_start = time.monotonic()
+            try:
+                client.images.get(docker_image)
+            except docker.errors.ImageNotFound:
+                client.images.pull(docker_image)
+            metrics.pull_seconds = round(time.monotonic() - pull_start, 3)
+
+            # The uncompressed size of an image is only known once it is pulled
+            image_error = (
+                check_uncompressed_size(
+                    client.images.get(docker_image).attrs.get("Size", 0), image_limits
+                )
+                if image_limits
+                else None
+            )
+            if image_error:
+                try:
+                    client.images.remove(docker_image, force=True)
+                except docker.errors.APIError as e:
+                    print(f"Could not remove image {docker_image}: {e}")
+                raise ImageRejected(image_error)
+
+            start_start = time.monotonic()
+            container = client.containers.run(
+                docker_image,
+                detach=True,
+                volumes=volumes,
+                network_disabled=True,
+                labels=get_container_labels(submission_id, run_id),
+                **get_container_limits(cpus, memory),
+            )
+            metrics.start_seconds = round(time.monotonic() - start_start, 3)
+
+        if image_cache is not None:
+            image_cache.touch(docker_image)
+
+        # Stream the container logs (stdout and stderr) into a bounded buffer as they are written,
+        # and sample its resource usage while it runs
+        log_buffer = LogBuffer.from_max_size(log_max_size * 1000)
+        log_thread = capture_logs(container, log_buffer)
+        stats_thread = (
+            record_stats(container, metrics) if container.status != "exited" else None
         )
 
+        # Stop the container if it writes more than allowed to its output directory
+        quota_watcher = None
+        if output_max_size and container.status != "exited":
+            quota_watcher = OutputQuotaWatcher(
+                container, get_output_mount(container) or output_path, output_max_size
+            )
+            quota_watcher.start()
+
+        run_start = time.monotonic()
         timeout_msg = monitor_container(
             container, timeout=container_timeout, poll_interval=poll_interval
         )
-
-        # Capture and save the container logs (stdout and stderr)
-        log_text = container.logs(stdout=True, stderr=True).decode("utf-8")
+        metrics.run_seconds = round(time.monotonic() - run_start, 3)
+
+        if quota_watcher is not None:
+            quota_watcher.stop()
+            if quota_watcher.message and not timeout_msg:
+                timeout_msg = quota_watcher.message
+
+        # Wait for the remaining logs and stats to be flushed once the container has stopped
+        log_thread.join(timeout=60)
+        if stats_thread is not None:
+            stats_thread.join(timeout=10)
+        container.reload()
+        metrics.update_from_attrs(container.attrs)
+        oom_killed, exit_msg = get_exit_message(container.attrs, memory)
+        if oom_killed and not timeout_msg:
+            timeout_msg = exit_msg
+
+        # A container of a previous attempt wrote its outputs to that attempt's directory
+        collect_outputs(
+            container,
+            output_path,
+            submission_id,
+            skip_files=[log_file_name, metrics_file_name],
+        )
+        if log_buffer.dropped_bytes:
+            print(f"Dropped {log_buffer.dropped_bytes} bytes from the middle of the container logs")
+        log_text = log_buffer.getvalue().decode("utf-8", "ignore")
 
         # Update the log text with the timeout error message, if it exists
         log_text = log_text + "\n\n" + timeout_msg
+        run_completed = True
+
+    # The image was rejected before a container was started
+    except ImageRejected as e:
+        print(f"Image rejected: {e}")
+        timeout_msg = f"{e} Unable to process."
+        log_text = timeout_msg
 
     # Capture any errors that may occur during the attempt to run the container
     except Exception as e:
@@ -512,8 +1207,8 @@ def run_docker(
         )
 
     if len(timeout_msg) > 0:
-        # If the container times out, make an invalid output file to propagate the error message to Synapse
-        # and to the user...
+        # If the container times out, runs out of memory or writes too much, or its image is rejected, make an invalid output file to propagate
+        # the error message to Synapse and to the user...
         output_file = make_invalid_output(
             "predictions.csv", log_file_path=output_path, file_content=timeout_msg
         )
@@ -522,7 +1217,10 @@ def run_docker(
         # If the container run was successful, handle any outputs in the ``output/`` directory, and its contents.
         # This means: An expected output file, more than 1 output file, no output file, or an empty output file.
         outputs_handled = handle_outputs(
-            output_path=output_path, output_file_name="predictions", log_text=log_text
+            output_path=output_path,
+            output_file_name="predictions",
+            log_text=log_text,
+            exit_message=exit_msg,
         )
         log_text = outputs_handled.log_text
         output_file = outputs_handled.output_file
@@ -535,23 +1233,396 @@ def run_docker(
         log_text=log_text,
     )
 
+    # Record valid outputs, so that a resubmission of the same image reuses them
+    if (
+        run_memo_key
+        and run_completed
+        and not timeout_msg
+        and not exit_msg
+        and not os.path.basename(output_file).startswith("INVALID_")
+    ):
+        result_memo.store(
+            run_memo_key, submission_id, result={"log_text": log_text}, files=[output_file]
+        )
+
+    # Record the resources used by the container, if it was started, and remove it
+    # now that its logs and outputs are collected
+    if container is not None:
+        metrics.write(os.path.join(output_path, metrics_file_name))
+        try:
+            container.remove(force=True)
+        except docker.errors.APIError as e:
+            print(f"Could not remove container {container.short_id}: {e}")
+    if in_use_token is not None:
+        image_cache.unmark_in_use(docker_image, in_use_token)
+
     # Rename the predictions file if requested
     if rename_output:
         helpers.rename_file(submission_id, output_file)
 
 
-if __name__ == "__main__":
-    submission_id = sys.argv[1]
-    container_timeout = float(sys.argv[2])
-    poll_interval = float(sys.argv[3])
-    log_max_size = int(sys.argv[4])
+def run_docker(
+    submission_id: str,
+    container_timeout: Union[int, float],
+    poll_interval: Union[int, float] = 1,
+    log_file_name: str = "docker.log",
+    log_max_size: int = 50,
+    rename_output: bool = True,
+    metrics_file_name: str = "metrics.json",
+    cpus: Optional[float] = None,
+    memory: Optional[int] = None,
+    run_id: Optional[str] = None,
+    image_cache_size: Optional[int] = None,
+    output_max_size: Optional[int] = None,
+    image_limits: Optional[ImageLimits] = None,
+    memoize: bool = False,
+) -> None:
+    """
+    A function to run a Docker container with the specified image and handle any exceptions that may occur.
+
+    This function will run a Docker container using the image specified by the
+    ``submission_id`` argument, and will mount the input/ and output/ directories
+    in the current working directory to the corresponding locations in the
+    container. If the container runs successfully, the function will store any
+    generated predictions file in the /output directory to Synapse, along with
+    any logs generated. If the container run fails, the function will store the
+    error message in a log file on Synapse.
+
+    Args:
+        submission_id: The ID of the submission to run.
+        container_timeout: The maximum duration to monitor the container (in minutes).
+        poll_interval: The time between progress reports during container monitoring (in minutes).
+        log_file_name: The name of the log file to create.
+        log_max_size: The maximum size of the log file that will be written, in kilobytes
+        rename_output: If True, renames the output file to include the submission ID.
+                       For example, if the submission ID is '123' and the output file is 'predictions.csv',
+                       then the 'predictions.csv' file is renamed to '123_predictions.csv'.
+        metrics_file_name: The name of the container metrics file to create.
+        cpus: The CPUs the container may use. Not limited if None.
+        memory: The memory (in bytes) the container may use. Not limited if None.
+        run_id: The ID of the workflow run, used to only reattach to containers of the same run.
+        image_cache_size: The disk budget (in bytes) for submission images on this host.
+                          The least recently used ones are removed once the run is over.
+        output_max_size: The maximum size (in bytes) of the output directory. Not limited if None.
+        image_limits: The size and platform limits of the submission image. Not checked if None.
+        memoize: Whether to reuse the outputs of an earlier run of the same image on the same input data
 
-    log_file_name = f"{submission_id}_docker.log"
+    Returns:
+        None
+
+    """
+    # Get the Synapse authentication token from the environment variable
+    synapse_auth_token: str = os.environ["SYNAPSE_AUTH_TOKEN"]
 
-    run_docker(
+    client, syn = connect(synapse_auth_token)
+
+    # Mount the input/ and output/ volumes that will exist in the submission container
+    volumes = mount_volumes()
+
+    # Get the Docker image ID from the submission
+    docker_image = get_submission_image(syn, submission_id)
+
+    image_cache = ImageCache(client, max_size=image_cache_size)
+
+    run_submission(
+        client,
         submission_id,
+        docker_image,
+        volumes,
         container_timeout,
         poll_interval,
         log_file_name=log_file_name,
         log_max_size=log_max_size,
+        rename_output=rename_output,
+        metrics_file_name=metrics_file_name,
+        cpus=cpus,
+        memory=memory,
+        run_id=run_id,
+        image_cache=image_cache,
+        output_max_size=output_max_size,
+        image_limits=image_limits,
+        memoize=memoize,
     )
+
+    # Keep the submission images on this host within the disk budget
+    image_cache.evict()
+
+
+def run_docker_batch(
+    container_requests: List[ContainerRequest],
+    container_timeout: Union[int, float],
+    poll_interval: Union[int, float] = 1,
+    log_max_size: int = 50,
+    cpus: Optional[float] = None,
+    memory: Optional[int] = None,
+    prefetch_workers: int = 2,
+    run_id: Optional[str] = None,
+    image_cache_size: Optional[int] = None,
+    output_max_size: Optional[int] = None,
+    image_limits: Optional[ImageLimits] = None,
+    memoize: bool = False,
+) -> None:
+    """
+    Runs the containers of several submissions side by side on this host.
+
+    Containers are packed against the ``cpus`` and ``memory`` budget with
+    ``select_container_requests``, and a new one is started as soon as a running
+    one finishes and frees enough resources. Each container gets its own
+    ``output/<submission_id>/`` directory mounted as /output. Once a run is handled,
+    its ``<submission_id>_predictions.*``, ``<submission_id>_docker.log`` and
+    ``<submission_id>_metrics.json`` files are moved up into ``output/``, which is
+    the layout ``run_docker`` produces.
+
+    The images of all the submissions are pulled in the background, in queue order,
+    by an ``ImagePrefetcher``, so they are usually on the host by the time their
+    container is started. Images rejected by ``preflight_image`` are not prefetched.
+
+    Arguments:
+        container_requests: The submissions to run, with the resources each one requests
+        container_timeout: The maximum duration to monitor each container (in minutes).
+        poll_interval: The time between progress reports during container monitoring (in minutes).
+        log_max_size: The maximum size of each log file that will be written, in kilobytes
+        cpus: The CPUs available to submission containers. Defaults to the host CPU count.
+        memory: The memory (in bytes) available to submission containers. Defaults to the host memory.
+        prefetch_workers: The maximum number of images pulled at the same time
+        run_id: The ID of the workflow run, used to only reattach to containers of the same run.
+        image_cache_size: The disk budget (in bytes) for submission images on this host.
+                          The least recently used ones are removed as containers finish,
+                          except for the images of submissions still queued or running.
+        output_max_size: The maximum size (in bytes) of each output directory. Not limited if None.
+        image_limits: The size and platform limits of the submission images. Not checked if None.
+        memoize: Whether to reuse the outputs of earlier runs of the same images on the same input data
+
+    """
+    cpus = cpus or os.cpu_count()
+    memory = memory or os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+    # Get the Synapse authentication token from the environment variable
+    synapse_auth_token: str = os.environ["SYNAPSE_AUTH_TOKEN"]
+
+    client, syn = connect(synapse_auth_token)
+
+    # Resolve the Docker images up front, so Synapse is only queried from this thread
+    docker_images = {
+        container_request.submission_id: get_submission_image(
+            syn, container_request.submission_id
+        )
+        for container_request in container_requests
+    }
+
+    # Start pulling the images while the first containers run
+    prefetcher = ImagePrefetcher(
+        client,
+        max_workers=prefetch_workers,
+        preflight=(
+            (lambda docker_image: preflight_image(docker_image, image_limits))
+            if image_limits
+            else None
+        ),
+    )
+    image_cache = ImageCache(client, max_size=image_cache_size)
+    # Keep other tasks from evicting the prefetched images before their container has run
+    in_use_tokens = {}
+    for container_request in container_requests:
+        docker_image = docker_images[container_request.submission_id]
+        if "InputError" not in docker_image:
+            in_use_tokens[container_request.submission_id] = image_cache.mark_in_use(docker_image)
+        prefetcher.prefetch(docker_image)
+
+    output_root = os.path.join(os.getcwd(), "output")
+    os.makedirs(output_root, exist_ok=True)
+
+    def run_batch_submission(container_request: ContainerRequest) -> None:
+        submission_id = container_request.submission_id
+        submission_output = os.path.join(output_root, submission_id)
+        os.makedirs(submission_output, exist_ok=True)
+
+        # Only the layers that could not be prefetched are pulled on start
+        prefetcher.wait(docker_images[submission_id])
+
+        try:
+            run_submission(
+                client,
+                submission_id,
+                docker_images[submission_id],
+                mount_volumes(output_dir=submission_output),
+                container_timeout,
+                poll_interval,
+                log_file_name=f"{submission_id}_docker.log",
+                log_max_size=log_max_size,
+                metrics_file_name=f"{submission_id}_metrics.json",
+                cpus=container_request.cpus,
+                memory=container_request.memory,
+                run_id=run_id,
+                image_cache=image_cache,
+                output_max_size=output_max_size,
+                image_limits=image_limits,
+                memoize=memoize,
+            )
+        finally:
+            if submission_id in in_use_tokens:
+                image_cache.unmark_in_use(docker_images[submission_id], in_use_tokens[submission_id])
+
+        # Move the renamed output file and the log file into output/
+        for file_name in os.listdir(submission_output):
+            if file_name.startswith(f"{submission_id}_"):
+                os.replace(
+                    os.path.join(submission_output, file_name),
+                    os.path.join(output_root, file_name),
+                )
+
+    pending = list(container_requests)
+    running = {}
+    with ThreadPoolExecutor(max_workers=max(len(container_requests), 1)) as executor:
+        while pending or running:
+            # Start every pending container that fits in the resources left
+            available_cpus = cpus - sum(r.cpus for r in running.values())
+            available_memory = memory - sum(r.memory for r in running.values())
+            for container_request in select_container_requests(
+                pending, available_cpus, available_memory, idle=not running
+            ):
+                print(
+                    f"Starting submission {container_request.submission_id} "
+                    f"({container_request.cpus} CPUs, {container_request.memory} bytes of memory)"
+                )
+                pending.remove(container_request)
+                future = executor.submit(run_batch_submission, container_request)
+                running[future] = container_request
+
+            # Wait for at least one container to finish before packing again
+            done, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+            for future in done:
+                container_request = running.pop(future)
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"Submission {container_request.submission_id} failed to run: {e}")
+                else:
+                    print(f"Submission {container_request.submission_id} finished.")
+
+            # Keep the submission images within the disk budget, without evicting
+            # the images of the submissions still queued or running
+            image_cache.evict(
+                pinned=[
+                    docker_images[container_request.submission_id]
+                    for container_request in pending + list(running.values())
+                ]
+            )
+
+    prefetcher.shutdown()
+
+
+def get_args():
+    """Set up command-line interface and get arguments."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "submission_id",
+        type=str,
+        help="The ID of the submission, or a comma-separated list of submissions (optionally <submission_id>:<cpus>:<memory>) to run in batch mode",
+    )
+    parser.add_argument("container_timeout", type=float, help="The container timeout (in minutes)")
+    parser.add_argument(
+        "poll_interval", type=float, help="The time between progress reports (in minutes)"
+    )
+    parser.add_argument("log_max_size", type=int, help="The maximum log size (in kilobytes)")
+    parser.add_argument(
+        "--cpus", type=float, default=None, help="CPUs available to the submission container(s)"
+    )
+    parser.add_argument(
+        "--memory", type=str, default=None, help="Memory available to the submission container(s), e.g. '32.GB'"
+    )
+    parser.add_argument(
+        "--container-cpus", type=float, default=1, help="Batch mode: default CPUs requested per container"
+    )
+    parser.add_argument(
+        "--container-memory", type=str, default="4.GB", help="Batch mode: default memory requested per container"
+    )
+    parser.add_argument(
+        "--run-id", type=str, default=None, help="The ID of the workflow run, used to reattach to containers after a retry"
+    )
+    parser.add_argument(
+        "--image-cache-size", type=str, default=None, help="Disk budget for submission images on the host, e.g. '100.GB'"
+    )
+    parser.add_argument(
+        "--output-max-size", type=str, default=None, help="Maximum size of a container's output directory, e.g. '20.GB'"
+    )
+    parser.add_argument(
+        "--image-max-size", type=str, default=None, help="Maximum compressed size of a submission image, e.g. '10.GB'"
+    )
+    parser.add_argument(
+        "--image-max-uncompressed-size",
+        type=str,
+        default=None,
+        help="Maximum uncompressed size of a submission image, e.g. '30.GB'",
+    )
+    parser.add_argument(
+        "--image-platform", type=str, default=None, help="Platform submission images must be built for, e.g. 'linux/amd64'"
+    )
+    parser.add_argument(
+        "--memoize",
+        action="store_true",
+        help="Reuse the outputs of an earlier run of the same image on the same input data",
+    )
+    parser.add_argument(
+        "--prefetch-workers", type=int, default=2, help="Batch mode: maximum number of images pulled at the same time"
+    )
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    image_cache_size = parse_memory(args.image_cache_size) if args.image_cache_size else None
+    output_max_size = parse_memory(args.output_max_size) if args.output_max_size else None
+    image_limits = None
+    if args.image_max_size or args.image_max_uncompressed_size or args.image_platform:
+        image_limits = ImageLimits(
+            max_compressed_size=parse_memory(args.image_max_size) if args.image_max_size else None,
+            max_uncompressed_size=(
+                parse_memory(args.image_max_uncompressed_size)
+                if args.image_max_uncompressed_size
+                else None
+            ),
+            platform=args.image_platform or None,
+        )
+
+    # Several submissions, or one with a resource override, are run in batch mode
+    if "," in args.submission_id or ":" in args.submission_id:
+        container_requests = parse_container_requests(
+            args.submission_id,
+            default_cpus=args.container_cpus,
+            default_memory=parse_memory(args.container_memory),
+        )
+        run_docker_batch(
+            container_requests,
+            args.container_timeout,
+            args.poll_interval,
+            log_max_size=args.log_max_size,
+            cpus=args.cpus,
+            memory=parse_memory(args.memory) if args.memory else None,
+            prefetch_workers=args.prefetch_workers,
+            run_id=args.run_id,
+            image_cache_size=image_cache_size,
+            output_max_size=output_max_size,
+            image_limits=image_limits,
+            memoize=args.memoize,
+        )
+    else:
+        submission_id = args.submission_id
+        log_file_name = f"{submission_id}_docker.log"
+
+        run_docker(
+            submission_id,
+            args.container_timeout,
+            args.poll_interval,
+            log_file_name=log_file_name,
+            log_max_size=args.log_max_size,
+            metrics_file_name=f"{submission_id}_metrics.json",
+            cpus=args.cpus,
+            memory=parse_memory(args.memory) if args.memory else None,
+            run_id=args.run_id,
+            image_cache_size=image_cache_size,
+            output_max_size=output_max_size,
+            image_limits=image_limits,
+            memoize=args.memoize,
+        )
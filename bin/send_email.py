@@ -6,6 +6,7 @@ from typing import List, NamedTuple
 import synapseclient
 
 import helpers
+import synapse_gateway
 
 class SubmissionAnnotations(NamedTuple):
     status: str
@@ -113,7 +114,8 @@ def get_annotations(syn: synapseclient.Synapse, submission_id: str) -> NamedTupl
         "validation_status",
         "predictions_id",
         "docker_logs_id",
-        "current_rank"
+        "current_rank",
+        "team_rank",
     ]
     submission_scores = {
         key: submission_annotations.get(key)
@@ -138,7 +140,7 @@ def send_email(view_id: str, submission_id: str, email_with_score: str, notifica
 
     """
     # Initiate connection to Synapse
-    syn = synapseclient.login()
+    syn = synapse_gateway.login(silent=False)
 
     # Get the Synapse user/team to send an e-mail to
     participant_id = helpers.get_participant_id(syn, submission_id)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+This module computes the spectral (operator 2-) norm of a matrix, i.e. its
+largest singular value, without the full SVD ``np.linalg.norm(a, 2)`` runs.
+
+The default "gram" method takes the largest eigenvalue of the smaller Gram
+matrix (``a^H a`` or ``a a^H``), which is exact up to rounding. The "power"
+method runs a power iteration on the Gram matrix until the estimate changes by
+less than ``tol`` (relative), and never forms it.
+
+Setting ``SPECTRAL_NORM_VERIFY=1`` in the environment (or passing ``verify=True``)
+checks every result against the exact SVD, within ``VERIFY_RTOL``.
+"""
+
+import os
+from typing import Optional
+
+import numpy as np
+
+VERIFY = os.environ.get("SPECTRAL_NORM_VERIFY", "0").lower() in ("1", "true", "yes")
+VERIFY_RTOL = float(os.environ.get("SPECTRAL_NORM_VERIFY_RTOL", 1e-8))
+
+
+def gram_norm(a: np.ndarray) -> np.float64:
+    """Compute the spectral norm from the largest eigenvalue of the smaller Gram matrix.
+
+    Arguments:
+        a: 2D array
+
+    Returns:
+        The largest singular value of ``a``
+    """
+    [m, n] = a.shape
+    gram = a.conj().T @ a if m >= n else a @ a.conj().T
+    largest_eigenvalue = np.linalg.eigvalsh(gram)[-1]
+
+    # Rounding can make the eigenvalue of a zero matrix slightly negative
+    return np.sqrt(np.maximum(largest_eigenvalue, 0.0))
+
+
+def power_norm(a: np.ndarray, tol: float = 1e-10, max_iter: int = 1000) -> np.float64:
+    """Estimate the spectral norm by power iteration on the Gram matrix.
+
+    Arguments:
+        a: 2D array
+        tol: relative change of the estimate between two iterations to stop at
+        max_iter: maximum number of iterations
+
+    Returns:
+        The estimate of the largest singular value of ``a``
+    """
+    [m, n] = a.shape
+    transposed = m < n
+    if transposed:
+        a = a.conj().T
+
+    # A fixed starting vector keeps the scores reproducible
+    x = np.random.default_rng(0).standard_normal(a.shape[1])
+    x /= np.linalg.norm(x)
+
+    sigma = np.float64(0.0)
+    for _ in range(max_iter):
+        y = a.conj().T @ (a @ x)
+        eigenvalue = np.linalg.norm(y)
+        if eigenvalue == 0:
+            return np.float64(0.0)
+        x = y / eigenvalue
+        new_sigma = np.sqrt(eigenvalue)
+        if abs(new_sigma - sigma) <= tol * new_sigma:
+            return new_sigma
+        sigma = new_sigma
+
+    return sigma
+
+
+def spectral_norm(
+    a: np.ndarray,
+    method: str = "gram",
+    tol: float = 1e-10,
+    max_iter: int = 1000,
+    verify: Optional[bool] = None,
+) -> np.float64:
+    """Compute the spectral norm of a matrix, i.e. ``np.linalg.norm(a, 2)``.
+
+    Arguments:
+        a: 2D array. 1D arrays get their Euclidean norm, as with ``np.linalg.norm``.
+        method: "gram" (eigenvalues of the smaller Gram matrix) or "power" (power iteration)
+        tol: relative tolerance of the "power" method
+        max_iter: maximum number of iterations of the "power" method
+        verify: check the result against the exact SVD. Defaults to ``SPECTRAL_NORM_VERIFY``.
+
+    Returns:
+        The largest singular value of ``a``, as a NumPy float like ``np.linalg.norm``
+        returns, so that dividing by the norm of a zero matrix gives inf or nan
+
+    Raises:
+        ValueError: if the method is unknown
+        RuntimeError: if verification is on and the result differs from the SVD
+    """
+    a = np.asarray(a)
+    if a.ndim != 2:
+        return np.float64(np.linalg.norm(a))
+    if a.size == 0:
+        return np.float64(0.0)
+
+    # Compute in double precision, as ``np.linalg.norm`` does
+    a = a.astype(np.result_type(a, np.float64), copy=False)
+
+    if method == "gram":
+        result = gram_norm(a)
+    elif method == "power":
+        result = power_norm(a, tol=tol, max_iter=max_iter)
+    else:
+        raise ValueError(f"Unknown spectral norm method: {method}")
+
+    if VERIFY if verify is None else verify:
+        expected = float(np.linalg.norm(a, 2))
+        rtol = max(VERIFY_RTOL, tol) if method == "power" else VERIFY_RTOL
+        if abs(result - expected) > rtol * expected:
+            raise RuntimeError(
+                f"Spectral norm ({method}) of a {a.shape} array is {result}, "
+                f"but the SVD gives {expected}"
+            )
+
+    return result
@@ -0,0 +1,493 @@
+#!/usr/bin/env python3
+"""
+This module runs a local gateway to Synapse, so that the scripts processing a
+submission share one authenticated Synapse session (and its pool of HTTPS
+connections) instead of each logging in again.
+
+The gateway is an optional, long-lived process, started once per host:
+
+    synapse_gateway.py [--socket /tmp/synapse_gateway.sock] [--endpoint URL]
+
+It logs in with ``SYNAPSE_AUTH_TOKEN`` and serves the ``GATEWAY_METHODS`` of its
+``synapseclient.Synapse`` object over a Unix socket (``SYNAPSE_GATEWAY_SOCKET``,
+``/tmp/synapse_gateway.sock`` by default). The socket is only accessible to the
+user running the gateway, and both ends check that the other runs as the same
+user before exchanging anything. Messages are JSON, and only the Synapse models
+and exceptions listed in this module are rebuilt from them. ``--endpoint``
+points the session at another server than Synapse, e.g. a local HTTP stub.
+
+Scripts call ``synapse_gateway.login()`` instead of ``synapseclient.login()``. It
+returns a ``GatewaySynapse`` proxy if the gateway answers, and logs in to
+Synapse directly otherwise. Calls through the proxy return what the Synapse
+method returns, and raise what it raises (e.g. ``SynapseHTTPError``).
+"""
+
+import argparse
+import datetime
+import functools
+import json
+import os
+import signal
+import socket
+import socketserver
+import stat
+import struct
+import tempfile
+import threading
+from typing import Any, BinaryIO, Optional, Tuple
+
+import synapseclient
+from synapseclient.core import exceptions as synapse_exceptions
+from synapseclient.entity import Entity
+
+import cache_dir
+
+SOCKET_PATH = os.environ.get(
+    "SYNAPSE_GATEWAY_SOCKET",
+    os.path.join(tempfile.gettempdir(), "synapse_gateway.sock"),
+)
+
+# Time (in seconds) allowed to connect to the gateway before falling back to a direct login
+CONNECT_TIMEOUT = 5
+
+# The Synapse methods the scripts call, and the gateway serves
+GATEWAY_METHODS = frozenset(
+    {
+        "restGET",
+        "restPOST",
+        "restPUT",
+        "restDELETE",
+        "findEntityId",
+        "getEvaluation",
+        "getSubmission",
+        "getSubmissionStatus",
+        "sendMessage",
+        "setPermissions",
+        "store",
+    }
+)
+
+# Answered by the gateway itself, with the name of the logged in user
+PING = "ping"
+
+# Frames are JSON documents prefixed with their length
+FRAME_HEADER = struct.Struct(">Q")
+
+# The credentials of the process at the other end of a Unix socket (pid, uid, gid)
+PEER_CREDENTIALS = struct.Struct("3i")
+
+# The key marking the JSON objects that stand for something else than a dict
+TYPE_KEY = "__gateway_type__"
+
+# The Synapse models sent as their dict values, by type name
+DICT_MODELS = {
+    model.__name__: model
+    for model in (
+        synapseclient.Submission,
+        synapseclient.SubmissionStatus,
+        synapseclient.Evaluation,
+    )
+}
+
+
+class GatewayError(Exception):
+    """Raised when the gateway cannot serve a call."""
+
+
+# The exceptions re-raised as themselves on the other end, by type name
+EXCEPTIONS = {
+    exception.__name__: exception
+    for exception in (
+        *[
+            value
+            for value in vars(synapse_exceptions).values()
+            if isinstance(value, type) and issubclass(value, Exception)
+        ],
+        GatewayError,
+        KeyError,
+        LookupError,
+        OSError,
+        FileNotFoundError,
+        PermissionError,
+        RuntimeError,
+        TypeError,
+        ValueError,
+    )
+}
+
+
+def encode(value: Any) -> Any:
+    """
+    Turns a message into values JSON can hold.
+
+    Arguments:
+        value: The message
+
+    Returns:
+        The message, with the Synapse models, datetimes and exceptions it holds
+        replaced by JSON objects marked with ``TYPE_KEY``
+
+    Raises:
+        TypeError: If the message holds a value of another type
+
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [encode(item) for item in value]
+    if isinstance(value, Entity):
+        return {
+            TYPE_KEY: "Entity",
+            "properties": encode(dict(value.properties)),
+            "annotations": encode(dict(value.annotations)),
+            "local_state": encode(value.local_state()),
+        }
+    if type(value).__name__ in DICT_MODELS and isinstance(value, dict):
+        return {TYPE_KEY: type(value).__name__, "values": encode(dict(value))}
+    if isinstance(value, dict):
+        values = {str(key): encode(item) for key, item in value.items()}
+        if TYPE_KEY in values:
+            return {TYPE_KEY: "dict", "values": values}
+        return values
+    if isinstance(value, datetime.datetime):
+        return {TYPE_KEY: "datetime", "value": value.isoformat()}
+    if isinstance(value, BaseException):
+        try:
+            args = encode(value.args)
+        except TypeError:
+            args = [str(value)]
+        return {TYPE_KEY: "exception", "name": type(value).__name__, "args": args}
+    raise TypeError(f"{type(value).__name__} cannot be sent through the gateway")
+
+
+def decode(value: Any) -> Any:
+    """
+    Rebuilds a message turned into JSON values by ``encode``.
+
+    Arguments:
+        value: The JSON values
+
+    Returns:
+        The message. Exceptions of types outside of ``EXCEPTIONS`` are rebuilt as
+        ``GatewayError``.
+
+    Raises:
+        ValueError: If the values hold an object of an unknown type
+
+    """
+    if isinstance(value, list):
+        return [decode(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+
+    value_type = value.get(TYPE_KEY)
+    if value_type is None:
+        return {key: decode(item) for key, item in value.items()}
+    if value_type == "dict":
+        return {key: decode(item) for key, item in value["values"].items()}
+    if value_type == "Entity":
+        return Entity.create(
+            decode(value["properties"]),
+            decode(value["annotations"]),
+            decode(value["local_state"]),
+        )
+    if value_type in DICT_MODELS:
+        return DICT_MODELS[value_type](**decode(value["values"]))
+    if value_type == "datetime":
+        return datetime.datetime.fromisoformat(value["value"])
+    if value_type == "exception":
+        args = decode(value["args"])
+        exception = EXCEPTIONS.get(value["name"])
+        if exception is not None:
+            try:
+                return exception(*args)
+            except TypeError:
+                pass
+        return GatewayError(f"{value['name']}: {', '.join(map(str, args))}")
+    raise ValueError(f"Unknown type {value_type} in a gateway message")
+
+
+def write_frame(stream: BinaryIO, message: Any) -> None:
+    """
+    Writes a message to a stream, as a length-prefixed JSON document.
+
+    Arguments:
+        stream: The stream to write to
+        message: The message
+
+    Raises:
+        TypeError: If the message holds a value ``encode`` does not handle
+
+    """
+    payload = json.dumps(encode(message)).encode()
+    stream.write(FRAME_HEADER.pack(len(payload)) + payload)
+    stream.flush()
+
+
+def read_frame(stream: BinaryIO) -> Any:
+    """
+    Reads a message written by ``write_frame`` from a stream.
+
+    Arguments:
+        stream: The stream to read from
+
+    Returns:
+        The message
+
+    Raises:
+        EOFError: If the stream ends before a complete message
+        ValueError: If the message is not a valid JSON document
+
+    """
+    header = stream.read(FRAME_HEADER.size)
+    if len(header) < FRAME_HEADER.size:
+        raise EOFError("The connection was closed")
+    (size,) = FRAME_HEADER.unpack(header)
+    payload = stream.read(size)
+    if len(payload) < size:
+        raise EOFError("The connection was closed")
+
+    return decode(json.loads(payload))
+
+
+def check_peer(sock: socket.socket, socket_path: str) -> None:
+    """
+    Checks that the process at the other end of a Unix socket runs as the current user.
+
+    Where the peer's credentials are not available, the socket file is checked
+    instead: it must belong to the current user, and sit in a folder only they can
+    write to (see ``cache_dir.check_private_dir``).
+
+    Arguments:
+        sock: The connected socket
+        socket_path: The path of the socket
+
+    Raises:
+        PermissionError: If the peer runs as another user, or cannot be checked
+
+    """
+    if hasattr(socket, "SO_PEERCRED"):
+        credentials = sock.getsockopt(
+            socket.SOL_SOCKET, socket.SO_PEERCRED, PEER_CREDENTIALS.size
+        )
+        _, uid, _ = PEER_CREDENTIALS.unpack(credentials)
+        if uid != os.getuid():
+            raise PermissionError(f"{socket_path} is served by another user")
+        return
+
+    socket_stat = os.lstat(socket_path)
+    if not stat.S_ISSOCK(socket_stat.st_mode):
+        raise PermissionError(f"{socket_path} is not a socket")
+    if socket_stat.st_uid != os.getuid():
+        raise PermissionError(f"{socket_path} is owned by another user")
+    if socket_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise PermissionError(f"{socket_path} can be written to by other users")
+    cache_dir.check_private_dir(os.path.dirname(os.path.abspath(socket_path)))
+
+
+class GatewayHandler(socketserver.StreamRequestHandler):
+    """Serves the calls of one client connection, one at a time, until it is closed."""
+
+    def handle(self) -> None:
+        syn = self.server.syn
+        while True:
+            try:
+                method, args, kwargs = read_frame(self.rfile)
+            except (EOFError, ValueError):
+                return
+
+            if method == PING:
+                response = ("ok", getattr(syn, "username", None))
+            elif method not in GATEWAY_METHODS:
+                response = ("error", GatewayError(f"{method} is not served by the gateway"))
+            else:
+                try:
+                    response = ("ok", getattr(syn, method)(*args, **kwargs))
+                except Exception as e:
+                    response = ("error", e)
+
+            try:
+                write_frame(self.wfile, response)
+            except TypeError as e:
+                write_frame(
+                    self.wfile,
+                    ("error", GatewayError(f"The result of {method} cannot be sent: {e}")),
+                )
+
+
+class GatewayServer(socketserver.ThreadingUnixStreamServer):
+    """A Unix socket server sharing one Synapse session between its client connections."""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, syn: synapseclient.Synapse):
+        self.syn = syn
+        if os.path.exists(socket_path):
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                try:
+                    probe.connect(socket_path)
+                except OSError:
+                    # A socket left by a gateway that did not shut down cleanly
+                    os.remove(socket_path)
+                else:
+                    raise GatewayError(f"A gateway is already serving on {socket_path}")
+        # Only the user running the gateway may connect to it
+        previous_umask = os.umask(0o177)
+        try:
+            super().__init__(socket_path, GatewayHandler)
+        finally:
+            os.umask(previous_umask)
+
+    def verify_request(self, request: socket.socket, client_address: Any) -> bool:
+        # Refuse the clients of other users, should the socket's permissions be widened
+        try:
+            check_peer(request, self.server_address)
+        except PermissionError as e:
+            print(f"Refused a connection to the Synapse gateway: {e}")
+            return False
+        return True
+
+
+def serve(syn: synapseclient.Synapse, socket_path: str = SOCKET_PATH) -> None:
+    """
+    Serves a Synapse session over a Unix socket, until interrupted.
+
+    Arguments:
+        syn: The (logged in) Synapse session to share
+        socket_path: The path of the Unix socket
+
+    """
+    with GatewayServer(socket_path, syn) as server:
+        print(f"Serving Synapse on {socket_path}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(socket_path)
+
+
+class GatewaySynapse:
+    """
+    A proxy to the Synapse session of a gateway, exposing its ``GATEWAY_METHODS``.
+
+    Arguments:
+        socket_path: The path of the gateway's Unix socket
+
+    Raises:
+        OSError: If the gateway cannot be reached
+        PermissionError: If the gateway runs as another user
+
+    """
+
+    def __init__(self, socket_path: str = SOCKET_PATH):
+        self._lock = threading.Lock()
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self._socket.settimeout(CONNECT_TIMEOUT)
+            self._socket.connect(socket_path)
+            check_peer(self._socket, socket_path)
+            self._stream = self._socket.makefile("rwb")
+            self.username = self._call(PING)
+        except BaseException:
+            self._socket.close()
+            raise
+        # Calls (e.g. uploads) may take longer than connecting
+        self._socket.settimeout(None)
+
+    def _call(self, method: str, *args, **kwargs) -> Any:
+        # Files are uploaded and downloaded by the gateway, so relative paths are resolved here
+        if kwargs.get("downloadLocation"):
+            kwargs["downloadLocation"] = os.path.abspath(kwargs["downloadLocation"])
+        for arg in list(args) + list(kwargs.values()):
+            if isinstance(arg, synapseclient.File) and arg.get("path"):
+                arg.path = os.path.abspath(arg.path)
+
+        with self._lock:
+            try:
+                write_frame(self._stream, (method, args, kwargs))
+                status, result = read_frame(self._stream)
+            except EOFError as e:
+                raise GatewayError(f"The gateway closed the connection during {method}") from e
+            except ValueError as e:
+                raise GatewayError(f"The gateway sent an invalid answer to {method}") from e
+
+        if status == "error":
+            raise result
+        return result
+
+    def __getattr__(self, name: str) -> Any:
+        if name not in GATEWAY_METHODS:
+            raise AttributeError(f"{name} is not served by the Synapse gateway")
+        return functools.partial(self._call, name)
+
+    def close(self) -> None:
+        """Closes the connection to the gateway."""
+        self._stream.close()
+        self._socket.close()
+
+
+def login(silent: bool = True, socket_path: Optional[str] = None) -> Any:
+    """
+    Connects to the Synapse gateway, or logs in to Synapse directly if it is not running.
+
+    Arguments:
+        silent: Whether to hide the welcome message of a direct login
+        socket_path: The path of the gateway's Unix socket. Defaults to ``SOCKET_PATH``.
+
+    Returns:
+        A ``GatewaySynapse`` proxy, or a logged in ``synapseclient.Synapse``
+
+    """
+    socket_path = socket_path or SOCKET_PATH
+    if os.path.exists(socket_path):
+        try:
+            return GatewaySynapse(socket_path)
+        except (OSError, EOFError, ValueError, GatewayError) as e:
+            print(f"Could not connect to the Synapse gateway, logging in directly: {e}")
+
+    return synapseclient.login(silent=silent)
+
+
+def get_args() -> argparse.Namespace:
+    """Set up command-line interface and get arguments."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--socket",
+        type=str,
+        default=SOCKET_PATH,
+        help="The path of the Unix socket to serve on",
+    )
+    parser.add_argument(
+        "--endpoint",
+        type=str,
+        default=None,
+        help="The base URL of the server to use instead of Synapse, e.g. a local HTTP stub",
+    )
+
+    return parser.parse_args()
+
+
+def get_endpoints(endpoint: str) -> Tuple[str, str, str]:
+    """Returns the repository, authentication and file handle endpoints under a base URL."""
+    endpoint = endpoint.rstrip("/")
+    return f"{endpoint}/repo/v1", f"{endpoint}/auth/v1", f"{endpoint}/file/v1"
+
+
+if __name__ == "__main__":
+    args = get_args()
+    if args.endpoint:
+        repo_endpoint, auth_endpoint, file_endpoint = get_endpoints(args.endpoint)
+        syn = synapseclient.Synapse(
+            repoEndpoint=repo_endpoint,
+            authEndpoint=auth_endpoint,
+            fileHandleEndpoint=file_endpoint,
+            skip_checks=True,
+        )
+    else:
+        syn = synapseclient.Synapse()
+    syn.login(silent=True)
+
+    # Remove the socket when stopped, as when interrupted
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    serve(syn, args.socket)
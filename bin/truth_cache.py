@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+This module caches quantities derived from the ground truth only (norms,
+histograms, power spectra, ...), so that they are computed once per ground
+truth file instead of once per scored submission.
+
+Entries are ``.npz`` files under ``GROUNDTRUTH_CACHE`` (``/tmp/groundtruth_cache``
+by default). Scoring tasks on the same host reuse each other's entries only where
+``/tmp`` is a host folder, as ``aws.batch.volumes`` makes it on AWS Batch; under
+the local Docker profile, set ``GROUNDTRUTH_CACHE`` to a folder mounted into the
+scoring containers, or each task computes the quantities again. Entries are
+only read from a folder owned by, and only writable by, the current user. They
+are keyed by the SHA-256 of the ground truth file, the name of the quantities
+and their parameters, the version of the code computing them (given by the
+caller, e.g. ``result_memo.code_version`` of the scoring modules), and
+``CACHE_VERSION``, which must be bumped whenever the format of the entries
+changes.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import zipfile
+from typing import Callable, Dict
+
+import numpy as np
+
+from cache_dir import check_private_dir, make_private_dir
+
+CACHE_DIR = os.environ.get(
+    "GROUNDTRUTH_CACHE",
+    os.path.join(tempfile.gettempdir(), "groundtruth_cache"),
+)
+CACHE_VERSION = 1
+
+# Size of the chunks read when hashing a file
+HASH_CHUNK_SIZE = 1024**2
+
+# Quantities already read or computed by this process, by cache key
+_loaded: Dict[str, Dict[str, np.ndarray]] = {}
+
+
+def set_cache_dir(path: str) -> str:
+    """
+    Moves the cache of this process to another folder, e.g. to keep test data out
+    of the shared cache. The quantities kept in memory are forgotten.
+
+    Arguments:
+        path: The path of the folder
+
+    Returns:
+        The path of the previous folder, to restore it with
+
+    """
+    global CACHE_DIR
+    previous_dir, CACHE_DIR = CACHE_DIR, path
+    clear_memory()
+
+    return previous_dir
+
+
+def clear_memory() -> None:
+    """Forgets the quantities kept in memory, so they are read from the cache on disk again."""
+    _loaded.clear()
+
+
+def _write_atomic(path: str, write: Callable) -> None:
+    # Written to a temporary file and moved into place, so concurrent readers never see a partial file
+    make_private_dir(CACHE_DIR)
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            write(tmp_file)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def file_digest(path: str) -> str:
+    """
+    Returns the SHA-256 of a file. The digest is recorded next to the cache along with
+    the size and modification time of the file, so unchanged files are only hashed once.
+
+    Arguments:
+        path: The path of the file
+
+    Returns:
+        The hexadecimal SHA-256 of the file
+
+    """
+    stat = os.stat(path)
+    real_path = os.path.realpath(path)
+    record_path = os.path.join(
+        CACHE_DIR, "digests", hashlib.sha1(real_path.encode()).hexdigest() + ".json"
+    )
+    try:
+        check_private_dir(CACHE_DIR)
+        with open(record_path, "r") as record_file:
+            record = json.load(record_file)
+        if record["size"] == stat.st_size and record["mtime_ns"] == stat.st_mtime_ns:
+            return record["sha256"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    digest = sha256.hexdigest()
+
+    record = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest}
+    try:
+        _write_atomic(record_path, lambda f: f.write(json.dumps(record).encode()))
+    except OSError as e:
+        print(f"Could not record the digest of {path}: {e}")
+
+    return digest
+
+
+def get_truth_stats(
+    truth_path: str,
+    name: str,
+    params: dict,
+    compute: Callable[[], Dict[str, np.ndarray]],
+    code_version: str = "",
+) -> Dict[str, np.ndarray]:
+    """
+    Retrieves quantities derived from a ground truth file, from the cache if possible.
+    Failing to read or write the cache is not an error: the quantities are then computed.
+    Quantities are also kept in memory, so a process scoring many submissions only
+    reads them once.
+
+    Arguments:
+        truth_path: The path of the ground truth file
+        name: The name of the quantities, e.g. 'pde_truth_stats'
+        params: The parameters the quantities depend on, e.g. {'k': 20, 'modes': 30}
+        compute: Computes the quantities from the ground truth, if they are not cached
+        code_version: The version of the code computing the quantities, so that
+                      quantities computed by older code are not reused
+
+    Returns:
+        The quantities, by name. Scalars are returned as 0-d arrays.
+
+    """
+    try:
+        key = hashlib.sha256(
+            json.dumps(
+                {
+                    "version": CACHE_VERSION,
+                    "truth": file_digest(truth_path),
+                    "name": name,
+                    "params": params,
+                    "code": code_version,
+                },
+                sort_keys=True,
+            ).encode()
+        ).hexdigest()
+    except OSError as e:
+        print(f"Could not hash {truth_path}: {e}")
+        return compute()
+    if key in _loaded:
+        return _loaded[key]
+    cache_path = os.path.join(CACHE_DIR, f"{name}_{key}.npz")
+
+    try:
+        check_private_dir(CACHE_DIR)
+        with np.load(cache_path) as cached:
+            _loaded[key] = {field: cached[field] for field in cached.files}
+            return _loaded[key]
+    except (OSError, ValueError, zipfile.BadZipFile):
+        pass
+
+    stats = compute()
+    try:
+        _write_atomic(cache_path, lambda f: np.savez(f, **stats))
+    except OSError as e:
+        print(f"Could not write {name} of {truth_path} to the ground truth cache: {e}")
+    _loaded[key] = stats
+
+    return stats
@@ -6,6 +6,7 @@ import sys
 from typing import Union, Dict, Any
 import synapseclient
 import helpers
+import synapse_gateway
 
 
 def store_file(
@@ -94,7 +95,7 @@ def update_folders(
 
     """
     # Log into the client
-    syn = synapseclient.login(silent=True)
+    syn = synapse_gateway.login(silent=True)
 
     # Retrieving Synapse IDs that will be necessary later
     project_id = syn.findEntityId(name=project_name)
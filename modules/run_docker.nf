@@ -21,10 +21,11 @@ process RUN_DOCKER {
     val ready
 
     output:
-    tuple val(submission_id), path('output/*_predictions.{csv,zip}'), path('output/*.log')
+    tuple val(submission_id), path('output/*_predictions.{csv,zip}'), path('output/*.log'), emit: predictions
+    tuple val(submission_id), path('output/*_metrics.json'), optional: true, emit: metrics
 
     script:
     """
-    run_docker.py '${submission_id}' '${container_timeout}' '${poll_interval}' '${log_max_size}'
+    run_docker.py '${submission_id}' '${container_timeout}' '${poll_interval}' '${log_max_size}' --cpus '${task.cpus}' --memory '${task.memory.toBytes()}B' --run-id '${workflow.sessionId}' --image-cache-size '${params.image_cache_size}' --output-max-size '${params.output_max_size}' --image-max-size '${params.image_max_size}' --image-max-uncompressed-size '${params.image_max_uncompressed_size}' --image-platform '${params.image_platform}' ${params.memoize_runs ? '--memoize' : ''}
     """
 }
@@ -18,6 +18,7 @@ process SCORE {
 
     script:
     """
+    export SCORING_CPUS=${task.cpus}
     status=\$(${execute_scoring} -p '${predictions}' -g '${groundtruth}' -o '${results}' -t '${task_number}')
     """
 }
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The scripts under bin/ import their sibling modules by name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "bin"))
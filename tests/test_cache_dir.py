@@ -0,0 +1,30 @@
+import os
+
+import pytest
+
+from cache_dir import check_private_dir, make_private_dir
+
+
+def test_make_private_dir_creates_folder_only_user_can_access(tmp_path):
+    path = tmp_path / "cache"
+
+    make_private_dir(str(path))
+
+    assert os.stat(path).st_mode & 0o777 == 0o700
+
+
+def test_check_private_dir_refuses_folder_others_can_write_to(tmp_path):
+    path = tmp_path / "cache"
+    path.mkdir()
+    os.chmod(path, 0o777)
+
+    with pytest.raises(PermissionError):
+        check_private_dir(str(path))
+
+
+def test_check_private_dir_refuses_symbolic_link(tmp_path):
+    (tmp_path / "target").mkdir(mode=0o700)
+    os.symlink(tmp_path / "target", tmp_path / "cache")
+
+    with pytest.raises(PermissionError):
+        check_private_dir(str(tmp_path / "cache"))
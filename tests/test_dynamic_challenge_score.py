@@ -0,0 +1,168 @@
+import os
+import tarfile
+
+import numpy as np
+import pytest
+
+import truth_cache
+
+from dynamic_challenge_score import (
+    BLAS_THREADS_VARIABLES,
+    SYSTEM_TO_FORECAST,
+    calculate_all_scores,
+    forecast,
+    house_zero_score,
+    reconstruction,
+)
+
+# Shapes of each system's arrays, with fewer time steps than the testing datasets
+SHAPES = {
+    "doublependulum": (4, 2000),
+    "Lorenz": (3, 2000),
+    "Rossler": (3, 2000),
+    "KS": (1024, 200),
+    "Lorenz96": (100, 200),
+    "Kolmogorov": (128 * 128, 40),
+    "HouseZero": (500, 3),
+}
+
+
+def random_pair(shape, seed=0):
+    rng = np.random.default_rng(seed)
+    truth = 5 * rng.standard_normal(shape)
+    return truth, truth + 0.1 * rng.standard_normal(shape)
+
+
+# The metrics as computed before they were optimized
+def baseline_short_time_error(truth, prediction, k):
+    return np.linalg.norm(truth[:, 0:k] - prediction[:, 0:k], 2) / np.linalg.norm(
+        truth[:, 0:k], 2
+    )
+
+
+def baseline_ode_forecast(truth, prediction, k, modes):
+    elts = []
+    for row, bins in enumerate([np.arange(-20, 21), np.arange(-20, 21), np.arange(0, 51)]):
+        hist_truth, _ = np.histogram(truth[-modes:, :][row, :], bins=bins)
+        hist_prediction, _ = np.histogram(prediction[-modes:, :][row, :], bins=bins)
+        norm = np.linalg.norm(hist_truth, 2)
+        elts.append(np.linalg.norm(hist_truth - hist_prediction, 2) / norm if norm > 0 else 0)
+    elt = sum(elts) / 3
+
+    return 100 * (1 - baseline_short_time_error(truth, prediction, k)), 100 * (1 - elt)
+
+
+def baseline_pde_forecast(truth, prediction, k, modes):
+    [m, n] = truth.shape
+    pt = np.empty((2 * modes + 1, 0))
+    pp = np.empty((2 * modes + 1, 0))
+    for j in range(1, k + 1):
+        pt3 = np.fft.fftshift(np.abs(np.fft.fft(truth[:, n - j])) ** 2)
+        pp3 = np.fft.fftshift(np.abs(np.fft.fft(prediction[:, n - j])) ** 2)
+        pt = np.column_stack((pt, np.log(pt3[int(m / 2) - modes: int(m / 2) + modes + 1])))
+        pp = np.column_stack((pp, np.log(pp3[int(m / 2) - modes: int(m / 2) + modes + 1])))
+    elt = np.linalg.norm(pt - pp, 2) / np.linalg.norm(pt, 2)
+
+    return 100 * (1 - baseline_short_time_error(truth, prediction, k)), 100 * (1 - elt)
+
+
+def baseline_pde_forecast_2d(truth, prediction, k, modes, nf):
+    [_, n] = truth.shape
+    pt = np.empty((2 * modes + 1, 0))
+    pp = np.empty((2 * modes + 1, 0))
+    for j in range(1, k + 1):
+        truth_fft = np.abs(np.fft.fft2(truth[:, n - j].reshape((nf, nf), order="F")))
+        prediction_fft = np.abs(np.fft.fft2(prediction[:, n - j].reshape((nf, nf), order="F")))
+        pt3 = np.fft.fftshift((truth_fft**2)[:, int(nf / 2) + 1])
+        pp3 = np.fft.fftshift((prediction_fft**2)[:, int(nf / 2) + 1])
+        pt = np.column_stack((pt, np.log(pt3[int(nf / 2) - modes: int(nf / 2) + modes + 1])))
+        pp = np.column_stack((pp, np.log(pp3[int(nf / 2) - modes: int(nf / 2) + modes + 1])))
+    elt = np.linalg.norm(pt - pp, 2) / np.linalg.norm(pt, 2)
+
+    return 100 * (1 - baseline_short_time_error(truth, prediction, k)), 100 * (1 - elt)
+
+
+BASELINE_FORECASTS = {
+    "doublependulum": baseline_ode_forecast,
+    "Lorenz": baseline_ode_forecast,
+    "Rossler": baseline_ode_forecast,
+    "Kolmogorov": baseline_pde_forecast_2d,
+    "KS": baseline_pde_forecast,
+    "Lorenz96": baseline_pde_forecast,
+}
+
+
+@pytest.mark.parametrize("system", sorted(BASELINE_FORECASTS))
+def test_forecast_matches_the_baseline(system):
+    truth, prediction = random_pair(SHAPES[system])
+    params = SYSTEM_TO_FORECAST[system]["params"]
+
+    expected = BASELINE_FORECASTS[system](truth, prediction, **params)
+
+    np.testing.assert_allclose(forecast(truth, prediction, system), expected, rtol=1e-10)
+    truth_stats = SYSTEM_TO_FORECAST[system]["truth_stats"](truth, **params)
+    np.testing.assert_allclose(
+        forecast(truth, prediction, system, truth_stats=truth_stats), expected, rtol=1e-10
+    )
+
+
+@pytest.mark.parametrize("system", sorted(SHAPES))
+def test_reconstruction_matches_the_baseline(system):
+    truth, prediction = random_pair(SHAPES[system])
+
+    expected = 100 * (1 - np.linalg.norm(truth - prediction, 2) / np.linalg.norm(truth, 2))
+
+    np.testing.assert_allclose(reconstruction(truth, prediction), expected, rtol=1e-10)
+
+
+def test_house_zero_score_matches_the_baseline():
+    truth, prediction = random_pair(SHAPES["HouseZero"])
+
+    expected = [
+        100
+        * (
+            1
+            - np.linalg.norm((prediction[:, i] - truth[:, i]) ** 2)
+            / np.linalg.norm(truth[:, i] ** 2)
+        )
+        for i in (1, 2, 0)
+    ]
+
+    np.testing.assert_allclose(house_zero_score(truth, prediction), expected, rtol=1e-10)
+
+
+def test_all_zero_truth_scores_like_the_baseline():
+    with np.errstate(divide="ignore", invalid="ignore"):
+        assert reconstruction(np.zeros((3, 100)), np.ones((3, 100))) == -np.inf
+
+
+def test_pool_workers_score_like_this_process(tmp_path, monkeypatch):
+    for variable in BLAS_THREADS_VARIABLES:
+        monkeypatch.delenv(variable, raising=False)
+    # Keep the ground truth of the test out of the shared cache, also in the pool workers
+    monkeypatch.setenv("GROUNDTRUTH_CACHE", str(tmp_path / "cache"))
+    monkeypatch.setattr(truth_cache, "CACHE_DIR", str(tmp_path / "cache"))
+    groundtruth_path = tmp_path / "groundtruth"
+    predictions_dir = tmp_path / "predictions"
+    predictions_dir.mkdir()
+    for seed, system in enumerate(["KS", "Lorenz", "Rossler"]):
+        truth, prediction = random_pair(SHAPES[system], seed=seed)
+        (groundtruth_path / f"Test_{system}").mkdir(parents=True)
+        np.save(groundtruth_path / f"Test_{system}" / "X1test.npy", truth)
+        np.save(predictions_dir / f"{system}_X1prediction.npy", prediction)
+    predictions_path = tmp_path / "predictions.tar"
+    with tarfile.open(predictions_path, "w") as tar_f:
+        for name in os.listdir(predictions_dir):
+            tar_f.add(predictions_dir / name, arcname=name)
+
+    scores = [
+        calculate_all_scores(
+            str(groundtruth_path), str(predictions_path), "9615379", workers=workers
+        )
+        for workers in (1, 3)
+    ]
+
+    assert len(scores[0]) == 6
+    assert scores[0] == scores[1]
+    # Only the pool workers get one BLAS thread
+    assert not any(variable in os.environ for variable in BLAS_THREADS_VARIABLES)
@@ -0,0 +1,68 @@
+import docker
+
+from image_cache import ImageCache
+
+GB = 1024**3
+
+
+class FakeImages:
+    def __init__(self, sizes):
+        self.sizes = dict(sizes)
+
+    def get(self, docker_image):
+        if docker_image not in self.sizes:
+            raise docker.errors.ImageNotFound(docker_image)
+        return type("Image", (), {"attrs": {"Size": self.sizes[docker_image]}})()
+
+    def remove(self, docker_image):
+        del self.sizes[docker_image]
+
+
+class FakeClient:
+    def __init__(self, sizes):
+        self.images = FakeImages(sizes)
+
+
+def test_evict_skips_images_marked_in_use(tmp_path):
+    client = FakeClient({"a@sha256:1": GB, "b@sha256:2": GB, "c@sha256:3": GB})
+    state_path = str(tmp_path / "state.json")
+    image_cache = ImageCache(client, max_size=2 * GB, state_path=state_path)
+    for docker_image in ["a@sha256:1", "b@sha256:2", "c@sha256:3"]:
+        image_cache.touch(docker_image)
+
+    # Another task is running the least recently used image
+    other_task = ImageCache(client, max_size=None, state_path=state_path)
+    token = other_task.mark_in_use("a@sha256:1")
+
+    assert image_cache.evict() == ["b@sha256:2"]
+
+    other_task.unmark_in_use("a@sha256:1", token)
+    image_cache.max_size = GB
+
+    assert image_cache.evict() == ["a@sha256:1"]
+
+
+def test_evict_keeps_marks_of_images_being_pulled(tmp_path):
+    client = FakeClient({})
+    image_cache = ImageCache(client, max_size=GB, state_path=str(tmp_path / "state.json"))
+    image_cache.mark_in_use("a@sha256:1")
+
+    image_cache.evict()
+
+    # Once pulled, the image is still marked in use
+    client.images.sizes["a@sha256:1"] = 2 * GB
+    image_cache.touch("a@sha256:1")
+    assert image_cache.evict() == []
+
+
+def test_state_in_a_shared_folder_is_ignored(tmp_path):
+    shared_dir = tmp_path / "shared"
+    shared_dir.mkdir()
+    shared_dir.chmod(0o777)
+    client = FakeClient({"a@sha256:1": GB})
+    image_cache = ImageCache(client, max_size=0, state_path=str(shared_dir / "state.json"))
+
+    image_cache.touch("a@sha256:1")
+
+    assert image_cache.evict() == []
+    assert list(shared_dir.iterdir()) == []
@@ -0,0 +1,79 @@
+import random
+
+import pytest
+
+import leaderboard
+from leaderboard import (
+    ALL_SUBMISSIONS,
+    BEST_PER_TEAM,
+    Entry,
+    Leaderboard,
+    LeaderboardStore,
+    read_score,
+)
+
+
+def random_entries(count, seed=0):
+    rng = random.Random(seed)
+    return [
+        Entry(
+            str(rng.randrange(25)),
+            str(rng.randrange(6)),
+            float(rng.randrange(10)),
+            f"2024-01-{rng.randrange(10, 30)}",
+        )
+        for _ in range(count)
+    ]
+
+
+def test_store_replays_scores_appended_since_the_snapshot(tmp_path, monkeypatch):
+    monkeypatch.setattr(leaderboard, "SNAPSHOT_INTERVAL", 7)
+    entries = random_entries(60)
+
+    for entry in entries:
+        with LeaderboardStore("9615379", store_dir=str(tmp_path)) as store:
+            store.add(entry)
+
+    assert (tmp_path / "9615379.snapshot.json").exists()
+    expected = Leaderboard.from_entries(entries)
+    with LeaderboardStore("9615379", exclusive=False, store_dir=str(tmp_path)) as store:
+        for view in (ALL_SUBMISSIONS, BEST_PER_TEAM):
+            assert store.leaderboard.ranking(view) == expected.ranking(view)
+
+
+def test_store_ignores_snapshot_of_other_order(tmp_path, monkeypatch):
+    monkeypatch.setattr(leaderboard, "SNAPSHOT_INTERVAL", 1)
+    entries = random_entries(20, seed=1)
+    with LeaderboardStore("9615379", store_dir=str(tmp_path)) as store:
+        for entry in entries:
+            store.add(entry)
+
+    with LeaderboardStore(
+        "9615379", higher_is_better=False, exclusive=False, store_dir=str(tmp_path)
+    ) as store:
+        assert store.leaderboard.ranking() == Leaderboard.from_entries(entries, False).ranking()
+
+
+def test_store_requires_a_folder(monkeypatch):
+    monkeypatch.setattr(leaderboard, "STORE_DIR", None)
+
+    with pytest.raises(ValueError):
+        LeaderboardStore("9615379")
+
+
+def test_store_read_lock_cannot_add(tmp_path):
+    with LeaderboardStore("9615379", exclusive=False, store_dir=str(tmp_path)) as store:
+        with pytest.raises(ValueError):
+            store.add(Entry("1", "1", 1.0, "2024-01-10"))
+
+
+@pytest.mark.parametrize("score_key", [None, "ltf_E2"])
+@pytest.mark.parametrize("score", ["NaN", "Infinity", "-Infinity"])
+def test_read_score_rejects_non_finite_scores(tmp_path, score_key, score):
+    results_path = tmp_path / "results.json"
+    results_path.write_text(
+        '{"score_status": "SCORED", "stf_E1": 50.0, "ltf_E2": %s}' % score
+    )
+
+    assert read_score(str(results_path), score_key) is None
+    assert read_score(str(results_path), "stf_E1") == 50.0
@@ -0,0 +1,41 @@
+import tarfile
+
+import numpy as np
+import pytest
+
+import npy_tar
+
+
+@pytest.mark.parametrize("mode", ["w", "w:gz", "w:bz2", "w:xz"])
+def test_uncompressed_tar_members_are_memory_mapped(tmp_path, mode):
+    arrays = {f"S{i}_X1prediction.npy": np.arange(12.0).reshape(3, 4) * i for i in range(3)}
+    tar_filename = tmp_path / "predictions.tar"
+    with tarfile.open(tar_filename, mode) as tar_f:
+        for name, array in arrays.items():
+            np.save(tmp_path / name, array)
+            tar_f.add(tmp_path / name, arcname=f"predictions/{name}")
+
+    with npy_tar.uncompressed_tar(str(tar_filename)) as tar_path:
+        members = npy_tar.index_tar(tar_path)
+        for name, array in arrays.items():
+            loaded = npy_tar.load_member(tar_path, members[name])
+            assert isinstance(loaded, np.memmap)
+            np.testing.assert_array_equal(loaded, array)
+        del loaded
+
+    # The decompressed copy is removed on exit
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted(
+        ["predictions.tar", *arrays]
+    )
+
+
+def test_uncompressed_tar_rejects_truncated_archive(tmp_path):
+    tar_filename = tmp_path / "predictions.tar"
+    np.save(tmp_path / "a.npy", np.zeros(100000))
+    with tarfile.open(tar_filename, "w:gz") as tar_f:
+        tar_f.add(tmp_path / "a.npy", arcname="a.npy")
+    tar_filename.write_bytes(tar_filename.read_bytes()[:200])
+
+    with pytest.raises(tarfile.ReadError):
+        with npy_tar.uncompressed_tar(str(tar_filename)):
+            pass
@@ -0,0 +1,131 @@
+import os
+
+import pytest
+
+import result_memo
+import run_docker
+import truth_cache
+from run_docker import ContainerRequest, parse_container_requests, select_container_requests
+
+GB = 1024**3
+
+
+def test_parse_container_requests_applies_overrides():
+    container_requests = parse_container_requests(
+        "9741046, 9741047:2:8.GB,,9741048:0.5", default_cpus=1, default_memory=4 * GB
+    )
+
+    assert container_requests == [
+        ContainerRequest("9741046", 1, 4 * GB),
+        ContainerRequest("9741047", 2.0, 8 * GB),
+        ContainerRequest("9741048", 0.5, 4 * GB),
+    ]
+
+
+def test_select_container_requests_packs_first_fit():
+    pending = [
+        ContainerRequest("1", 4, 8 * GB),
+        ContainerRequest("2", 4, 8 * GB),
+        ContainerRequest("3", 2, 4 * GB),
+    ]
+
+    selected = select_container_requests(pending, 6, 16 * GB, idle=True)
+
+    assert [r.submission_id for r in selected] == ["1", "3"]
+
+
+def test_select_container_requests_runs_oversized_request_alone():
+    pending = [ContainerRequest("1", 16, 64 * GB), ContainerRequest("2", 1, GB)]
+
+    # The small request is started first, and the oversized one waits for an idle host
+    assert select_container_requests(pending, 8, 32 * GB, idle=True) == [pending[1]]
+    assert select_container_requests(pending[:1], 8, 32 * GB, idle=False) == []
+    assert select_container_requests(pending[:1], 8, 32 * GB, idle=True) == pending[:1]
+
+
+def test_run_docker_batch_moves_invalid_outputs(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("SYNAPSE_AUTH_TOKEN", "token")
+    monkeypatch.setattr(run_docker, "connect", lambda token: (object(), object()))
+    monkeypatch.setattr(
+        run_docker,
+        "get_submission_image",
+        lambda syn, submission_id: f"InputError: Submission {submission_id} should be a Docker image, not File",
+    )
+
+    run_docker.run_docker_batch(
+        parse_container_requests("1,2:2:1.GB", default_cpus=1, default_memory=GB),
+        container_timeout=1,
+        cpus=4,
+        memory=4 * GB,
+    )
+
+    output_root = tmp_path / "output"
+    assert sorted(f.name for f in output_root.iterdir() if f.is_file()) == [
+        "1_INVALID_predictions.csv",
+        "1_docker.log",
+        "2_INVALID_predictions.csv",
+        "2_docker.log",
+    ]
+    assert os.listdir(output_root / "1") == []
+    assert "should be a Docker image" in (output_root / "2_INVALID_predictions.csv").read_text()
+
+
+class FakeContainer:
+    short_id = "abc123"
+    status = "exited"
+
+    def __init__(self, exit_code):
+        self.attrs = {"State": {"ExitCode": exit_code}, "Mounts": []}
+
+    def logs(self, **kwargs):
+        return iter([b"done\n"])
+
+    def reload(self):
+        pass
+
+    def remove(self, force=False):
+        pass
+
+
+class FakeClient:
+    def __init__(self, container):
+        self.containers = type(
+            "Containers", (), {"list": lambda *a, **k: [], "run": lambda *a, **k: container}
+        )()
+        self.images = type("Images", (), {"get": lambda *a, **k: None})()
+
+
+@pytest.mark.parametrize("exit_code, recorded", [(0, True), (1, False)])
+def test_run_submission_only_memoizes_successful_runs(tmp_path, monkeypatch, exit_code, recorded):
+    monkeypatch.setattr(result_memo, "MEMO_DIR", str(tmp_path / "memo"))
+    monkeypatch.setattr(truth_cache, "CACHE_DIR", str(tmp_path / "cache"))
+    output_path = tmp_path / "output"
+    input_path = tmp_path / "input"
+    output_path.mkdir()
+    input_path.mkdir()
+    (input_path / "data.csv").write_text("1,2\n")
+
+    # The container leaves a predictions file, whatever its exit code
+    def monitor_container(container, timeout, poll_interval):
+        (output_path / "predictions.csv").write_text("prediction\n1\n")
+        return ""
+
+    monkeypatch.setattr(run_docker, "monitor_container", monitor_container)
+    volumes = {
+        str(output_path): {"bind": "/output", "mode": "rw"},
+        str(input_path): {"bind": "/input", "mode": "ro"},
+    }
+    docker_image = "image@sha256:1"
+
+    run_docker.run_submission(
+        FakeClient(FakeContainer(exit_code)),
+        "9741046",
+        docker_image,
+        volumes,
+        container_timeout=1,
+        memoize=True,
+    )
+
+    memo_entry = result_memo.lookup(run_docker.get_run_memo_key(docker_image, volumes))
+    assert (memo_entry is not None) == recorded
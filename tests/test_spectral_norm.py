@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+
+from spectral_norm import spectral_norm
+
+
+@pytest.mark.parametrize("method", ["gram", "power"])
+@pytest.mark.parametrize("shape", [(3, 100), (100, 3), (40, 40)])
+def test_spectral_norm_matches_the_svd(method, shape):
+    a = np.random.default_rng(0).standard_normal(shape)
+
+    np.testing.assert_allclose(spectral_norm(a, method=method), np.linalg.norm(a, 2), rtol=1e-9)
+
+
+@pytest.mark.parametrize("method", ["gram", "power"])
+def test_dividing_by_the_norm_of_zeros_gives_inf(method):
+    with np.errstate(divide="ignore"):
+        ratio = spectral_norm(np.ones((3, 100)), method=method) / spectral_norm(
+            np.zeros((3, 100)), method=method
+        )
+
+    assert isinstance(ratio, np.float64)
+    assert ratio == np.inf
@@ -0,0 +1,103 @@
+import http.server
+import json
+import os
+import threading
+
+import pytest
+import synapseclient
+from synapseclient.core.exceptions import SynapseHTTPError
+
+import synapse_gateway
+
+SUBMISSION = {
+    "id": "9615379",
+    "evaluationId": "9615023",
+    "entityId": "syn123",
+    "versionNumber": 1,
+    "teamId": "3491765",
+}
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    """Answers the Synapse REST calls of the tests."""
+
+    def do_GET(self):
+        if self.path == f"/repo/v1/evaluation/submission/{SUBMISSION['id']}":
+            self.send_json(200, SUBMISSION)
+        else:
+            self.send_json(404, {"reason": f"{self.path} was not found"})
+
+    def send_json(self, code, body):
+        payload = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def gateway(tmp_path):
+    stub = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+    repo_endpoint, auth_endpoint, file_endpoint = synapse_gateway.get_endpoints(
+        f"http://127.0.0.1:{stub.server_address[1]}"
+    )
+    syn = synapseclient.Synapse(
+        repoEndpoint=repo_endpoint,
+        authEndpoint=auth_endpoint,
+        fileHandleEndpoint=file_endpoint,
+        skip_checks=True,
+        cache_root_dir=str(tmp_path / "synapse_cache"),
+    )
+
+    socket_path = str(tmp_path / "synapse_gateway.sock")
+    server = synapse_gateway.GatewayServer(socket_path, syn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield socket_path
+
+    server.shutdown()
+    server.server_close()
+    stub.shutdown()
+    stub.server_close()
+
+
+def test_calls_are_served_through_the_stub(gateway):
+    syn = synapse_gateway.login(socket_path=gateway)
+    assert isinstance(syn, synapse_gateway.GatewaySynapse)
+
+    assert syn.restGET(f"/evaluation/submission/{SUBMISSION['id']}") == SUBMISSION
+    with pytest.raises(SynapseHTTPError):
+        syn.restGET("/userProfile/404")
+    syn.close()
+
+
+def test_gateway_of_another_user_is_refused(gateway, monkeypatch):
+    monkeypatch.setattr(os, "getuid", lambda: os.geteuid() + 1)
+
+    with pytest.raises(PermissionError):
+        synapse_gateway.GatewaySynapse(gateway)
+
+
+def test_messages_rebuild_only_known_types():
+    status = synapseclient.SubmissionStatus(
+        id="9615379", etag="etag", status="SCORED", submissionAnnotations={"score": [0.5]}
+    )
+    message = synapse_gateway.decode(
+        json.loads(json.dumps(synapse_gateway.encode([status, {"__gateway_type__": "x"}])))
+    )
+    assert isinstance(message[0], synapseclient.SubmissionStatus)
+    assert message[0] == status
+    assert message[1] == {"__gateway_type__": "x"}
+
+    with pytest.raises(ValueError):
+        synapse_gateway.decode({"__gateway_type__": "os.system"})
+    with pytest.raises(TypeError):
+        synapse_gateway.encode(object())
+    unknown = synapse_gateway.decode(
+        {"__gateway_type__": "exception", "name": "SystemExit", "args": [1]}
+    )
+    assert isinstance(unknown, synapse_gateway.GatewayError)
@@ -0,0 +1,20 @@
+import numpy as np
+
+import truth_cache
+
+
+def test_truth_stats_are_computed_again_by_other_code(tmp_path, monkeypatch):
+    monkeypatch.setattr(truth_cache, "CACHE_DIR", str(tmp_path / "cache"))
+    truth_path = tmp_path / "X1test.npy"
+    np.save(truth_path, np.ones((3, 4)))
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {"norm": np.float64(len(calls))}
+
+    for code_version in ["a", "a", "b"]:
+        truth_cache.clear_memory()
+        truth_cache.get_truth_stats(str(truth_path), "stats", {}, compute, code_version=code_version)
+
+    assert len(calls) == 2
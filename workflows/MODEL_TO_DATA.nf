@@ -13,7 +13,7 @@ params.cpus = "4"
 params.memory = "16.GB"
 // Maximum time (in minutes) to wait for Docker submission container run to complete
 params.container_timeout = "180"
-// Time (in minutes) between status checks during container monitoring
+// Time (in minutes) between progress reports during container monitoring
 params.poll_interval = "1"
 // The challenge task for which the submissions are made
 params.task_number = 1
@@ -29,6 +29,17 @@ params.email_script = "send_email.py"
 params.private_folders = "predictions"
 // Set the maximum size (in KB) of the submitted Docker container's execution log file
 params.log_max_size = "50"
+// Disk budget for the submission images kept on a Docker host (least recently used ones are removed first)
+params.image_cache_size = "100.GB"
+// Maximum size of the submitted Docker container's output directory. The container is stopped once it is exceeded
+params.output_max_size = "20.GB"
+// Maximum compressed and uncompressed sizes, and the platform, of submitted Docker images ("" to not check)
+params.image_max_size = "20.GB"
+params.image_max_uncompressed_size = "50.GB"
+params.image_platform = "linux/amd64"
+// Reuse the outputs of an earlier run of the same image digest on the same input data, instead of running it again.
+// Only useful if RESULT_MEMO and GROUNDTRUTH_CACHE point at folders shared by the RUN_DOCKER tasks
+params.memoize_runs = false
 
 // import modules
 include { CREATE_SUBMISSION_CHANNEL } from '../subworkflows/create_submission_channel.nf'
@@ -65,7 +76,8 @@ workflow MODEL_TO_DATA {
     UPDATE_SUBMISSION_STATUS_BEFORE_RUN(submission_ch, "EVALUATION_IN_PROGRESS")
 
     // Phase 2: Running the Docker submission (runs after Phase 1 data staging)
-    run_docker_outputs = RUN_DOCKER(submission_ch, params.container_timeout, params.poll_interval, SYNAPSE_STAGE_DATA.output, params.cpus, params.memory, params.log_max_size, CREATE_FOLDERS.output, UPDATE_SUBMISSION_STATUS_BEFORE_RUN.output, SEND_EMAIL_BEFORE.output)
+    RUN_DOCKER(submission_ch, params.container_timeout, params.poll_interval, SYNAPSE_STAGE_DATA.output, params.cpus, params.memory, params.log_max_size, CREATE_FOLDERS.output, UPDATE_SUBMISSION_STATUS_BEFORE_RUN.output, SEND_EMAIL_BEFORE.output)
+    run_docker_outputs = RUN_DOCKER.out.predictions
     //// Explicit output handling
     run_docker_submission = run_docker_outputs.map { submission_id, predictions, logs -> submission_id }
     run_docker_files = run_docker_outputs.map { submission_id, predictions, logs -> tuple(predictions, logs) }